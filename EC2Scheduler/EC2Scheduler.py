@@ -1,164 +1,1019 @@
-import cronex
-import boto3
+import calendar
+import hashlib
 import json
+import operator
+import re
+import sys
 import time
 import os
-from datetime import datetime, timedelta
-from botocore.exceptions import ClientError
+import random
+import threading
+import weakref
+from datetime import date, datetime, timedelta, timezone
+from collections import namedtuple
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait
+from types import MappingProxyType
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
 
 # Version
 version = "16102019"
 
-# Declare clients
-region="eu-central-1"
-ec2_client = boto3.client("ec2", region_name=region)
-asg_client = boto3.client("autoscaling", region_name=region)
+def envNumber(name, default, cast=int, minimum=0):
+    """
+    Return validated number from env variable. Configuration is read once on module load,
+    wrong value stops lambda before first invocation.
+
+    @param name - env variable name
+    @param default - string value when variable is not set
+    @param cast - int or float
+    @param minimum - lowest allowed value
+    @return number
+    """
+    value = os.environ.get(name, default)
+    try:
+        number = cast(value)
+    except ValueError:
+        raise ValueError("Env variable %s must be %s, got %s" % (name, cast.__name__, value))
+    if number < minimum:
+        raise ValueError("Env variable %s must be at least %s, got %s" % (name, minimum, value))
+    return number
+
+def envZones(name, value):
+    """
+    Check timezone names from env variable - unknown zone stops lambda on module load instead of
+    turning every schedule into wrong schedule. zoneinfo is imported only when some zone is set.
+
+    @param name - env variable name
+    @param value - list of zone names
+    @return list of zone names
+    """
+    if not value:
+        return value
+    from zoneinfo import ZoneInfo
+    for zone in value:
+        try:
+            ZoneInfo(zone)
+        except (KeyError, ValueError):
+            raise ValueError("Env variable %s has unknown timezone %s" % (name, zone))
+    return value
+
+def envAccountZones(name):
+    """
+    Return account timezones from env variable "<account ID>=<zone>,..."
+
+    @param name - env variable name
+    @return dict account ID -> zone name
+    """
+    zones = {}
+    for item in os.environ.get(name, "").split(","):
+        if not item.strip():
+            continue
+        account, separator, zone = (part.strip() for part in item.partition("="))
+        if not separator or not account.isdigit() or not zone:
+            raise ValueError("Env variable %s must be <account>=<zone>,..., got %s" % (name, item))
+        zones[account] = zone
+    envZones(name, list(zones.values()))
+    return zones
+
+# Declare regions - comma separated list in "regions" env variable, when not set all enabled regions are used
+defaultRegion = os.environ.get("AWS_REGION", "eu-central-1")
+regionsEnv = os.environ.get("regions", "")
+regionConcurrency = envNumber("regionConcurrency", "8", minimum=1)
+
+# Declare accounts - comma separated list of role ARNs in "roleArns" env variable or in lambda event
+roleArnsEnv = os.environ.get("roleArns", "")
+accountConcurrency = envNumber("accountConcurrency", "10", minimum=1)
+accountTimeout = envNumber("accountTimeout", "600", minimum=1)
+
+# Declare start/stop executor - instances per API call and number of parallel calls
+actionChunkSize = envNumber("actionChunkSize", "100", minimum=1)
+actionConcurrency = envNumber("actionConcurrency", "4", minimum=1)
+
+# Declare staggered start - instances per wave (0 - all at once), seconds between waves,
+# number of later waves for instance failing on capacity or throttling
+waveSize = envNumber("waveSize", "0")
+waveDelay = envNumber("waveDelay", "10", float)
+waveRetries = envNumber("waveRetries", "3")
+capacityCodes = ["InsufficientInstanceCapacity", "InsufficientHostCapacity", "InsufficientReservedInstanceCapacity",
+    "InsufficientCapacity"]
+# Start/stop errors caused by single instance of call (code prefixes) - only such call is split to isolate
+# the instance, other errors (permissions, parameters) fail all instances of call
+instanceCodes = ["IncorrectInstanceState", "InvalidInstanceID.", "UnsupportedOperation", "IncorrectState"]
+# Start priority of resources without RUN:PRIORITY tag, lower starts first
+defaultPriority = 100
+
+# Declare autoscaling executor - number of groups updated in parallel
+asgConcurrency = envNumber("asgConcurrency", "8", minimum=1)
+
+# Declare API call layer - requests per second for each API family, attempts on throttling
+apiRates = {
+    "describe": envNumber("describeRate", "20", float, 0.1),
+    "tags": envNumber("tagRate", "10", float, 0.1),
+    "mutate": envNumber("mutateRate", "5", float, 0.1)
+}
+apiMaxAttempts = envNumber("apiMaxAttempts", "8", minimum=1)
+apiMaxBackoff = envNumber("apiMaxBackoff", "20", float)
+throttleCodes = ["Throttling", "ThrottlingException", "RequestLimitExceeded", "RequestThrottled",
+    "RequestThrottledException", "TooManyRequestsException", "SlowDown"]
+# Transient server errors are repeated same way as throttling, botocore doesn't retry (one retry layer)
+transientCodes = ["InternalError", "InternalFailure", "ServiceUnavailable", "Unavailable", "RequestTimeout",
+    "RequestTimeoutException", "PriorRequestNotComplete"]
+rateLimiters = weakref.WeakKeyDictionary()
+rateLimitersLock = threading.Lock()
+metricsNamespace = os.environ.get("metricsNamespace", "EC2Scheduler")
+credentialsCache = {}
+credentialsLock = threading.Lock()
+
+# Sessions and clients are created on first use and reused by warm lambda
+defaultSession = {}
+clientCache = weakref.WeakKeyDictionary()
+# boto3 session is not thread safe during client creation
+clientLock = threading.Lock()
+
+# Declare state store - "<type>://<path>" in "stateStore" env variable (file:///tmp/state.json, sqlite:///tmp/state.db).
+# When set, inventory is cached between runs, EventBridge events update it and full scan runs every reconcileInterval minutes
+stateStoreEnv = os.environ.get("stateStore", "")
+reconcileInterval = envNumber("reconcileInterval", "60")
+stateStore = {}
+stateStoreLock = threading.Lock()
+# EventBridge sources handled by incremental mode
+eventSources = ["aws.ec2", "aws.tag", "aws.autoscaling"]
+
+# Session factory and clock - replaceable by local AWS stand-in and fixed time in benchmarks
+sessionFactory = None
+clock = datetime.now
 
 # Declare Vars
-startEC2List = []
-stopEC2List = []
-startAsgList = []
-stopAsgList = []
-asgScaleDown = []
-asgScaleUp = []
-secureScanDay = str(os.environ["secureScanDay"])
-secureScanStartTime = str(os.environ["secureScanStartTime"])
-secureScanDuration = str(os.environ["secureScanDuration"])
+secureScanDay = os.environ.get("secureScanDay", "1").strip()
+secureScanStartTime = str(envNumber("secureScanStartTime", "0"))
+secureScanDuration = str(envNumber("secureScanDuration", "0"))
 try:
     debugEnv = str(os.environ["debug"])
 except:
     debugEnv = "False"
-tagList=["RUN:DAYS", "RUN:HOURS", "RUN:CONTROL", "MANUAL", "OFFPEAK","NUM_INST", "SecureScanState"]
-asgKeys=["AutoScalingGroupName", "Tags", "Instances", "DesiredCapacity", "MaxSize", "MinSize", "SuspendedProcesses"] 
-ec2Keys=["InstanceId", "State", "Tags"]
+dryRunEnv = os.environ.get("dryRun", "False")
+# Log records kept in memory before bulk write to stdout
+logBufferSize = envNumber("logBufferSize", "1000", minimum=1)
+# Profiling of invocation - "profile" env variable with modes (cprofile,tracemalloc,spans), empty - disabled.
+# Results are written to local directory (file:///tmp/profile) or S3 (s3://bucket/prefix)
+profileModes = ["cprofile", "tracemalloc", "spans"]
+profileEnv = os.environ.get("profile", "")
+profileSinkEnv = os.environ.get("profileSink", "file:///tmp/ec2scheduler-profile")
+profileTop = envNumber("profileTop", "20", minimum=1)
+profileInterval = envNumber("profileInterval", "0.01", float)
+if profileSinkEnv.partition("://")[0] not in ("file", "s3") and "://" in profileSinkEnv:
+    raise ValueError("Env variable profileSink must be file://<path> or s3://<bucket>/<prefix>, got %s" % (profileSinkEnv))
+dayNames=["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+hoursPattern=re.compile(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$")
+# Names in one describe_auto_scaling_groups call (API maximum)
+asgNameBatch=100
+tagList=["RUN:DAYS", "RUN:HOURS", "RUN:CONTROL", "MANUAL", "OFFPEAK","NUM_INST", "SecureScanState", "RUN:PRIORITY", "RUN:TZ", "OFFPEAK:MODE", "SCALEUP"]
+# SCALEUP tag of autoscaling group - UTC time of scale-up request, removed when group has DesiredCapacity instances InService
+scaleUpFormat = "%Y-%m-%dT%H:%M:%SZ"
+# OFFPEAK:MODE tag of autoscaling group -> warm pool state, capacity above OFFPEAK is kept in warm pool
+# or standby instead of termination. "scale" (default) terminates capacity.
+warmPoolModes = {"warm-stopped": "Stopped", "warm-hibernated": "Hibernated"}
+offpeakModes = ["scale", "standby"] + sorted(warmPoolModes)
+# Instances in one enter_standby/exit_standby call (API maximum)
+standbyBatch = 20
+# Default timezone of schedules without RUN:TZ tag ("Europe/Prague"), empty - local time of process (TZ env variable).
+# "accountTimezones" overrides it per account - "123456789012=America/New_York,210987654321=Asia/Tokyo"
+timezoneEnv = os.environ.get("timezone", "").strip()
+envZones("timezone", [timezoneEnv] if timezoneEnv else [])
+accountTimezones = envAccountZones("accountTimezones")
+
+# Per-invocation snapshot - instances indexed by InstanceId, asgs by AutoScalingGroupName
+Inventory = namedtuple("Inventory", ["instances", "asgs"])
+
+# Reconciler result - actions by instance ID and autoscaling group name, deferred instances in pending/stopping state
+Plan = namedtuple("Plan", ["region", "time", "scanActive", "instances", "asgs", "deferred"])
+
+# Absolute security scan window, end is not included
+ScanWindow = namedtuple("ScanWindow", ["start", "end"])
+
+class RegionRun(object):
+    """
+    Clients and action lists of one region run. Every region gets own instance,
+    so regions can run in parallel without sharing state.
+    """
+    def __init__(self, region, session, now, account=None, dryRun=False, deadline=None):
+        self.region = region
+        self.account = account
+        self.deadline = deadline
+        self.zone = accountZone(account)
+        self.dryRun = dryRun
+        self.plan = None
+        self.session = session
+        self.now = now
+        self.tagBuffer = None
+        self.startEC2List = []
+        self.stopEC2List = []
+        self.startAsgList = []
+        self.stopAsgList = []
+        self.asgScaleDown = []
+        self.asgScaleUp = []
+        self.actionFailures = {}
+        self.asgResults = {}
+        self.waveReport = None
+        self.scanActive = False
+        self.scaleUpSeconds = {}
+        self.scaleUpsPending = []
+        self.scaleUpsDone = []
+
+    @property
+    def ec2_client(self):
+        return getClient(self.session, "ec2", self.region)
+
+    @property
+    def asg_client(self):
+        return getClient(self.session, "autoscaling", self.region)
+
+    @property
+    def tags(self):
+        if self.tagBuffer is None:
+            self.tagBuffer = TagBuffer(self.ec2_client, self.asg_client)
+        return self.tagBuffer
+
+@lru_cache(maxsize=1)
+def getClientConfig():
+    """
+    Return botocore config of all clients - without botocore retries (callAws repeats throttled
+    and transient errors through rate limiter), keep-alive and connection pool large enough
+    for parallel start/stop calls. botocore.config import is deferred to first use.
+
+    @return botocore Config
+    """
+    from botocore.config import Config
+    return Config(
+        retries={"mode": "standard", "max_attempts": 1},
+        tcp_keepalive=True,
+        max_pool_connections=max(10, actionConcurrency + 2, asgConcurrency + 2))
+
+def newSession(**kwargs):
+    """
+    Return new boto3 session (or session from sessionFactory). boto3 import is deferred to first use.
+
+    @param kwargs - credentials of assumed role
+    @return boto3 session
+    """
+    if sessionFactory is not None:
+        return sessionFactory(**kwargs)
+    import boto3
+    return boto3.session.Session(**kwargs)
+
+def getDefaultSession():
+    """
+    Return session of lambda role, reused by warm lambda
+
+    @return boto3 session
+    """
+    with clientLock:
+        if defaultSession.get("factory") is not sessionFactory or "session" not in defaultSession:
+            defaultSession["factory"] = sessionFactory
+            defaultSession["session"] = newSession()
+            defaultSession.pop("account", None)
+        return defaultSession["session"]
+
+def getClient(session, service, region):
+    """
+    Return client for service and region. Clients are cached per session,
+    warm lambda reuses clients and their connection pools.
+
+    @param session - boto3 session
+    @param service - ec2, autoscaling, sts
+    @param region - AWS region name
+    @return boto3 client
+    """
+    with clientLock:
+        clients = clientCache.setdefault(session, {})
+        if (service, region) not in clients:
+            clients[(service, region)] = session.client(service, region_name=region, config=getClientConfig())
+        return clients[(service, region)]
+
+class TokenBucket(object):
+    """
+    Client side rate limiter - rate tokens per second, burst up to capacity
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, wait when bucket is empty
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+def apiFamily(operation):
+    """
+    Return API family of operation (describe, tags, mutate)
+
+    @param operation - boto3 method name
+    @return string
+    """
+    if operation.startswith("describe_"):
+        return "describe"
+    if operation.endswith("_tags"):
+        return "tags"
+    return "mutate"
 
-def listsClear():
+def getRateLimiter(client, operation):
+    """
+    Return token bucket for client and API family of operation
+
+    @param client - boto3 client
+    @param operation - boto3 method name
+    @return TokenBucket
+    """
+    family = apiFamily(operation)
+    with rateLimitersLock:
+        buckets = rateLimiters.setdefault(client, {})
+        if family not in buckets:
+            buckets[family] = TokenBucket(apiRates[family])
+        return buckets[family]
+
+class Metrics(object):
     """
-    Clear list before run because AWS Lambda caching global variables
+    Per invocation instrumentation - AWS calls (count, latency histogram, retries, error codes)
+    and duration of run phases. Emitted as one CloudWatch Embedded Metric Format record.
     """
-    startEC2List.clear()
-    stopEC2List.clear()
-    startAsgList.clear()
-    stopAsgList.clear()
-    asgScaleDown.clear()
-    asgScaleUp.clear()
+    latencyBuckets = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all values before invocation (lambda keeps globals between invocations)
+        """
+        with self.lock:
+            self.started = time.time()
+            self.api = {}
+            self.phases = {}
+            self.throttles = 0
+            self.scaleUps = {}
+
+    def recordCall(self, operation, latency, retries, errorCode=None):
+        """
+        Record finished AWS call
+
+        @param operation - boto3 method name
+        @param latency - seconds including retries
+        @param retries - number of retries
+        @param errorCode - AWS error code of failed call
+        """
+        latency = latency * 1000
+        with self.lock:
+            item = self.api.setdefault(operation, {"calls": 0, "retries": 0, "latencySum": 0.0,
+                "latencyMax": 0.0, "histogram": [0] * (len(self.latencyBuckets) + 1), "errors": {}})
+            item["calls"] += 1
+            item["retries"] += retries
+            item["latencySum"] += latency
+            item["latencyMax"] = max(item["latencyMax"], latency)
+            item["histogram"][next((i for i, bucket in enumerate(self.latencyBuckets) if latency <= bucket), len(self.latencyBuckets))] += 1
+            if errorCode:
+                item["errors"][errorCode] = item["errors"].get(errorCode, 0) + 1
+
+    def recordScaleUp(self, region, asg, seconds):
+        """
+        Record finished scale-up of autoscaling group
+
+        @param region - AWS region name
+        @param asg - group name
+        @param seconds - from scale-up request until DesiredCapacity instances are InService
+        """
+        with self.lock:
+            self.scaleUps["%s/%s" % (region, asg)] = seconds
+
+    def recordThrottle(self):
+        """
+        Record throttled AWS call
+        """
+        with self.lock:
+            self.throttles += 1
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measure duration of run phase, phases of parallel regions are summed
+
+        @param name - phase name
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = (time.monotonic() - start) * 1000
+            with self.lock:
+                item = self.phases.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+                item["count"] += 1
+                item["sum"] += duration
+                item["max"] = max(item["max"], duration)
+
+    def emit(self):
+        """
+        Return invocation metrics as CloudWatch Embedded Metric Format record
+
+        @return dict
+        """
+        with self.lock:
+            values = {
+                "Duration": ((time.time() - self.started) * 1000, "Milliseconds"),
+                "Throttles": (self.throttles, "Count"),
+                "ApiCalls": (sum(item["calls"] for item in self.api.values()), "Count"),
+                "ApiRetries": (sum(item["retries"] for item in self.api.values()), "Count"),
+                "ApiErrors": (sum(sum(item["errors"].values()) for item in self.api.values()), "Count")
+            }
+            for operation, item in self.api.items():
+                values["%s.Calls" % operation] = (item["calls"], "Count")
+                values["%s.Retries" % operation] = (item["retries"], "Count")
+                values["%s.LatencyAvg" % operation] = (item["latencySum"] / item["calls"], "Milliseconds")
+                values["%s.LatencyMax" % operation] = (item["latencyMax"], "Milliseconds")
+            for name, item in self.phases.items():
+                values["Phase.%s" % name] = (item["sum"], "Milliseconds")
+            if self.scaleUps:
+                values["ScaleUps"] = (len(self.scaleUps), "Count")
+                values["ScaleUpSecondsAvg"] = (sum(self.scaleUps.values()) / len(self.scaleUps), "Seconds")
+                values["ScaleUpSecondsMax"] = (max(self.scaleUps.values()), "Seconds")
+            record = {
+                "_aws": {
+                    "Timestamp": int(self.started * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": metricsNamespace,
+                        "Dimensions": [[]],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (value, unit) in values.items()]
+                    }]
+                },
+                "version": version,
+                "latencyBuckets": self.latencyBuckets,
+                "apiLatencyHistogram": dict((operation, item["histogram"]) for operation, item in self.api.items()),
+                "apiErrors": dict((operation, item["errors"]) for operation, item in self.api.items() if item["errors"]),
+                "phases": dict((name, {"count": item["count"], "sum": round(item["sum"], 1), "max": round(item["max"], 1)})
+                    for name, item in self.phases.items()),
+                "scaleUpSeconds": dict(self.scaleUps)
+            }
+            record.update((name, round(value, 1)) for name, (value, unit) in values.items())
+            return record
+
+metrics = Metrics()
+
+class Log(object):
+    """
+    Buffered leveled log. Records are JSON lines (time, level, message) kept in memory and written
+    to stdout in bulk at the end of invocation or when buffer is full. Message is formatted only
+    when level is enabled, so per-resource DEBUG records cost nothing with "debug" env variable off.
+    """
+    levels = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+    def __init__(self, level, bufferSize):
+        self.lock = threading.Lock()
+        self.level = self.levels[level]
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.reset()
+
+    def reset(self):
+        """
+        Clear record counters before invocation
+        """
+        with self.lock:
+            self.counts = dict((level, 0) for level in self.levels)
+
+    def log(self, level, message, *args):
+        """
+        Add record to buffer, buffer is written when it is full
+
+        @param level - DEBUG, INFO, WARNING, ERROR
+        @param message - message, formatted by % with args
+        @param args - message arguments
+        """
+        with self.lock:
+            self.counts[level] += 1
+        if self.levels[level] < self.level:
+            return
+        self.write({"time": round(time.time(), 3), "level": level, "message": message % args if args else message})
+
+    def debug(self, message, *args):
+        self.log("DEBUG", message, *args)
+
+    def info(self, message, *args):
+        self.log("INFO", message, *args)
+
+    def warning(self, message, *args):
+        self.log("WARNING", message, *args)
+
+    def error(self, message, *args):
+        self.log("ERROR", message, *args)
+
+    def write(self, record):
+        """
+        Add structured record (dict) to buffer without level filtering
+
+        @param record - JSON serializable dict
+        """
+        with self.lock:
+            self.buffer.append(json.dumps(record))
+            full = len(self.buffer) >= self.bufferSize
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered records to stdout in one write
+        """
+        with self.lock:
+            if self.buffer:
+                sys.stdout.write("\n".join(self.buffer) + "\n")
+                sys.stdout.flush()
+                self.buffer = []
+
+log = Log("DEBUG" if debugEnv == "True" else "INFO", logBufferSize)
+
+class Profiler(object):
+    """
+    On-demand profiling of invocation, modes from "profile" env variable:
+    cprofile - cProfile of handler and every region thread (merged),
+    tracemalloc - memory snapshots at boundaries of main(), asgUpdates() and instanceUpdates(),
+    spans - wall-clock sampling of stacks of all threads (collapsed stacks for flame graph).
+    Results go to profileSink, top entries are logged. Without modes every hook returns immediately.
+    """
+    def __init__(self, modes):
+        unknown = set(modes) - set(profileModes)
+        if unknown:
+            raise ValueError("Env variable profile must be list of %s, got %s" % (",".join(profileModes), ",".join(sorted(unknown))))
+        self.modes = frozenset(modes)
+        self.enabled = bool(self.modes)
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start profiling of invocation
+        """
+        if not self.enabled:
+            return
+        self.started = time.time()
+        self.profiles = []
+        self.snapshots = []
+        self.samples = {}
+        if "tracemalloc" in self.modes:
+            import tracemalloc
+            tracemalloc.start()
+        if "spans" in self.modes:
+            self.samplerStop = threading.Event()
+            self.sampler = threading.Thread(target=self.sample, name="profiler", daemon=True)
+            self.sampler.start()
+        if "cprofile" in self.modes:
+            import cProfile
+            self.profileClass = cProfile.Profile
+            self.profiles.append(self.profileClass())
+            self.profiles[0].enable()
+
+    def call(self, function, *args):
+        """
+        Call function in worker thread, profiled by own cProfile in cprofile mode
+        (Python 3.12+ profiles all threads by handler profile, then function is called directly)
+
+        @param function - callable
+        @param args - arguments
+        @return result of function
+        """
+        if "cprofile" not in self.modes:
+            return function(*args)
+        profile = self.profileClass()
+        try:
+            profile.enable()
+        except ValueError:
+            return function(*args)
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def snapshot(self, region, boundary):
+        """
+        Record traced memory and top allocation sites in tracemalloc mode
+
+        @param region - AWS region name
+        @param boundary - name of finished step
+        """
+        if "tracemalloc" not in self.modes:
+            return
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:profileTop]
+        with self.lock:
+            self.snapshots.append({"label": "%s %s" % (region, boundary), "time": round(time.time() - self.started, 3), "current": current, "peak": peak,
+                "top": [{"site": str(item.traceback[0]), "size": item.size, "count": item.count} for item in top]})
+
+    def sample(self):
+        """
+        Sampler thread - count stacks of all threads every profileInterval seconds
+        """
+        own = threading.get_ident()
+        while not self.samplerStop.wait(profileInterval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append("%s:%s" % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def finish(self):
+        """
+        Stop profiling, write results to profileSink and log top entries
+        """
+        if not self.enabled:
+            return
+        files = {}
+        if "cprofile" in self.modes:
+            import marshal, pstats
+            self.profiles[0].disable()
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+            files["cprofile.pstats"] = marshal.dumps(stats.stats)
+            stats.sort_stats("tottime")
+            log.info("Profile top functions (tottime, cumtime, calls): %s", ["%s:%s(%s) %.3f %.3f %s" % (
+                os.path.basename(function[0]), function[1], function[2], stats.stats[function][2], stats.stats[function][3],
+                stats.stats[function][1]) for function in stats.fcn_list[:profileTop]])
+        if "tracemalloc" in self.modes:
+            import tracemalloc
+            tracemalloc.stop()
+            files["tracemalloc.json"] = json.dumps(self.snapshots, indent=1).encode()
+            log.info("Memory at boundaries (current, peak): %s", ["%s %d %d" % (item["label"], item["current"], item["peak"]) for item in self.snapshots])
+        if "spans" in self.modes:
+            self.samplerStop.set()
+            self.sampler.join()
+            files["spans.txt"] = "".join("%s %d\n" % item for item in sorted(self.samples.items())).encode()
+            leaves = {}
+            for stack, count in self.samples.items():
+                leaves[stack.rsplit(";", 1)[-1]] = leaves.get(stack.rsplit(";", 1)[-1], 0) + count
+            log.info("Wall-clock samples by frame (every %s s): %s", profileInterval,
+                sorted(leaves.items(), key=lambda item: -item[1])[:profileTop])
+        prefix = "%s-%03d" % (time.strftime("%Y%m%dT%H%M%S", time.gmtime(self.started)), int(self.started * 1000) % 1000)
+        for name, data in files.items():
+            writeProfile("%s/%s" % (prefix, name), data)
+        log.info("Profile written to %s/%s", profileSinkEnv, prefix)
+
+def writeProfile(name, data):
+    """
+    Write profile file to profileSink - local directory or S3 bucket (s3:PutObject)
+
+    @param name - relative name
+    @param data - bytes
+    """
+    scheme, separator, path = profileSinkEnv.partition("://")
+    if scheme == "s3":
+        bucket, separator, prefix = path.partition("/")
+        callAws(getClient(getDefaultSession(), "s3", defaultRegion), "put_object",
+            Bucket=bucket, Key="/".join(item for item in (prefix.strip("/"), name) if item), Body=data)
+        return
+    target = os.path.join(path if separator else profileSinkEnv, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as outputFile:
+        outputFile.write(data)
+
+profiler = Profiler([item.strip() for item in profileEnv.split(",") if item.strip()])
+
+def callAws(client, operation, **kwargs):
+    """
+    Call AWS API through rate limiter. Throttled calls, transient server errors and connection
+    errors are repeated with exponential backoff and full jitter up to apiMaxAttempts - this is
+    only retry layer, botocore makes single attempt. Other errors are raised to caller.
+    Every call is recorded in metrics.
+
+    @param client - boto3 client
+    @param operation - boto3 method name (describe_instances, ...)
+    @param kwargs - API call parameters
+    @return AWS response as dict
+    """
+    limiter = getRateLimiter(client, operation)
+    attempt = 0
+    start = time.monotonic()
+    while True:
+        limiter.acquire()
+        try:
+            responseDict = getattr(client, operation)(**kwargs)
+            metrics.recordCall(operation, time.monotonic() - start, attempt)
+            return responseDict
+        except ClientError as e:
+            attempt += 1
+            code = e.response['Error']['Code']
+            if code in throttleCodes:
+                metrics.recordThrottle()
+            if code not in throttleCodes + transientCodes or attempt >= apiMaxAttempts:
+                metrics.recordCall(operation, time.monotonic() - start, attempt - 1, code)
+                raise
+        except (BotoConnectionError, HTTPClientError) as e:
+            attempt += 1
+            if attempt >= apiMaxAttempts:
+                metrics.recordCall(operation, time.monotonic() - start, attempt - 1, e.__class__.__name__)
+                raise
+        time.sleep(random.uniform(0, min(apiMaxBackoff, 0.5 * 2 ** attempt)))
+
+def paginateAws(client, operation, **kwargs):
+    """
+    Yield response pages of paginated AWS API, every page goes through callAws
+
+    @param client - boto3 client
+    @param operation - boto3 method name
+    @param kwargs - API call parameters
+    @return generator of AWS responses
+    """
+    while True:
+        responseDict = callAws(client, operation, **kwargs)
+        yield responseDict
+        if not responseDict.get("NextToken"):
+            return
+        kwargs["NextToken"] = responseDict["NextToken"]
+
+def collectInstances(ec2_client, filters):
+    """
+    Yield one record per instance as describe_instances pages arrive. ClientError of any page
+    is raised to caller, truncated inventory would look complete.
+
+    @param ec2_client - ec2 boto3 client
+    @param filters - describe_instances filters
+    @return generator of instance records
+    """
+    for page in paginateAws(ec2_client, "describe_instances", Filters=filters):
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                yield getInstancetData(instance)
+
+def collectAsgs(asg_client, asgNames=None):
+    """
+    Yield one record per autoscaling group as describe_auto_scaling_groups pages arrive.
+    ClientError of any page is raised to caller.
+
+    @param asg_client - asg boto3 client
+    @param asgNames - list of group names (described in batches of asgNameBatch), None for all groups
+    @return generator of autoscaling group records
+    """
+    batches = chunks(asgNames, asgNameBatch) if asgNames is not None else [None]
+    for batch in batches:
+        kwargs = {"AutoScalingGroupNames": batch, "MaxRecords": asgNameBatch} if batch else {}
+        for page in paginateAws(asg_client, "describe_auto_scaling_groups", **kwargs):
+            for asg in page["AutoScalingGroups"]:
+                yield getAsgData(asg)
 
 def getTagedInstances(ec2_client):
     """
-    Return instances with tags in tagList
-    
+    Return instances with tags in tagList. EC2 filters can't exclude tags,
+    so manual and run control instances are skipped by decision, not by AWS.
+
     @param ec2 boto3 client
-    @return AWS response as dict
+    @return generator of instance records
     """
-    try:
-        List=[]
-        responseDict = ec2_client.describe_instances(
-            Filters=[{
-                'Name': 'instance-state-name',
-                'Values': ['stopped', 'running']
-                },
-                {'Name': 'tag-key', 'Values': tagList
-                }]
-        )
-        for instances in responseDict["Reservations"]:
-            List.append(getInstancetData(instances["Instances"]))
-        return List
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    return collectInstances(ec2_client, [{
+        'Name': 'instance-state-name',
+        'Values': ['pending', 'running', 'stopping', 'stopped']
+        },
+        {'Name': 'tag-key', 'Values': tagList
+        }])
 
 def getAllInstances(ec2_client):
     """
     Return all instances in account
 
     @param ec2 boto3 client
-    @return AWS response as dict
+    @return generator of instance records
     """
-    try:
-        List=[]
-        responseDict = ec2_client.describe_instances(
-            Filters=[{
-                'Name': 'instance-state-name',
-                'Values': ['stopped', 'running']
-                }]
-        )
-        for instances in responseDict["Reservations"]:
-            List.append(getInstancetData(instances["Instances"]))
-        return List
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    return collectInstances(ec2_client, [{
+        'Name': 'instance-state-name',
+        'Values': ['pending', 'running', 'stopping', 'stopped']
+        }])
+
+def getTagedAsgNames(asg_client):
+    """
+    Return names of autoscaling groups with tags in tagList, tags are filtered by AWS.
+    ClientError of any page is raised to caller.
+
+    @param asg boto3 client
+    @return list of group names
+    """
+    names = {}
+    for page in paginateAws(asg_client, "describe_tags", Filters=[{'Name': 'key', 'Values': tagList}]):
+        for tag in page["Tags"]:
+            names[tag["ResourceId"]] = True
+    return list(names)
 
 def getTagedAsgs(asg_client):
     """
-    Return autoscaling groups with tags in tagList
+    Return autoscaling groups with tags in tagList - only groups found by describe_tags are described
 
     @param asg boto3 client
-    @return AWS response as dict
+    @return generator of autoscaling group records
     """
-    try:
-        List=[]
-        responseDict = asg_client.describe_auto_scaling_groups()
-        for asg in responseDict["AutoScalingGroups"]:
-            if next((True for item in asg["Tags"] if item["Key"] in tagList),False):
-                List.append(getAsgData(asg))
-        return List
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    names = getTagedAsgNames(asg_client)
+    return collectAsgs(asg_client, names) if names else iter([])
 
 def getAllAsgs(asg_client):
     """
     Return all autoscaling groups in account
 
     @param asg boto3 client
-    @return AWS response as dict
+    @return generator of autoscaling group records
     """
-    try:
-        List=[]
-        responseDict = asg_client.describe_auto_scaling_groups()
-        for asg in responseDict["AutoScalingGroups"]:
-            List.append(getAsgData(asg))
-        return List
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    return collectAsgs(asg_client)
+
+# Tag of record -> slot name
+tagSlots = {"RUN:DAYS": "days", "RUN:HOURS": "hours", "RUN:CONTROL": "control", "MANUAL": "manual",
+    "OFFPEAK": "offpeak", "NUM_INST": "numInst", "SecureScanState": "scanState", "RUN:PRIORITY": "priority", "RUN:TZ": "zone",
+    "OFFPEAK:MODE": "offpeakMode", "SCALEUP": "scaleUp"}
+# Instance state name <-> code (low byte of AWS state code)
+stateCodes = {"pending": 0, "running": 16, "shutting-down": 32, "terminated": 48, "stopping": 64, "stopped": 80}
+stateViews = dict((code, MappingProxyType({"Name": name})) for name, code in stateCodes.items())
+processViews = {}
+
+class ResourceRecord(object):
+    """
+    Compact read-only record of resource - only fields used by scheduler, stored in __slots__.
+    Tag values are interned (many resources share few schedules) and RUN:HOURS/RUN:DAYS
+    are compiled once to shared week bitmap (schedule, None for missing or wrong tags).
+    Record can be read as dict (record["RUN:HOURS"], get, in, iteration over keys).
+    """
+    __slots__ = tuple(tagSlots.values()) + ("schedule",)
+    # key -> function returning value of key from record, None for missing key
+    getters = dict((key, operator.attrgetter(slot)) for key, slot in tagSlots.items())
+
+    def __init__(self, tags):
+        for key, slot in tagSlots.items():
+            value = tags.get(key)
+            setattr(self, slot, None if value is None else sys.intern(str(value)))
+        self.schedule = None
+        if self.hours is not None and self.days is not None:
+            try:
+                self.schedule = compileSchedule(self.hours, self.days)
+            except ValueError:
+                pass
+
+    def __getitem__(self, key):
+        value = self.getters[key](self)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        getter = self.getters.get(key)
+        value = None if getter is None else getter(self)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        getter = self.getters.get(key)
+        return getter is not None and getter(self) is not None
+
+    def __iter__(self):
+        return iter([key for key, getter in self.getters.items() if getter(self) is not None])
+
+    def keys(self):
+        return list(self)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.toDict())
 
-def getInstancetData(DataDict):
+    def toDict(self):
+        """
+        Return record as JSON serializable dict (format of cached inventory)
+
+        @return dict
+        """
+        return dict((key, self[key]) for key in self)
+
+class InstanceRecord(ResourceRecord):
+    """
+    Instance record - ID, state code and scheduler tags
+    """
+    __slots__ = ("InstanceId", "stateCode")
+    getters = dict(ResourceRecord.getters, InstanceId=operator.attrgetter("InstanceId"),
+        State=lambda record: stateViews[record.stateCode])
+
+    def __init__(self, instanceId, state, tags):
+        ResourceRecord.__init__(self, tags)
+        self.InstanceId = instanceId
+        self.stateCode = stateCodes[state]
+
+    def toDict(self):
+        record = ResourceRecord.toDict(self)
+        record["State"] = dict(record["State"])
+        return record
+
+    @classmethod
+    def fromDict(cls, record):
+        """
+        Return record from dict (cached inventory)
+
+        @param record - dict
+        @return InstanceRecord
+        """
+        return cls(record["InstanceId"], record["State"]["Name"], record)
+
+class AsgRecord(ResourceRecord):
+    """
+    Autoscaling group record - name, sizes, suspended processes and scheduler tags.
+    Instances (ID, lifecycle state) are kept only for OFFPEAK:MODE standby and groups with unfinished scale-up (SCALEUP tag).
+    """
+    __slots__ = ("AutoScalingGroupName", "DesiredCapacity", "MaxSize", "MinSize", "suspended", "members")
+    getters = dict(ResourceRecord.getters,
+        SuspendedProcesses=lambda record: [processViews.setdefault(item, MappingProxyType({"ProcessName": item})) for item in record.suspended],
+        Instances=lambda record: [{"InstanceId": instanceId, "LifecycleState": state} for instanceId, state in record.members] or None,
+        **dict((key, operator.attrgetter(key)) for key in ("AutoScalingGroupName", "DesiredCapacity", "MaxSize", "MinSize")))
+
+    def __init__(self, name, desiredCapacity, maxSize, minSize, suspended, tags, instances=()):
+        ResourceRecord.__init__(self, tags)
+        self.AutoScalingGroupName = name
+        self.DesiredCapacity = desiredCapacity
+        self.MaxSize = maxSize
+        self.MinSize = minSize
+        self.suspended = tuple(sys.intern(item) for item in suspended)
+        self.members = tuple((item["InstanceId"], sys.intern(item["LifecycleState"])) for item in instances) if (self.offpeakMode or "").strip().lower() == "standby" or self.scaleUp is not None else ()
+
+    def toDict(self):
+        record = ResourceRecord.toDict(self)
+        record["SuspendedProcesses"] = [{"ProcessName": item} for item in self.suspended]
+        return record
+
+    @classmethod
+    def fromDict(cls, record):
+        """
+        Return record from dict (cached inventory)
+
+        @param record - dict
+        @return AsgRecord
+        """
+        return cls(record["AutoScalingGroupName"], record["DesiredCapacity"], record["MaxSize"], record["MinSize"],
+            [item["ProcessName"] for item in record.get("SuspendedProcesses") or []], record, record.get("Instances") or [])
+
+def getInstancetData(instance):
     """
-    Return instances details
+    Return compact instance record - only fields used by scheduler
 
-    @param DataDict - instances list as a dict
-    @return AWS response as dict
+    @param instance - single instance from describe_instances response
+    @return InstanceRecord
     """
-    Dict={}
-    for instance in DataDict:
-        try:
-            if instance["Tags"] != None:
-                for key in ec2Keys:
-                    Dict[key]=instance[key]
-                for tag in instance["Tags"]:
-                    if tag["Key"] in tagList:
-                        Dict[tag["Key"]]=tag["Value"]
-        except:
-            pass
-    return Dict
+    return InstanceRecord(instance["InstanceId"], instance["State"]["Name"],
+        dict((tag["Key"], tag["Value"]) for tag in instance.get("Tags") or [] if tag["Key"] in tagSlots))
 
 def getAsgData(DataDict):
     """
-    Return autoscaling group details
+    Return compact autoscaling group record - only fields used by scheduler
 
-    @param autoscaling groups list as a dict
-    @return AWS response as dict
+    @param DataDict - single autoscaling group from describe_auto_scaling_groups response
+    @return AsgRecord
+    """
+    return AsgRecord(DataDict["AutoScalingGroupName"], DataDict["DesiredCapacity"], DataDict["MaxSize"], DataDict["MinSize"],
+        [item["ProcessName"] for item in DataDict.get("SuspendedProcesses") or []],
+        dict((tag["Key"], tag["Value"]) for tag in DataDict.get("Tags") or [] if tag["Key"] in tagSlots),
+        DataDict.get("Instances") or [])
+
+def isTaged(resource_dict):
+    """
+    Check if resource has at least one tag from tagList
+
+    @param resource_dict - instance or autoscaling group record
+    @return boolean
+    """
+    return any(key in resource_dict for key in tagList)
+
+def getInventory(ec2_client, asg_client, complete=False):
+    """
+    Build read-only inventory snapshot with single sweep of instances and autoscaling groups.
+    All phases of one run read from this snapshot instead of calling describe_* again.
+    Only resources with scheduler tags are read, security scan needs complete inventory.
+    Failed describe call fails the run of region, partial fleet is never scheduled.
+
+    @param ec2_client - ec2 boto3 client
+    @param asg_client - asg boto3 client
+    @param complete - include resources without scheduler tags
+    @return Inventory
     """
-    Dict={}
-    if DataDict["Tags"] != None:
-        for key in asgKeys:
-            Dict[key]=DataDict[key]
-        for tag in DataDict["Tags"]:
-            if tag["Key"] in tagList:
-                Dict[tag["Key"]]=tag["Value"]
-    return Dict
+    if complete:
+        instances={inst["InstanceId"]: inst for inst in getAllInstances(ec2_client)}
+        asgs={asg["AutoScalingGroupName"]: asg for asg in getAllAsgs(asg_client)}
+    else:
+        instances={inst["InstanceId"]: inst for inst in getTagedInstances(ec2_client)}
+        asgs={asg["AutoScalingGroupName"]: asg for asg in getTagedAsgs(asg_client)}
+    return Inventory(MappingProxyType(instances), MappingProxyType(asgs))
 
 def getInstanceStatus(client, instanceId):
     """
@@ -169,153 +1024,525 @@ def getInstanceStatus(client, instanceId):
     @return instance state string
     """
     try:
-        responseDict = client.describe_instance_status(InstanceIds=[instanceId])
+        responseDict = callAws(client, "describe_instance_status", InstanceIds=[instanceId])
         return responseDict["InstanceStatuses"][0]["InstanceState"]["Name"]
     except ClientError as e:
-        print(e.response['Error']['Code'])
+        log.error("describe_instance_status failed: %s", e.response['Error']['Code'])
         pass
 
-def getPreviousAsgSize(client, asgName):
+def describeInstances(ec2_client, instanceIds):
     """
-    Return previous instances value. After security scan or scale down.
+    Return records of instances by ID - targeted read of changed instances.
+    ClientError is raised to caller, missing instance doesn't mean failed call.
 
-    @param client - asg boto3 client
-    @param asgName - AWS autoscaling group name
-    @return value from asg tag
+    @param ec2_client - ec2 boto3 client
+    @param instanceIds - list of AWS instance IDs
+    @return dict instance ID -> record
     """
-    try:
-        responseDict = client.describe_tags(
-            Filters=[{
-                'Name': 'auto-scaling-group', 
-                'Values': [asgName]
-                }]
-            )
-        return next((item for item in responseDict["Tags"] if item["Key"] == "NUM_INST"),None)
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    records={}
+    # describe_instances filter accepts up to 200 values
+    for chunk in chunks(instanceIds, 200):
+        for page in paginateAws(ec2_client, "describe_instances", Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    records[instance["InstanceId"]]=getInstancetData(instance).toDict()
+    return records
+
+def describeAsgs(asg_client, asgNames):
+    """
+    Return records of autoscaling groups by name - targeted read of changed groups.
+    ClientError is raised to caller.
 
-def getCurrentAsgSize(client, asgName):
+    @param asg_client - asg boto3 client
+    @param asgNames - list of autoscaling group names
+    @return dict group name -> record
     """
-    Return number of running instances in autoscaling group.
-    
-    @param client - asg boto3 client
-    @param asgName - AWS autoscaling group name
-    @return value from asg tag
+    records={}
+    for chunk in chunks(asgNames, asgNameBatch):
+        for page in paginateAws(asg_client, "describe_auto_scaling_groups", AutoScalingGroupNames=chunk, MaxRecords=asgNameBatch):
+            for asg in page["AutoScalingGroups"]:
+                records[asg["AutoScalingGroupName"]]=getAsgData(asg).toDict()
+    return records
+
+class FileStore(object):
     """
-    try:
-        responseDict = client.describe_auto_scaling_groups(AutoScalingGroupNames=[asgName])
-        return responseDict["AutoScalingGroups"][0]["DesiredCapacity"]
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    State store in local JSON file. All keys are in one document, which is replaced
+    atomically on every update. Lock covers threads of one process only.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
 
-def addInstanceTag(client, instanceId, tagName, tagValue):
+    def read(self):
+        try:
+            with open(self.path) as stateFile:
+                return json.load(stateFile)
+        except (IOError, ValueError):
+            return {}
+
+    def load(self, key):
+        """
+        Return value of key or None
+
+        @param key - string
+        @return JSON value
+        """
+        with self.lock:
+            return self.read().get(key)
+
+    def update(self, key, function):
+        """
+        Replace value of key by function(old value). Nothing is written when function returns None.
+
+        @param key - string
+        @param function - callable with old value (or None)
+        @return new value
+        """
+        with self.lock:
+            data = self.read()
+            value = function(data.get(key))
+            if value is not None:
+                data[key] = value
+                tmpPath = "%s.%d.tmp" % (self.path, os.getpid())
+                with open(tmpPath, "w") as stateFile:
+                    json.dump(data, stateFile)
+                os.replace(tmpPath, self.path)
+            return value
+
+class SqliteStore(object):
+    """
+    State store in SQLite database, one row per key. Update runs in immediate transaction,
+    so parallel processes don't overwrite changes of each other. sqlite3 import is deferred to first use.
+    """
+    def __init__(self, path):
+        import sqlite3
+        self.sqlite3 = sqlite3
+        self.path = path
+        with closing(self.connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def connect(self):
+        return self.sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def load(self, key):
+        """
+        Return value of key or None
+
+        @param key - string
+        @return JSON value
+        """
+        with closing(self.connect()) as connection:
+            row = connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, key, function):
+        """
+        Replace value of key by function(old value). Nothing is written when function returns None.
+
+        @param key - string
+        @param function - callable with old value (or None)
+        @return new value
+        """
+        with closing(self.connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+                value = function(json.loads(row[0]) if row else None)
+                if value is not None:
+                    connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return value
+
+class MemoryStore(object):
     """
-    Add instance tag.
+    State store in process memory - for long running daemon, values live until process ends.
+    Values are kept as JSON strings, so loaded values are independent copies as in other stores.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def load(self, key):
+        """
+        Return value of key or None
+
+        @param key - string
+        @return JSON value
+        """
+        with self.lock:
+            value = self.data.get(key)
+        return json.loads(value) if value is not None else None
+
+    def update(self, key, function):
+        """
+        Replace value of key by function(old value). Nothing is written when function returns None.
+
+        @param key - string
+        @param function - callable with old value (or None)
+        @return new value
+        """
+        with self.lock:
+            old = self.data.get(key)
+            value = function(json.loads(old) if old is not None else None)
+            if value is not None:
+                self.data[key] = json.dumps(value)
+            return value
+
+# Store types for "stateStore" env variable, store needs load(key) and update(key, function)
+storeTypes = {"file": FileStore, "sqlite": SqliteStore, "memory": MemoryStore}
+# Version of cached inventory format, cache with other version is replaced by full scan
+cacheVersion = 4
+# Instances started/stopped by scheduler are cached in state they are going to
+settledStates = {"pending": "running", "stopping": "stopped"}
+
+def getStore():
+    """
+    Return state store from "stateStore" env variable, None when variable is not set
 
-    @param client - ec2 boto3 client
-    @param instanceId - AWS instanceID
-    @param tagName - string
-    @param tagValue - string 
+    @return store instance
     """
-    try:
-        client.create_tags(
-            Resources=[
-                instanceId,
-            ],
-            Tags=[{
-                'Key': tagName,
-                'Value': tagValue
-            }]
-        )
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    if not stateStoreEnv:
+        return None
+    with stateStoreLock:
+        if stateStore.get("env") != stateStoreEnv:
+            storeType, separator, path = stateStoreEnv.partition("://")
+            if not separator or storeType not in storeTypes or not path:
+                raise ValueError("Env variable stateStore must be <%s>://<path>, got %s" % ("|".join(sorted(storeTypes)), stateStoreEnv))
+            stateStore["store"] = storeTypes[storeType](path)
+            stateStore["env"] = stateStoreEnv
+        return stateStore["store"]
+
+def cacheKey(account, region):
+    """
+    Return state store key of cached inventory
 
-def delInstanceTag(client, instanceId, tagName):
+    @param account - AWS account ID
+    @param region - AWS region name
+    @return string
     """
-    Delete instance tag.
+    return "inventory/%s/%s" % (account, region)
 
-    @param client - ec2 boto3 client
-    @param instanceId - AWS instanceID
-    @param tagName - string
+def recordHash(record):
     """
-    try:
-        client.delete_tags(
-            Resources=[
-                instanceId,
-            ],
-            Tags=[{
-                'Key': tagName
-            }]
-        )
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    Return 64 bit hash of cached record
 
-def addAsgTag(client, asgName, tagName, tagValue):
+    @param record - instance or autoscaling group record
+    @return int
     """
-    Add tag to autoscaling group.
+    return int(hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()[:16], 16)
 
-    @param client - asg boto3 client
-    @param asgName - AWS autoscaling group name
-    @param tagName - string
-    @param tagValue - string 
+def inventoryFingerprint(instances, asgs):
     """
-    try:
-        client.create_or_update_tags(
-            Tags=[{
-                "ResourceId": asgName,
-                "ResourceType": "auto-scaling-group",
-                "Key": tagName,
-                "Value": str(tagValue),
-                "PropagateAtLaunch": True
-            }]
-        )
-    except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+    Return fingerprint of inventory - XOR of record hashes, so it can be updated
+    for changed records without hashing whole inventory again
+
+    @param instances - dict ID -> record
+    @param asgs - dict name -> record
+    @return hex string
+    """
+    fingerprint=0
+    for records in (instances, asgs):
+        for record in records.values():
+            fingerprint^=recordHash(record)
+    return "%016x" % (fingerprint)
+
+def mergeCache(cache, kind, records):
+    """
+    Merge changed records into cached inventory and update its fingerprint.
+    Record None or terminated instance is removed.
+
+    @param cache - cached inventory or None
+    @param kind - "instances" or "asgs"
+    @param records - dict ID/name -> record or None
+    @return cache or None when there is no cache
+    """
+    if not cache or cache.get("version") != cacheVersion:
+        return None
+    fingerprint=int(cache["fingerprint"], 16)
+    for name, record in records.items():
+        if name in cache[kind]:
+            fingerprint^=recordHash(cache[kind].pop(name))
+        if record is not None and record.get("State", {}).get("Name") != "terminated":
+            cache[kind][name]=record
+            fingerprint^=recordHash(record)
+    cache["fingerprint"]="%016x" % (fingerprint)
+    return cache
+
+def expireCache(cache):
+    """
+    Mark cached inventory for full scan on next run
+
+    @param cache - cached inventory or None
+    @return cache or None
+    """
+    if cache:
+        cache["scanned"]=0
+    return cache
+
+def loadCache(run):
+    """
+    Return cached inventory of region, None without state store or when cache
+    is missing or older than reconcileInterval. Security scan needs cache of complete scan.
+
+    @param run - RegionRun
+    @return dict or None
+    """
+    store=getStore()
+    if store is None or run.account is None:
+        return None
+    cache=store.load(cacheKey(run.account, run.region))
+    if (cache and cache.get("version") == cacheVersion and time.time() - cache["scanned"] < reconcileInterval*60
+            and (cache["complete"] or not run.scanActive)):
+        return cache
+    return None
+
+def loadInventory(run, cache):
+    """
+    Return inventory of region from cache. Without cache full scan is done
+    and stored when state store is set. Failed scan raises before anything is stored,
+    so cache and plan always come from complete scan.
+
+    @param run - RegionRun
+    @param cache - dict from loadCache or None
+    @return Inventory
+    """
+    key=cacheKey(run.account, run.region)
+    if cache:
+        log.debug("Inventory of %s from cache, scanned %d s ago", key, time.time() - cache["scanned"])
+        instances={name: InstanceRecord.fromDict(record) for name, record in cache["instances"].items()}
+        asgs={name: AsgRecord.fromDict(record) for name, record in cache["asgs"].items()}
+        return Inventory(MappingProxyType(instances), MappingProxyType(asgs))
+    inventory=getInventory(run.ec2_client, run.asg_client, run.scanActive)
+    store=getStore()
+    if store is None or run.account is None:
+        return inventory
+    log.info("Full scan of %s", key)
+    instances={name: record.toDict() for name, record in inventory.instances.items()}
+    asgs={name: record.toDict() for name, record in inventory.asgs.items()}
+    cache={
+        "version": cacheVersion,
+        "scanned": time.time(),
+        "complete": run.scanActive,
+        "fingerprint": inventoryFingerprint(instances, asgs),
+        "instances": instances,
+        "asgs": asgs
+    }
+    store.update(key, lambda old: cache)
+    return inventory
+
+def planIsCurrent(cache, now):
+    """
+    Check if stored plan of region is still valid - inventory is not changed since plan
+    was made and next schedule or security scan transition is not reached
+
+    @param cache - dict from loadCache or None
+    @param now - datetime of current run
+    @return boolean
+    """
+    plan=(cache or {}).get("plan")
+    return bool(plan) and plan["fingerprint"] == cache["fingerprint"] and now < datetime.strptime(plan["next"], "%Y-%m-%dT%H:%M")
 
-def delAsgTag(client, asgName, tagName):
+def savePlan(run, cache, inventory):
+    """
+    Store next transition with fingerprint of evaluated inventory. Plan is stored only when run
+    made no action on cached inventory - same inventory gives same (empty) decision until next transition.
+    Deferred instances (pending/stopping), failed actions or tags and unfinished scale-ups need next run, so no plan is stored for them.
+
+    @param run - RegionRun
+    @param cache - dict from loadCache or None
+    @param inventory - Inventory of current run
+    @return datetime of next transition or None
     """
-    Delete tag from autoscaling group.
+    if not cache or run.startEC2List or run.stopEC2List or run.startAsgList or run.stopAsgList or run.asgScaleUp or run.asgScaleDown or run.scaleUpsDone:
+        return None
+    if run.plan.deferred or run.actionFailures or run.tags.failed or run.scaleUpsPending:
+        log.debug("Region %s - plan not stored, %s deferred, %s failed actions, %s failed tags, %s unfinished scale-ups", run.region,
+            len(run.plan.deferred), len(run.actionFailures), len(run.tags.failed), len(run.scaleUpsPending))
+        return None
+    nextTime=nextTransition(inventory, run.now, run.zone)
+    plan={"next": nextTime.strftime("%Y-%m-%dT%H:%M"), "fingerprint": cache["fingerprint"]}
+
+    def storePlan(current):
+        if not current or current.get("fingerprint") != plan["fingerprint"]:
+            return None
+        current["plan"]=plan
+        return current
+
+    getStore().update(cacheKey(run.account, run.region), storePlan)
+    return nextTime
+
+def refreshCache(run):
+    """
+    Read again resources changed by this run and merge them into cached inventory,
+    so read volume follows number of actions, not fleet size. Started and stopped instances
+    are stored in final state, deferred instances in observed state, so next run sees them settled.
+    When read fails, cache is expired and next run does full scan.
 
-    @param client - asg boto3 client
-    @param asgName - AWS autoscaling group name
-    @param tagName - string
+    @param run - RegionRun
     """
+    store=getStore()
+    if store is None or run.account is None:
+        return
+    instanceIds=sorted(set(run.startEC2List + run.stopEC2List + list(run.plan.deferred)))
+    asgNames=sorted(set(run.startAsgList + run.stopAsgList + run.asgScaleUp + run.asgScaleDown + run.scaleUpsDone))
+    if not instanceIds and not asgNames:
+        return
+    key=cacheKey(run.account, run.region)
     try:
-        client.delete_tags(
-            Tags=[{
-                "ResourceId": asgName,
-                "ResourceType": "auto-scaling-group",
-                "Key": tagName
-            }]
-        )
+        instances=describeInstances(run.ec2_client, instanceIds) if instanceIds else {}
+        asgs=describeAsgs(run.asg_client, asgNames) if asgNames else {}
     except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+        log.error("Cache refresh of %s failed: %s", key, e.response['Error']['Code'])
+        store.update(key, expireCache)
+        return
+    for instanceId, record in instances.items():
+        if instanceId not in run.actionFailures and instanceId not in run.plan.deferred and record["State"]["Name"] in settledStates:
+            record["State"]={"Name": settledStates[record["State"]["Name"]]}
+    store.update(key, lambda cache: mergeCache(mergeCache(cache, "instances",
+        dict((instanceId, instances.get(instanceId)) for instanceId in instanceIds)),
+        "asgs", dict((asg, asgs.get(asg)) for asg in asgNames)))
+
+def chunks(items, size):
+    """
+    Split list to chunks with maximal size
 
-def getOffpeakValue(client, asgName):
+    @param items - list
+    @param size - maximal chunk size
+    @return generator of lists
     """
-    Return value offpeak configuration from asg
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
 
-    @param client - asg boto3 client
-    @param asgName - AWS autoscaling group name
-    @return value from asg tag
+def bisectCall(function, items, splitCodes):
+    """
+    Call function with list of items. When call fails with error of single item (code starts
+    with one of splitCodes), list is split in half and both halves are called again until failing
+    items are isolated. Other errors apply to whole call and fail all items without more calls.
+
+    @param function - callable with list argument
+    @param items - list
+    @param splitCodes - list of error code prefixes caused by single item
+    @return dict failed item -> error code
     """
     try:
-        responseDict = client.describe_tags(
-            Filters=[{
-                'Name': 'auto-scaling-group', 
-                'Values': [asgName]
-                }]
-            )
-        return next((item for item in responseDict["Tags"] if item["Key"] == "OFFPEAK"),None)
+        function(items)
+        return {}
     except ClientError as e:
-        print(e.response['Error']['Code'])
-        pass
+        code = e.response['Error']['Code']
+        if len(items) == 1 or not code.startswith(tuple(splitCodes)):
+            return dict((item, code) for item in items)
+        failed = bisectCall(function, items[:len(items)//2], splitCodes)
+        failed.update(bisectCall(function, items[len(items)//2:], splitCodes))
+        return failed
+
+class TagBuffer(object):
+    """
+    Collect tag changes of one run and write them with as few bulk calls as possible.
+    EC2 tags are grouped by same key and value (create_tags/delete_tags accept many resources),
+    ASG tags are sent in batches (create_or_update_tags/delete_tags accept many tags). ASG tags of scheduler
+    (NUM_INST, SCALEUP) are bookkeeping of group, they are not propagated to launched instances.
+    Failures are reported per resource in failed dict. Failing call is split only on error of single
+    resource (missing instance or group), other errors (permissions) fail all resources of call.
+    """
+    ec2ChunkSize = 1000
+    asgChunkSize = 50
+    ec2SplitCodes = ["InvalidInstanceID.", "InvalidID"]
+    asgSplitCodes = ["ValidationError", "LimitExceeded"]
+
+    def __init__(self, ec2_client, asg_client):
+        self.ec2_client = ec2_client
+        self.asg_client = asg_client
+        self.ec2Create = {}
+        self.ec2Delete = {}
+        self.asgCreate = {}
+        self.asgDelete = {}
+        self.failed = {}
+
+    def addInstanceTag(self, instanceId, tagName, tagValue):
+        """
+        Add instance tag.
+
+        @param instanceId - AWS instanceID
+        @param tagName - string
+        @param tagValue - string
+        """
+        self.ec2Create.setdefault((tagName, str(tagValue)), []).append(instanceId)
+
+    def delInstanceTag(self, instanceId, tagName):
+        """
+        Delete instance tag.
+
+        @param instanceId - AWS instanceID
+        @param tagName - string
+        """
+        self.ec2Delete.setdefault(tagName, []).append(instanceId)
+
+    def addAsgTag(self, asgName, tagName, tagValue):
+        """
+        Add tag to autoscaling group.
+
+        @param asgName - AWS autoscaling group name
+        @param tagName - string
+        @param tagValue - string
+        """
+        self.asgCreate[(asgName, tagName)] = str(tagValue)
+
+    def delAsgTag(self, asgName, tagName):
+        """
+        Delete tag from autoscaling group.
+
+        @param asgName - AWS autoscaling group name
+        @param tagName - string
+        """
+        self.asgDelete[(asgName, tagName)] = None
+
+    def flush(self):
+        """
+        Write all buffered tag changes and clear buffer
+
+        @return dict failed resource -> error code for this flush
+        """
+        failed = {}
+        for (tagName, tagValue), resources in self.ec2Create.items():
+            for chunk in chunks(resources, self.ec2ChunkSize):
+                failed.update(bisectCall(lambda items: callAws(self.ec2_client, "create_tags",
+                    Resources=items,
+                    Tags=[{'Key': tagName, 'Value': tagValue}]), chunk, self.ec2SplitCodes))
+        for tagName, resources in self.ec2Delete.items():
+            for chunk in chunks(resources, self.ec2ChunkSize):
+                failed.update(bisectCall(lambda items: callAws(self.ec2_client, "delete_tags",
+                    Resources=items,
+                    Tags=[{'Key': tagName}]), chunk, self.ec2SplitCodes))
+        for chunk in chunks(list(self.asgCreate.items()), self.asgChunkSize):
+            for ((asgName, tagName), tagValue), code in bisectCall(lambda items: callAws(self.asg_client, "create_or_update_tags",
+                    Tags=[{
+                        "ResourceId": asgName,
+                        "ResourceType": "auto-scaling-group",
+                        "Key": tagName,
+                        "Value": tagValue,
+                        "PropagateAtLaunch": False
+                    } for (asgName, tagName), tagValue in items]), chunk, self.asgSplitCodes).items():
+                failed[asgName] = code
+        for chunk in chunks(list(self.asgDelete), self.asgChunkSize):
+            for (asgName, tagName), code in bisectCall(lambda items: callAws(self.asg_client, "delete_tags",
+                    Tags=[{
+                        "ResourceId": asgName,
+                        "ResourceType": "auto-scaling-group",
+                        "Key": tagName
+                    } for asgName, tagName in items]), chunk, self.asgSplitCodes).items():
+                failed[asgName] = code
+        self.ec2Create.clear()
+        self.ec2Delete.clear()
+        self.asgCreate.clear()
+        self.asgDelete.clear()
+        for resource, code in failed.items():
+            log.warning("Tag update failed for %s: %s", resource, code)
+        self.failed.update(failed)
+        return failed
 
 def isManual(resource_dict):
     """
@@ -329,10 +1556,10 @@ def isManual(resource_dict):
             return True
     except KeyError:
         try:
-            print("Instance %s haven't tags for scheduling" % resource_dict['InstanceId'])
+            log.debug("Instance %s haven't tags for scheduling", resource_dict['InstanceId'])
             return "MissingTag"
         except KeyError:
-            print("Asg %s haven't tags for scheduling" % resource_dict['AutoScalingGroupName'])
+            log.debug("Asg %s haven't tags for scheduling", resource_dict['AutoScalingGroupName'])
     else:
         return False
 
@@ -348,60 +1575,181 @@ def runControl(resource_dict):
     else:
         return False
 
-def activeNow(resource_dict):
+@lru_cache(maxsize=1024)
+def compileHours(hoursTag):
     """
-    Check RUN:HOURS tag if instance can run now.
+    Compile RUN:HOURS tag to bitmap of active minutes in day (bit 0 = 00:00, bit 1439 = 23:59)
 
     time record examples:
     01:00-20:00 (run from 1AM to 8PM)
     06:00-17:00 (run from 6AM to 5PM)
     06:00-01:00 (run from 6AM to 1AM next day)
 
-    @param dict
-    @return boolean
+    @param hoursTag - string
+    @return int bitmap
     """
-    try:
-        nowTimestamp = int(datetime.now().strftime("%H"))*60+int(datetime.now().strftime("%M"))
-        hoursActive = resource_dict["RUN:HOURS"].split("-")
-        startTimestamp=int(hoursActive[0].split(":")[0])*60+int(hoursActive[0].split(":")[1])
-        stopTimestamp=int(hoursActive[1].split(":")[0])*60+int(hoursActive[1].split(":")[1])
-        if stopTimestamp < startTimestamp:
-            if nowTimestamp in range(0, stopTimestamp) or nowTimestamp in range(startTimestamp, 23*60+59):
-                return True
-        if nowTimestamp in range(startTimestamp, stopTimestamp):
-            return True
-    except KeyError:
-        print("Instance %s haven't tags for scheduling" % resource_dict['InstanceId'])
-        return False
-    except (ValueError, IndexError):
-        try:
-            print("Wrong time set in instance %s" % resource_dict['InstanceId'])
-        except KeyError:
-            print("Wrong time set in asg %s" % resource_dict['AutoScalingGroupName'])
-    else:
-        return False
-    
-def activeToday(resource_dict):
+    match = hoursPattern.match(hoursTag.strip())
+    if not match:
+        raise ValueError("Wrong time format %s" % (hoursTag))
+    startHour, startMinute, stopHour, stopMinute = (int(item) for item in match.groups())
+    if startHour > 23 or stopHour > 24 or startMinute > 59 or stopMinute > 59 or (stopHour == 24 and stopMinute > 0):
+        raise ValueError("Wrong time %s" % (hoursTag))
+    startTimestamp = startHour*60+startMinute
+    stopTimestamp = stopHour*60+stopMinute
+    if stopTimestamp < startTimestamp:
+        return ((1 << stopTimestamp) - 1) | (((1 << (24*60 - startTimestamp)) - 1) << startTimestamp)
+    return ((1 << (stopTimestamp - startTimestamp)) - 1) << startTimestamp
+
+@lru_cache(maxsize=1024)
+def compileDays(daysTag):
     """
-    Check RUN:DAYS tag if instance or asg can run today
+    Compile RUN:DAYS tag to bitmap of active days (bit 0 = MON, bit 6 = SUN)
 
     List of instance working days 
     [MON,TUE,WED,THU,FRI,SAT,SUN]
 
-    @param dict
-    @return boolean
+    @param daysTag - string
+    @return int bitmap
+    """
+    bitmap = 0
+    for day in daysTag.strip().strip("[]").replace(" ", ",").upper().split(","):
+        if not day:
+            continue
+        if day not in dayNames:
+            raise ValueError("Wrong day %s" % (day))
+        bitmap |= 1 << dayNames.index(day)
+    return bitmap
+
+@lru_cache(maxsize=1024)
+def compileSchedule(hoursTag, daysTag):
+    """
+    Compile RUN:HOURS and RUN:DAYS tags to week bitmap with minute resolution
+    (bit = weekday*1440 + minute of day). Compiled once for each distinct pair of tags.
+
+    @param hoursTag - string
+    @param daysTag - string
+    @return int bitmap
+    """
+    hours = compileHours(hoursTag)
+    days = compileDays(daysTag)
+    return sum(hours << (day*24*60) for day in range(7) if days >> day & 1)
+
+@lru_cache(maxsize=1024)
+def transitionBitmap(bitmap):
+    """
+    Return week bitmap of minutes when schedule switches on or off (state differs from previous minute)
+
+    @param bitmap - int from compileSchedule
+    @return int bitmap
+    """
+    minutes = 7*24*60
+    previous = ((bitmap << 1) | (bitmap >> (minutes - 1))) & ((1 << minutes) - 1)
+    return bitmap ^ previous
+
+def minuteOfWeek(now):
+    """
+    Return index of minute in week for week bitmap
+
+    @param now - datetime
+    @return int
+    """
+    return now.weekday()*24*60 + now.hour*60 + now.minute
+
+def accountZone(account):
+    """
+    Return default timezone of schedules in account, None for local time
+
+    @param account - AWS account ID or None
+    @return zone name or None
+    """
+    return accountTimezones.get(account) or timezoneEnv or None
+
+@lru_cache(maxsize=16)
+def utcWeek(now):
+    """
+    Return start of UTC week and index of minute in UTC week for time of run (local time of process)
+
+    @param now - datetime of current run
+    @return tuple (datetime of monday 00:00 UTC, int)
+    """
+    utc = now.astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime(utc.year, utc.month, utc.day) - timedelta(days=utc.weekday()), minuteOfWeek(utc)
+
+@lru_cache(maxsize=256)
+def zoneOffsets(zone, weekStart):
+    """
+    Return UTC offsets of zone during UTC week - DST transitions of week are found by checking
+    offset every 15 minutes. zoneinfo import is deferred to first zone.
+
+    @param zone - IANA zone name
+    @param weekStart - datetime of monday 00:00 UTC
+    @return tuple of (first minute of week, offset in minutes)
     """
-    nowDay = datetime.today().strftime("%a").upper()
+    from zoneinfo import ZoneInfo
     try:
-        if nowDay in resource_dict["RUN:DAYS"]:
-            return True
+        tzinfo = ZoneInfo(zone)
+    except (KeyError, ValueError):
+        raise ValueError("Wrong timezone %s" % (zone))
+    start = weekStart.replace(tzinfo=timezone.utc)
+    segments = []
+    for minute in range(0, 7*24*60, 15):
+        offset = int((start + timedelta(minutes=minute)).astimezone(tzinfo).utcoffset().total_seconds() // 60)
+        if not segments or segments[-1][1] != offset:
+            segments.append((minute, offset))
+    return tuple(segments)
+
+@lru_cache(maxsize=1024)
+def zoneSchedule(bitmap, zone, weekStart):
+    """
+    Convert week bitmap in local time of zone to bitmap of UTC week (bit = minute from monday 00:00 UTC).
+    Compiled once for each schedule and zone in week, resources are then evaluated by UTC minute of run.
+
+    @param bitmap - int from compileSchedule
+    @param zone - IANA zone name
+    @param weekStart - datetime of monday 00:00 UTC
+    @return int bitmap
+    """
+    minutes = 7*24*60
+    mask = (1 << minutes) - 1
+    segments = zoneOffsets(zone, weekStart)
+    result = 0
+    for index, (first, offset) in enumerate(segments):
+        last = segments[index + 1][0] if index + 1 < len(segments) else minutes
+        shift = offset % minutes
+        rotated = ((bitmap >> shift) | (bitmap << (minutes - shift))) & mask
+        result |= rotated & (((1 << (last - first)) - 1) << first)
+    return result
+
+def isScheduled(resource_dict, now, zone=None):
+    """
+    Check RUN:DAYS and RUN:HOURS tags if instance or asg can run now.
+    Schedule is in timezone from RUN:TZ tag, default zone or local time.
+
+    @param resource_dict - instance or asg record
+    @param now - datetime of current run, same for all resources
+    @param zone - default timezone of account, None for local time
+    @return boolean, None for wrong tags
+    """
+    zone = resource_dict.get("RUN:TZ") or zone
+    try:
+        schedule = getattr(resource_dict, "schedule", None)
+        if schedule is None:
+            schedule = compileSchedule(resource_dict["RUN:HOURS"], resource_dict["RUN:DAYS"])
+        if zone:
+            weekStart, minute = utcWeek(now)
+            return zoneSchedule(schedule, zone, weekStart) >> minute & 1 == 1
+        return schedule >> minuteOfWeek(now) & 1 == 1
     except KeyError:
         try:
-            print("Instance %s haven't tags for scheduling" % resource_dict['InstanceId'])
+            log.debug("Instance %s haven't tags for scheduling", resource_dict['InstanceId'])
         except KeyError:
-            print("Asg %s haven't tags for scheduling" % resource_dict['AutoScalingGroupName'])
-    else:
+            log.debug("Asg %s haven't tags for scheduling", resource_dict['AutoScalingGroupName'])
         return False
+    except ValueError as e:
+        try:
+            log.warning("Wrong schedule set in instance %s: %s", resource_dict['InstanceId'], e)
+        except KeyError:
+            log.warning("Wrong schedule set in asg %s: %s", resource_dict['AutoScalingGroupName'], e)
 
 def offpeak(resource_dict):
     """
@@ -412,327 +1760,1134 @@ def offpeak(resource_dict):
     OFFPEAK = -1 - Affects ASG group with disabling HealtCheck. With this settings u can stop instance in ASG without terminating.
 
     @param dict
-    @return boolean
+    @return boolean, None without tag or with wrong value (group is skipped)
     """
     try:
         if int(resource_dict["OFFPEAK"]) == -1:
             return False
     except KeyError:
         try:
-            print("ASG %s haven't tags for offpeak configuration " % resource_dict['AutoScalingGroupName'])
+            log.debug("ASG %s haven't tags for offpeak configuration ", resource_dict['AutoScalingGroupName'])
         except KeyError:
             return False
+    except ValueError:
+        log.warning("Wrong OFFPEAK %s in %s", resource_dict["OFFPEAK"],
+            resource_dict.get("AutoScalingGroupName") or resource_dict.get("InstanceId"))
+        return None
     else:
         return True
 
-def timeForSS(secureScanDay, secureScanStartTime, secureScanDuration):
+def offpeakMode(asg):
     """
-    Check if is time for security scan - inputs scanDay, start hour and ruration in hours
-    Append to list cron check_trigger result (True/False)
-    Returning True if one of results is True
+    Return off-peak strategy of autoscaling group from OFFPEAK:MODE tag, unknown value is reported and scale is used
 
-    @param secureScanDay - str (num day 1-31 or day in week 0#1-6#5)
-    @param secureScanDuration - str
-    @param secureScanStartTime - str
-    @return boolean
+    @param asg - autoscaling group record
+    @return "scale", "standby", "warm-stopped" or "warm-hibernated"
+    """
+    mode=asg.get("OFFPEAK:MODE", "scale").strip().lower()
+    if mode not in offpeakModes:
+        log.warning("Wrong OFFPEAK:MODE %s in asg %s", asg["OFFPEAK:MODE"], asg["AutoScalingGroupName"])
+        return "scale"
+    return mode
 
+def scanDay(year, month, secureScanDay):
+    """
+    Return date of security scan in month
 
+    @param year - int
+    @param month - int
+    @param secureScanDay - str (num day 1-31 or day in week 0#1-6#5, 0 is sunday)
+    @return date or None when month doesn't include this day
     """
-    resultsList=[]
-    curTime=time.localtime(time.time())[:5]
-    hours=int(secureScanStartTime)+int(secureScanDuration)
-    days=hours//24
-    
-    # Check special run day record (0#1 etc.)
+    daysInMonth = calendar.monthrange(year, month)[1]
     if "#" in secureScanDay:
-        # Check duration of SS
-        if int(secureScanDuration) == 1:
-            resultsList.append(cronex.CronExpression("* "+secureScanStartTime+" * * "+secureScanDay).check_trigger(curTime))
-        elif hours < 24:
-            resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-"+str(int(secureScanStartTime)+int(secureScanDuration))+" * * "+secureScanDay).check_trigger(curTime))
-        else:
-            # Duration is 24 hours
-            if hours == 24:
-                # Check if duration going to next week
-                if int(secureScanDay.split("#")[0])+1 > 6:
-                    nextDay="0#"+int(secureScanDay.split("#")[1])+1
-                else:
-                    nextDay=secureScanDay.split("#")[0]+1+"#"+secureScanDay.split("#")[1]
-                resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-23"+" * * "+secureScanDay).check_trigger(curTime))
-                resultsList.append(cronex.CronExpression("* 0-1 * * "+nextDay).check_trigger(curTime))
-            else:
-                # Duration is 24 to 47 hours
-                if days == 1:
-                    # Check if duration going to next week
-                    if int(secureScanDay.split("#")[0])+1 > 6:
-                        lastDay="0#"+str(int(secureScanDay.split("#")[1])+1)
-                    else:
-                        lastDay=str(int(secureScanDay.split("#")[0])+1)+"#"+secureScanDay.split("#")[1]
-                    resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-23"+" * * "+secureScanDay).check_trigger(curTime))
-                    resultsList.append(cronex.CronExpression("* 0"+str(hours-24)+" * * "+lastDay).check_trigger(curTime)) 
-                else:
-                    # Duration is 48 hours and more
-                    splitDayNumbers=secureScanDay.split("#")
-                    # SS fit in single week
-                    if int(splitDayNumbers[0])+days <= 6:
-                        nextDay=",".join(str(i) for i in range(int(splitDayNumbers[0])+1,int(splitDayNumbers[0])+days))+"#"+splitDayNumbers[1]
-                        lastDay=str(int(splitDayNumbers[0])+days)+"#"+splitDayNumbers[1]
-                        resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-23"+" * * "+secureScanDay).check_trigger(curTime))
-                        resultsList.append(cronex.CronExpression("* 0-23 * * "+nextDay).check_trigger(curTime))
-                        resultsList.append(cronex.CronExpression("* 0-"+str(hours-(24*days))+" * * "+lastDay).check_trigger(curTime))
-                    else:
-                        # SS duration goint to next week
-                        if ((int(splitDayNumbers[0])+days+1)//7) == 1:
-                            if int(splitDayNumbers[0])+1 == 7:
-                                nextWeek=",".join(str(i) for i in range(0,(int(splitDayNumbers[0])+days)-7))+"#"+str(int(splitDayNumbers[1])+1)
-                            else:
-                                nextDay=",".join(str(i) for i in range(int(splitDayNumbers[0])+1,7))+"#"+splitDayNumbers[1]
-                                nextWeek=",".join(str(i) for i in range(0,(int(splitDayNumbers[0])+days)-7))+"#"+str(int(splitDayNumbers[1])+1)
-                                resultsList.append(cronex.CronExpression("* 0-23 * * "+nextDay).check_trigger(curTime))
-                            lastDay=str(int(splitDayNumbers[0])+days-7)+"#"+str(int(splitDayNumbers[1])+1)
-                            resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-23"+" * * "+secureScanDay).check_trigger(curTime))
-                            resultsList.append(cronex.CronExpression("* 0-23 * * "+nextWeek).check_trigger(curTime))
-                            resultsList.append(cronex.CronExpression("* 0-"+str(hours-(24*days))+" * * "+lastDay).check_trigger(curTime))
-                        else:
-                            print("Longer run than week is not implemented")
+        weekDay, nth = (int(item) for item in secureScanDay.split("#"))
+        if weekDay < 0 or weekDay > 7 or nth < 1 or nth > 5:
+            raise ValueError("Wrong secureScanDay %s" % (secureScanDay))
+        # cron day of week (0 = sunday) to python weekday (0 = monday)
+        firstDay = 1 + ((weekDay - 1) % 7 - calendar.weekday(year, month, 1)) % 7
+        day = firstDay + 7*(nth-1)
     else:
-        # Check duration of SS
-        if int(secureScanDuration) == 1:
-            resultsList.append(cronex.CronExpression("* "+secureScanStartTime+" "+secureScanDay+" * *").check_trigger(curTime))
-        elif hours < 24:
-            resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-"+str(int(secureScanStartTime)+int(secureScanDuration))+" "+secureScanDay+" * *").check_trigger(curTime))
+        day = int(secureScanDay)
+        if day < 1 or day > 31:
+            raise ValueError("Wrong secureScanDay %s" % (secureScanDay))
+    if day > daysInMonth:
+        return None
+    return date(year, month, day)
+
+@lru_cache(maxsize=4)
+def getScanWindows(now):
+    """
+    Return absolute security scan windows (start, end) which can include now or follow it -
+    windows of previous, current and next month, so scan can cross month boundary.
+    Computed once per invocation (cached by run time).
+
+    @param now - datetime of current run
+    @return list of ScanWindow
+    """
+    windows=[]
+    try:
+        duration=int(secureScanDuration)
+        startHour=int(secureScanStartTime)
+        if duration <= 0:
+            return windows
+        if startHour < 0 or startHour > 23:
+            raise ValueError("Wrong secureScanStartTime %s" % (secureScanStartTime))
+        for shift in (-1, 0, 1):
+            year, month = divmod(now.year*12 + now.month - 1 + shift, 12)
+            day = scanDay(year, month + 1, secureScanDay)
+            if day:
+                start = datetime(day.year, day.month, day.day, startHour)
+                windows.append(ScanWindow(start, start + timedelta(hours=duration)))
+    except ValueError as e:
+        log.warning("Wrong security scan settings: %s", e)
+    return windows
+
+def validateScanSettings():
+    """
+    Validate security scan env variables on module load
+    """
+    if "#" not in secureScanDay and not secureScanDay.isdigit():
+        raise ValueError("Env variable secureScanDay must be day in month or day of week (0#1), got %s" % (secureScanDay))
+    scanDay(2000, 1, secureScanDay)
+    if int(secureScanStartTime) > 23:
+        raise ValueError("Env variable secureScanStartTime must be hour 0-23, got %s" % (secureScanStartTime))
+
+validateScanSettings()
+
+def timeForSS(now):
+    """
+    Check if is time for security scan - now is inside one of scan windows
+
+    @param now - datetime of current run
+    @return boolean
+    """
+    return next((True for window in getScanWindows(now) if window.start <= now < window.end), False)
+
+def minutesToEdge(edges, current):
+    """
+    Return minutes from current minute to next set bit of week bitmap (wraps to next week)
+
+    @param edges - int bitmap from transitionBitmap
+    @param current - index of current minute in week
+    @return int, 7 days without edges
+    """
+    minutes=7*24*60
+    later=edges >> (current + 1)
+    if later:
+        return (later & -later).bit_length()
+    if edges:
+        return (edges & -edges).bit_length() + minutes - current - 1
+    return minutes
+
+def nextTransition(inventory, now, zone=None):
+    """
+    Return earliest time after now when any schedule of inventory switches on or off,
+    or security scan window starts or ends. Without transitions return now + 7 days.
+    Schedules with timezone are compiled for current UTC week, so time is limited to end of that week.
+
+    @param inventory - Inventory
+    @param now - datetime of current run
+    @param zone - default timezone of account, None for local time
+    @return datetime (minute resolution)
+    """
+    minutes=7*24*60
+    start=now.replace(second=0, microsecond=0)
+    localEdges=0
+    utcEdges=None
+    for schedule, itemZone in set((item.schedule, item.zone or zone) for records in (inventory.instances, inventory.asgs) for item in records.values()):
+        if schedule is None:
+            continue
+        if not itemZone:
+            localEdges|=transitionBitmap(schedule)
+            continue
+        weekStart, current=utcWeek(start)
+        try:
+            utcEdges=(utcEdges or 0) | transitionBitmap(zoneSchedule(schedule, itemZone, weekStart))
+        except ValueError:
+            continue
+    ahead=minutesToEdge(localEdges, minuteOfWeek(start))
+    if utcEdges is not None:
+        ahead=min(ahead, minutesToEdge(utcEdges, current), minutes - current)
+    nextTime=start + timedelta(minutes=ahead)
+    for window in getScanWindows(now):
+        for edge in (window.start, window.end):
+            if now < edge < nextTime:
+                nextTime=edge
+    return nextTime
+
+def desiredInstance(instance, now, scanActive, zone=None):
+    """
+    Return desired state of instance and tag changes
+
+    - security scan: all instances run, stopped manual instances are marked by SecureScanState tag
+    - after security scan: instances with SecureScanState tag are stopped, tag is removed
+    - otherwise instance follows RUN:DAYS and RUN:HOURS (not with manual, run control or OFFPEAK)
+
+    @param instance - instance record
+    @param now - datetime of current run
+    @param scanActive - security scan is running
+    @param zone - default timezone of account, None for local time
+    @return tuple (desired state "running"/"stopped" or None when scheduler doesn't control instance,
+        dict of tags - value None removes tag)
+    """
+    if scanActive:
+        if instance["State"]["Name"] == "stopped" and isManual(instance):
+            return "running", {"SecureScanState": "stopped"}
+        return "running", {}
+    if "SecureScanState" in instance:
+        log.debug("Stop instance %s after security scan", instance["InstanceId"])
+        return "stopped", {"SecureScanState": None}
+    if not isTaged(instance):
+        return None, {}
+    if isManual(instance) or runControl(instance):
+        log.debug("Instance %s - manual config or run control: enabled", instance["InstanceId"])
+        return None, {}
+    log.debug("Instance %s - manual config: disabled", instance["InstanceId"])
+    activeV=isScheduled(instance, now, zone)
+    if activeV is None or offpeak(instance) is not False:
+        return None, {}
+    return ("running" if activeV else "stopped"), {}
+
+def asgAction(asg, now, scanActive, zone=None):
+    """
+    Compare desired and observed state of autoscaling group and return needed changes
+
+    - security scan: groups with MinSize 0 are scaled to 1
+    - OFFPEAK -1: HealthCheck is suspended out of schedule (instances can be stopped without termination)
+    - OFFPEAK >= 0: out of schedule group is scaled to OFFPEAK, previous size is stored in NUM_INST tag
+      and restored in schedule
+    - OFFPEAK:MODE warm-stopped/warm-hibernated: warm pool is set before scale down, instances removed
+      by scale down are kept in pool and scale up resumes them
+    - OFFPEAK:MODE standby: instances above OFFPEAK enter standby and are stopped, in schedule they are
+      started and leave standby
+
+    @param asg - autoscaling group record
+    @param now - datetime of current run
+    @param scanActive - security scan is running
+    @param zone - default timezone of account, None for local time
+    @return dict - healthCheck ("resume"/"suspend"), size (new MinSize and DesiredCapacity),
+        NUM_INST (size stored before scale down, None removes tag), warmPool (put_warm_pool parameters),
+        standby ("enter"/"exit" -> instance IDs)
+    """
+    if scanActive:
+        return {"size": 1} if asg["MinSize"] == 0 else {}
+    if not isTaged(asg):
+        return {}
+    if isManual(asg):
+        log.debug("ASG %s - manual config: enabled", asg["AutoScalingGroupName"])
+        return {}
+    log.debug("ASG %s - manual config: disabled", asg["AutoScalingGroupName"])
+    activeV=isScheduled(asg, now, zone)
+    offpeakV=offpeak(asg)
+    suspended=[item["ProcessName"] for item in asg["SuspendedProcesses"]]
+    if activeV is None:
+        return {}
+    if offpeakV is False:
+        if activeV and "HealthCheck" in suspended:
+            return {"healthCheck": "resume"}
+        if not activeV and "HealthCheck" not in suspended:
+            return {"healthCheck": "suspend"}
+    # Capacity is not changed while any process is suspended
+    elif offpeakV is True and not suspended:
+        offpeakSize=max(int(asg["OFFPEAK"]), 0)
+        try:
+            storedSize=int(asg["NUM_INST"]) if "NUM_INST" in asg else None
+        except ValueError:
+            log.warning("Wrong NUM_INST %s in asg %s", asg["NUM_INST"], asg["AutoScalingGroupName"])
+            return {}
+        mode=offpeakMode(asg)
+        members=asg.get("Instances", []) if mode == "standby" else []
+        if activeV:
+            size=offpeakSize if storedSize is None else storedSize
+            standby=[item["InstanceId"] for item in members if item["LifecycleState"] == "Standby"]
+            if size > asg["MinSize"] or standby:
+                action=dict({"size": max(size, asg["MinSize"])}, **({"NUM_INST": None} if "NUM_INST" in asg else {}))
+                if standby:
+                    action["standby"]={"exit": standby}
+                return action
         else:
-            # Duration is 24 hours
-            if hours == 24:
-                resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-23"+" "+secureScanDay+" * *").check_trigger(curTime))
-                resultsList.append(cronex.CronExpression("* 0-1 "+str(int(secureScanDay)+1)+" * *").check_trigger(curTime))
-            else:
-                # Duration is 24 to 47 hours
-                if days == 1:
-                    resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-23"+" "+secureScanDay+" * *").check_trigger(curTime))
-                    resultsList.append(cronex.CronExpression("* 0-"+str(hours-24)+" "+str(int(secureScanDay)+1)+" * *").check_trigger(curTime)) 
-                else:
-                    # Duration is 48 hours and more
-                    resultsList.append(cronex.CronExpression("* "+secureScanStartTime+"-23"+" "+secureScanDay+" * *").check_trigger(curTime))
-                    resultsList.append(cronex.CronExpression("* 0-23 "+str(int(secureScanDay)+1)+"-"+str(int(secureScanDay)+days-1)+" * *").check_trigger(curTime))
-                    resultsList.append(cronex.CronExpression("* 0-"+str(hours-(24*days))+" "+str(int(secureScanDay)+days)+" * *").check_trigger(curTime))
-
-    if True in resultsList:
-        return True
-    else:
-        return False
+            inService=[item["InstanceId"] for item in members if item["LifecycleState"] == "InService"]
+            if asg["MinSize"] > offpeakSize or len(inService) > offpeakSize:
+                action={"size": offpeakSize, "NUM_INST": storedSize if storedSize is not None else asg["DesiredCapacity"]}
+                if mode in warmPoolModes:
+                    # Pool holds only instances removed by scale down (prepared capacity is size before it),
+                    # after scale up pool is empty and no instances are kept warm in schedule
+                    action["warmPool"]={"PoolState": warmPoolModes[mode], "MinSize": 0,
+                        "MaxGroupPreparedCapacity": max(asg["DesiredCapacity"], asg["MinSize"])}
+                elif len(inService) > offpeakSize:
+                    action["standby"]={"enter": sorted(inService)[offpeakSize:]}
+                return action
+    return {}
+
+def isScaleUp(asg, action):
+    """
+    Check if planned action adds capacity to autoscaling group (size above MinSize or instances leaving standby)
+
+    @param asg - autoscaling group record
+    @param action - dict from asgAction
+    @return boolean
+    """
+    return action.get("size", 0) > asg["MinSize"] or "exit" in action.get("standby", {})
 
-def securityScan(asg_list, instance_list):
+def resourcePriority(resource):
     """
-    Run security scan. Scale up all autoscaling groups. Start all stopped instances. 
+    Return start priority from RUN:PRIORITY tag, lower number starts first
 
-    @param asg_list - list
-    @param instance_list - list
+    @param resource - instance or autoscaling group record
+    @return int
+    """
+    try:
+        return int(resource.get("RUN:PRIORITY", defaultPriority))
+    except ValueError:
+        log.warning("Wrong RUN:PRIORITY %s", resource.get("RUN:PRIORITY"))
+        return defaultPriority
 
+def reconcile(inventory, now, scanActive, region=None, zone=None):
+    """
+    Diff desired and observed state of all resources in inventory. Instances in pending/stopping
+    state count as running/stopped, instance which has to go opposite way is deferred to next run.
+
+    @param inventory - Inventory
+    @param now - datetime of current run
+    @param scanActive - security scan is running
+    @param region - AWS region name (for plan output)
+    @param zone - default timezone of account, None for local time
+    @return Plan
+    """
+    instances, asgs, deferred = {}, {}, {}
+    for instance in inventory.instances.values():
+        desired, tags = desiredInstance(instance, now, scanActive, zone)
+        state=instance["State"]["Name"]
+        action={}
+        if desired and settledStates.get(state, state) != desired:
+            if state in settledStates:
+                deferred[instance["InstanceId"]]="%s, desired %s" % (state, desired)
+                continue
+            if state not in ("running", "stopped"):
+                continue
+            action={"action": "start" if desired == "running" else "stop", "state": state}
+            if desired == "running":
+                action["priority"]=resourcePriority(instance)
+        # SecureScanState is set only with start, removed also from already stopped instance
+        if tags and (action or None in tags.values()):
+            action["tags"]=tags
+        if action:
+            instances[instance["InstanceId"]]=action
+    for asg in inventory.asgs.values():
+        action=asgAction(asg, now, scanActive, zone)
+        if isScaleUp(asg, action):
+            action["priority"]=resourcePriority(asg)
+        if action:
+            asgs[asg["AutoScalingGroupName"]]=action
+    return Plan(region, now, scanActive, instances, asgs, deferred)
+
+def planDict(plan):
     """
-    print("Security Scan Enabled - Starting all instances")
-    for asg in asg_list:
-        if asg["MinSize"] == 0:
-            asgScaleUp.append(asg["AutoScalingGroupName"])
-            print((asg["AutoScalingGroupName"],asg["MinSize"]))
+    Return plan as JSON serializable dict
 
-    for instance in instance_list:
-        if instance["State"]["Name"] == "stopped":
-            manual=isManual(instance)
-            if manual:
-                addInstanceTag(ec2_client, instance["InstanceId"], "SecureScanState", "stopped")
-            elif manual == "MissingTag":
-                addInstanceTag(ec2_client, instance["InstanceId"], "SecureScanState", "stopped")
-            startEC2List.append(instance["InstanceId"])
-            print((instance["InstanceId"], instance["State"]["Name"]))
+    @param plan - Plan
+    @return dict
+    """
+    return dict(plan._asdict(), time=plan.time.strftime("%Y-%m-%dT%H:%M"))
 
-def cleanupAfterSS(instanceId):
+def asgPipeline(run, asg, action):
     """
-    Delete security scan tag from instances, after security scan is ended.
+    Apply planned actions to one autoscaling group in order - HealthCheck process first, then warm pool
+    or standby, then capacity. Failed step stops following steps of the group.
+
+    Standby instances are started before they leave standby (health check grace period covers boot),
+    MinSize is lowered before instances enter standby and they are stopped after it.
 
-    @param instanceId - AWS instance id
+    @param run - RegionRun
+    @param asg - autoscaling group name
+    @param action - planned action (healthCheck, size, warmPool, standby)
+    @return dict operation -> "ok" or error code
     """
-    print("Stop instance %s after security scan" % (instanceId))
-    stopEC2List.append(instanceId)
-    delInstanceTag(ec2_client, instanceId, "SecureScanState")
-        
-def asgUpdates():
+    group={"AutoScalingGroupName": asg}
+    steps=[]
+    if action.get("healthCheck") == "resume":
+        steps.append((run.asg_client, "resume_processes", dict(group, ScalingProcesses=['HealthCheck'])))
+    elif action.get("healthCheck") == "suspend":
+        steps.append((run.asg_client, "suspend_processes", dict(group, ScalingProcesses=['HealthCheck'])))
+    if "warmPool" in action:
+        steps.append((run.asg_client, "put_warm_pool", dict(group, InstanceReusePolicy={"ReuseOnScaleIn": True}, **action["warmPool"])))
+    standby=action.get("standby", {})
+    if "enter" in standby:
+        steps.append((run.asg_client, "update_auto_scaling_group", dict(group, MinSize=action["size"])))
+        steps+=[(run.asg_client, "enter_standby", dict(group, InstanceIds=chunk, ShouldDecrementDesiredCapacity=True))
+            for chunk in chunks(standby["enter"], standbyBatch)]
+        steps.append((run.ec2_client, "stop_instances", {"InstanceIds": standby["enter"]}))
+    if "exit" in standby:
+        steps.append((run.ec2_client, "start_instances", {"InstanceIds": standby["exit"]}))
+        steps+=[(run.asg_client, "exit_standby", dict(group, InstanceIds=chunk)) for chunk in chunks(standby["exit"], standbyBatch)]
+    if "size" in action:
+        steps.append((run.asg_client, "update_auto_scaling_group", dict(group, MinSize=action["size"], DesiredCapacity=action["size"])))
+    result={}
+    for client, operation, kwargs in steps:
+        try:
+            callAws(client, operation, **kwargs)
+            result[operation]="ok"
+        except ClientError as e:
+            result[operation]=e.response['Error']['Code']
+            log.warning("ASG %s - %s failed: %s", asg, operation, result[operation])
+            break
+    return result
+
+def asgUpdates(run):
     """
     Operations with autoscaling groups 
     - enable or disable healthcheck
     - scale up or down
+
+    Groups run in parallel (asgConcurrency workers), steps of one group keep order.
+    Previous size of scaled down groups is stored with bulk tag call before any resize,
+    NUM_INST tag of scaled up group is removed only after successful resize.
+    Autoscaling API has no dry run, in dry run mode nothing is changed.
+
+    @param run - RegionRun
     """
-    if startAsgList:
-        print("Enable HealthCheck for %s ASGs: %s" %(len(startAsgList), startAsgList))
-        for asg in startAsgList:
-            try:
-                asg_client.resume_processes(AutoScalingGroupName=asg, ScalingProcesses=['HealthCheck'])
-            except ClientError as e:
-                print(e.response['Error']['Code'])
-                pass
+    if run.dryRun:
+        log.info("Region %s - dry run, autoscaling groups are not changed", run.region)
+        return
+    if not run.plan.asgs:
+        return
+    log.info("Region %s - enable HealthCheck for %s ASGs, disable for %s ASGs, scale up %s ASGs, scale down %s ASGs", run.region,
+        len(run.startAsgList), len(run.stopAsgList), len(run.asgScaleUp), len(run.asgScaleDown))
+    log.debug("Enable HealthCheck: %s", run.startAsgList)
+    log.debug("Disable HealthCheck: %s", run.stopAsgList)
+    log.debug("Scale up: %s", run.asgScaleUp)
+    log.debug("Scale down: %s", run.asgScaleDown)
+
+    failed={}
+    if run.asgScaleDown:
+        for asg in run.asgScaleDown:
+            run.tags.addAsgTag(asg, "NUM_INST", run.plan.asgs[asg]["NUM_INST"])
+        failed=run.tags.flush()
+    tasks={}
+    for asg, action in run.plan.asgs.items():
+        # Scale up is done by startWaves
+        if wavesEnabled(run) and asg in run.asgScaleUp:
+            continue
+        if asg in failed:
+            log.warning("ASG %s - previous size not stored, skipping scale down", asg)
+            run.asgResults[asg]={"create_or_update_tags": failed[asg]}
+        else:
+            tasks[asg]=action
 
-    if stopAsgList:
-        print("Disable HealthCheck for %s ASGs: %s" %(len(stopAsgList), stopAsgList))
-        for asg in stopAsgList:
-            try:
-                asg_client.suspend_processes(AutoScalingGroupName=asg, ScalingProcesses=['HealthCheck'])
-            except ClientError as e:
-                print(e.response['Error']['Code'])
-                pass
+    with ThreadPoolExecutor(max_workers=max(1, min(asgConcurrency, len(tasks)))) as executor:
+        futures={asg: executor.submit(asgPipeline, run, asg, action) for asg, action in tasks.items()}
+        for asg, future in futures.items():
+            run.asgResults[asg]=future.result()
 
-    if asgScaleUp:
-        print("Scale up %s ASGs: %s" %(len(asgScaleUp), asgScaleUp))
-        for asg in asgScaleUp:
-            if timeForSS(secureScanDay, secureScanStartTime, secureScanDuration) is False:
-                numInst=getPreviousAsgSize(asg_client, asg)["Value"]
-                delAsgTag(asg_client,asg,"NUM_INST")
-            else:
-                numInst=1
-            try:
-                asg_client.update_auto_scaling_group(
-                    AutoScalingGroupName=asg,
-                    MinSize=int(numInst),
-                    DesiredCapacity=int(numInst))
-            except ClientError as e:
-                print(e.response['Error']['Code'])
-                pass
+    # Previous size from NUM_INST tag is restored, tag is removed
+    for asg in run.asgScaleUp:
+        if run.asgResults.get(asg, {}).get("update_auto_scaling_group") == "ok":
+            scaleUpStarted(run, asg)
 
-    if asgScaleDown:
-        print("Scale down %s ASGs: %s" %(len(asgScaleDown), asgScaleDown))
-        for asg in asgScaleDown:
-            numInst=getCurrentAsgSize(asg_client, asg)
-            addAsgTag(asg_client, asg, "NUM_INST", numInst)
-            if int(getOffpeakValue(asg_client, asg)["Value"]) > 0:
-                runInst=getOffpeakValue(asg_client, asg)["Value"]
-            else:
-                runInst=0
-            try:
-                asg_client.update_auto_scaling_group(
-                    AutoScalingGroupName=asg,
-                    MinSize=int(runInst),
-                    DesiredCapacity=int(runInst))
-            except ClientError as e:
-                print(e.response['Error']['Code'])
-                pass
+def scaleUpStarted(run, asg):
+    """
+    Tag autoscaling group after successful scale-up request - NUM_INST tag is removed
+    and SCALEUP tag gets time of request for checkScaleUps
+
+    @param run - RegionRun
+    @param asg - group name
+    """
+    if "NUM_INST" in run.plan.asgs[asg]:
+        run.tags.delAsgTag(asg, "NUM_INST")
+    run.tags.addAsgTag(asg, "SCALEUP", run.now.astimezone(timezone.utc).strftime(scaleUpFormat))
 
-def instanceUpdates():
+def checkScaleUps(run, cache, inventory):
     """
-    Operations with instances - start/stop
+    Measure scale-up latency of autoscaling groups with SCALEUP tag - time from scale-up request
+    until DesiredCapacity instances are InService. Resolution is interval of runs. Finished groups
+    are recorded in metrics and their tag is removed, unfinished groups keep region from stored plan.
+    Groups are read again when inventory comes from cache. Tag of group scaled down before
+    scale-up finished is removed without measurement.
+
+    @param run - RegionRun
+    @param cache - dict from loadCache or None
+    @param inventory - Inventory of current run
     """
-    if startEC2List:
-        print("Starting %s instances: %s" %(len(startEC2List), startEC2List))
+    names=[name for name, asg in inventory.asgs.items() if "SCALEUP" in asg and name not in run.asgScaleUp]
+    if run.dryRun or not names:
+        return
+    try:
+        asgs=describeAsgs(run.asg_client, names) if cache else dict((name, inventory.asgs[name]) for name in names)
+    except ClientError as e:
+        log.warning("Region %s - scale-up check failed: %s", run.region, e.response['Error']['Code'])
+        run.scaleUpsPending.extend(names)
+        return
+    for name in names:
+        asg=asgs.get(name)
+        if asg is None or "SCALEUP" not in asg:
+            continue
+        if name in run.asgScaleDown:
+            log.info("ASG %s - scaled down before scale up finished", name)
+            run.tags.delAsgTag(name, "SCALEUP")
+            continue
+        inService=sum(1 for item in asg.get("Instances") or [] if item["LifecycleState"] == "InService")
+        if inService < asg["DesiredCapacity"]:
+            run.scaleUpsPending.append(name)
+            continue
+        run.scaleUpsDone.append(name)
         try:
-            ec2_client.start_instances(InstanceIds=startEC2List)
-        except ClientError as e:
-                print(e.response['Error']['Code'])
-                pass
+            started=datetime.strptime(asg["SCALEUP"], scaleUpFormat).replace(tzinfo=timezone.utc)
+        except ValueError:
+            log.warning("Wrong SCALEUP %s in asg %s", asg["SCALEUP"], name)
+        else:
+            seconds=max(0, int((run.now.astimezone(timezone.utc) - started).total_seconds()))
+            log.info("ASG %s - scale up finished in %s s, %s instances InService", name, seconds, inService)
+            run.scaleUpSeconds[name]=seconds
+            metrics.recordScaleUp(run.region, name, seconds)
+        run.tags.delAsgTag(name, "SCALEUP")
 
-    if stopEC2List:
-        print("Stopping %s instances: %s" %(len(stopEC2List), stopEC2List))
+def runInstanceAction(function, instanceIds, splitCodes=instanceCodes):
+    """
+    Call start/stop function for instances in chunks of actionChunkSize, chunks are sent
+    in parallel. Chunk failing on error of single instance is bisected, so one instance in wrong
+    state doesn't block others. Chunk failing on other error (permissions) fails as whole.
+
+    @param function - callable with list of instance IDs
+    @param instanceIds - list of AWS instance IDs
+    @param splitCodes - error code prefixes which split chunk
+    @return dict failed instance -> error code
+    """
+    failed={}
+    with ThreadPoolExecutor(max_workers=actionConcurrency) as executor:
+        for result in executor.map(lambda chunk: bisectCall(function, chunk, splitCodes), list(chunks(instanceIds, actionChunkSize))):
+            failed.update(result)
+    for instanceId, code in failed.items():
+        log.warning("Instance %s failed: %s", instanceId, code)
+    return failed
+
+def dryRunCall(function):
+    """
+    Wrap EC2 call with DryRun flag - DryRunOperation error means call would succeed
+
+    @param function - callable with list of instance IDs
+    @return callable
+    """
+    def call(items):
         try:
-            ec2_client.stop_instances(InstanceIds=stopEC2List)
+            return function(items)
         except ClientError as e:
-                print(e.response['Error']['Code'])
-                pass
+            if e.response['Error']['Code'] != "DryRunOperation":
+                raise
+    return call
 
-def main():
+def wavesEnabled(run):
     """
-    Main function 
+    Check if starts of run go in waves (waveSize env variable, not in dry run)
+
+    @param run - RegionRun
+    @return boolean
     """
-    # Check if is time for SecurityScan
-    if timeForSS(secureScanDay, secureScanStartTime, secureScanDuration) is True and int(secureScanDuration) > 0:
-        securityScan(getAllAsgs(asg_client), getAllInstances(ec2_client))
-    else:
-        allInstances=getAllInstances(ec2_client)
-        # Cleanup after security scan run only if AWS response include "SecureScanState" tag
-        for inst in allInstances:
-            if "SecureScanState" in inst:
-                cleanupAfterSS(inst["InstanceId"])
-        # Check autoscaling groups state and tags
-        for asg in getTagedAsgs(asg_client):
-            # check if tag manual is included
-            if isManual(asg):
-                print("ASG %s - manual config: enabled" % (asg["AutoScalingGroupName"]))
-            else:
-                print("ASG %s - manual config: disabled" % (asg["AutoScalingGroupName"]))
-                # Get previous number of instances in autoscaling group. When tag is not defined set to 0
-                try:
-                    asg["NUM_INST"]
-                except KeyError:           
-                    asg["NUM_INST"]=0
-                activeNowV=activeNow(asg)
-                activeTodayV=activeToday(asg)
-                offpeakV=offpeak(asg)
-                # Autoscalingroup state is (HealthCheck - suspended, running time true, ofpeeak = -1) -> enable healthcheck
-                if (activeNowV is True 
-                        and activeTodayV is True 
-                        and next((True for item in asg["SuspendedProcesses"] if item["ProcessName"] == "HealthCheck"),False) is True 
-                        and offpeakV is False):
-                    startAsgList.append(asg["AutoScalingGroupName"])
-                # Autoscalingroup state is (HealthCheck - not suspended, running time false, , ofpeeak = -1) -> disable healthcheck
-                elif (
-                        (activeNowV is False or activeTodayV is False) 
-                        and asg["SuspendedProcesses"] == [] 
-                        and offpeakV is False):
-                    stopAsgList.append(asg["AutoScalingGroupName"])
-                # Autoscalingroup state is (running time true, ofpeeak >= 0, Min size is 0 or less than NUM_INST) -> scale up
-                elif (offpeakV is True 
-                        and activeNowV is True 
-                        and activeTodayV is True 
-                        and asg["SuspendedProcesses"] == [] 
-                        and (asg["MinSize"] == 0 
-                            or int(asg["NUM_INST"]) > asg["MinSize"] 
-                            or asg["MinSize"] < int(asg["OFFPEAK"]))):
-                    asgScaleUp.append(asg["AutoScalingGroupName"])
-                # Autoscalingroup state is (running time false, ofpeeak >= 0, Min size is more than OFFPEAK) -> scale down
-                elif (offpeakV is True 
-                        and (activeNowV is False or activeTodayV is False) 
-                        and asg["SuspendedProcesses"] == [] 
-                        and asg["MinSize"] > int(asg["OFFPEAK"])):
-                    asgScaleDown.append(asg["AutoScalingGroupName"])
-
-        # Check instances state and tags
-        for instance in getTagedInstances(ec2_client):
-            # check if tag manual is included
-            if isManual(instance) or runControl(instance):
-                print("Instance %s - manual config or run control: enabled" % (instance["InstanceId"]))
+    return waveSize > 0 and not run.dryRun
+
+def startWaves(run):
+    """
+    Start instances and scale up autoscaling groups in waves of at most waveSize instances
+    with waveDelay seconds between waves. Resources are ordered by RUN:PRIORITY, scaled up group
+    counts as its new size. Start call failing on capacity or throttling moves its instances
+    to later wave, at most waveRetries times.
+
+    @param run - RegionRun
+    @return dict - waves, retried, failed, fleetUpSeconds (from first wave to last accepted start)
+    """
+    queue=[("instance", instanceId, 1, run.plan.instances[instanceId]["priority"]) for instanceId in run.startEC2List]
+    queue+=[("asg", asg, max(1, run.plan.asgs[asg]["size"]), run.plan.asgs[asg]["priority"]) for asg in run.asgScaleUp]
+    queue.sort(key=lambda item: item[3])
+    attempts={}
+    report={"waves": 0, "retried": 0, "failed": 0, "fleetUpSeconds": 0.0}
+    start=time.monotonic()
+    while queue:
+        if report["waves"]:
+            time.sleep(waveDelay)
+        wave, size = [], 0
+        while queue and (not wave or size + queue[0][2] <= waveSize):
+            wave.append(queue.pop(0))
+            size+=wave[-1][2]
+        report["waves"]+=1
+        instanceIds=[name for kind, name, weight, priority in wave if kind == "instance"]
+        asgs=[name for kind, name, weight, priority in wave if kind == "asg"]
+        log.info("Wave %s - starting %s instances, scaling up %s ASGs", report["waves"], len(instanceIds), len(asgs))
+        # Capacity errors apply to whole AZ or instance type - failing chunk isn't bisected, all its
+        # instances are moved to later wave. Only errors of single instance are isolated.
+        failed=runInstanceAction(lambda items: callAws(run.ec2_client, "start_instances", InstanceIds=items),
+            instanceIds) if instanceIds else {}
+        if asgs:
+            with ThreadPoolExecutor(max_workers=max(1, min(asgConcurrency, len(asgs)))) as executor:
+                for asg, result in zip(asgs, executor.map(lambda asg: asgPipeline(run, asg, run.plan.asgs[asg]), asgs)):
+                    run.asgResults[asg]=result
+                    if result.get("update_auto_scaling_group") == "ok":
+                        scaleUpStarted(run, asg)
+        for item in wave:
+            code=failed.get(item[1])
+            if code in capacityCodes + throttleCodes and attempts.get(item[1], 0) < waveRetries:
+                attempts[item[1]]=attempts.get(item[1], 0) + 1
+                report["retried"]+=1
+                queue.append(item)
+            elif code:
+                run.actionFailures[item[1]]=code
+                report["failed"]+=1
+        if len(failed) < len(instanceIds) or asgs:
+            report["fleetUpSeconds"]=round(time.monotonic() - start, 1)
+    log.info("Region %s - waves finished - %s waves, %s retried, %s failed, fleet up in %s s", run.region,
+        report["waves"], report["retried"], report["failed"], report["fleetUpSeconds"])
+    return report
+
+def instanceUpdates(run):
+    """
+    Operations with instances - start/stop. In dry run mode calls are sent with DryRun flag,
+    AWS checks permissions and instance state without changing them.
+
+    @param run - RegionRun
+    """
+    if wavesEnabled(run) and (run.startEC2List or run.asgScaleUp):
+        log.info("Region %s - starting %s instances and scaling up %s ASGs in waves of %s", run.region, len(run.startEC2List), len(run.asgScaleUp), waveSize)
+        run.waveReport=startWaves(run)
+        # NUM_INST and SCALEUP tags of scaled up groups
+        run.tags.flush()
+    elif run.startEC2List:
+        log.info("Region %s - starting %s instances", run.region, len(run.startEC2List))
+        log.debug("Starting instances: %s", run.startEC2List)
+        run.actionFailures.update(runInstanceAction(dryRunCall(
+            lambda items: callAws(run.ec2_client, "start_instances", InstanceIds=items, DryRun=run.dryRun)), run.startEC2List))
+
+    if run.stopEC2List:
+        log.info("Region %s - stopping %s instances", run.region, len(run.stopEC2List))
+        log.debug("Stopping instances: %s", run.stopEC2List)
+        run.actionFailures.update(runInstanceAction(dryRunCall(
+            lambda items: callAws(run.ec2_client, "stop_instances", InstanceIds=items, DryRun=run.dryRun)), run.stopEC2List))
+
+def main(run, inventory):
+    """
+    Main function - reconcile inventory and fill action lists of run
+
+    @param run - RegionRun
+    @param inventory - Inventory snapshot of current run
+    """
+    if run.scanActive is True:
+        log.info("Security Scan Enabled - Starting all instances")
+    run.plan=reconcile(inventory, run.now, run.scanActive, run.region, run.zone)
+    for instanceId, action in run.plan.instances.items():
+        if action.get("action") == "start":
+            run.startEC2List.append(instanceId)
+        elif action.get("action") == "stop":
+            run.stopEC2List.append(instanceId)
+        for key, value in action.get("tags", {}).items():
+            if value is None:
+                run.tags.delInstanceTag(instanceId, key)
             else:
-                print("Instance %s - manual config: disabled" % (instance["InstanceId"]))
-                activeNowV=activeNow(instance)
-                activeTodayV=activeToday(instance)
-                offpeakV=offpeak(instance)
-                # Instance state is (running time true, state stopped) -> start instance
-                if activeNowV is True and activeTodayV is True and instance["State"]["Name"] == "stopped" and offpeakV is False:
-                    startEC2List.append(instance["InstanceId"])
-                # Instance state is (running time false, state running) -> stop instance
-                elif (activeNowV is False or activeTodayV is False) and instance["State"]["Name"] == "running" and offpeakV is False:
-                    stopEC2List.append(instance["InstanceId"]) 
-
-def debug():
+                run.tags.addInstanceTag(instanceId, key, value)
+    for asg, action in run.plan.asgs.items():
+        if action.get("healthCheck") == "resume":
+            run.startAsgList.append(asg)
+        elif action.get("healthCheck") == "suspend":
+            run.stopAsgList.append(asg)
+        if isScaleUp(inventory.asgs[asg], action):
+            run.asgScaleUp.append(asg)
+        elif "size" in action:
+            run.asgScaleDown.append(asg)
+    for instanceId, reason in run.plan.deferred.items():
+        log.debug("Instance %s deferred - %s", instanceId, reason)
+
+def debug(run):
     """
     Print important run variables
+
+    @param run - RegionRun
     """
-    print("startEC2List - %s" % (startEC2List))
-    print("stopEC2List - %s" % (stopEC2List))
-    print("startAsgList - %s" % (startAsgList))
-    print("stopAsgList - %s" % (stopAsgList))
-    print("asgScaleUp - %s" % (asgScaleUp))
-    print("asgScaleDown - %s" % (asgScaleDown))
+    log.debug("region - %s", run.region)
+    log.debug("startEC2List - %s", run.startEC2List)
+    log.debug("stopEC2List - %s", run.stopEC2List)
+    log.debug("startAsgList - %s", run.startAsgList)
+    log.debug("stopAsgList - %s", run.stopAsgList)
+    log.debug("asgScaleUp - %s", run.asgScaleUp)
+    log.debug("asgScaleDown - %s", run.asgScaleDown)
+
+    log.debug("timeForSS - %s", run.scanActive)
+    log.debug("scanWindows - %s", ["%s - %s" % (window.start, window.end) for window in getScanWindows(run.now)])
+    log.debug("secureScanDay - %s", secureScanDay)
+    log.debug("secureScanStartTime - %s", secureScanStartTime)
+    log.debug("secureScanDuration - %s", secureScanDuration)
+
+def getRegions(session):
+    """
+    Return list of regions for scheduling. Regions from "regions" env variable
+    or all enabled regions in account.
 
-    print("timeForSS - %s" % (timeForSS(secureScanDay, secureScanStartTime, secureScanDuration)))
-    print("secureScanDay - %s" % (secureScanDay))
-    print("secureScanStartTime - %s" % (secureScanStartTime))
-    print("secureScanDuration - %s" % (secureScanDuration))
+    @param session - boto3 session
+    @return list of region names
+    """
+    if regionsEnv.strip():
+        return [item.strip() for item in regionsEnv.split(",") if item.strip()]
+    try:
+        responseDict = callAws(getClient(session, "ec2", defaultRegion), "describe_regions")
+        return sorted(item["RegionName"] for item in responseDict["Regions"])
+    except ClientError as e:
+        log.error("describe_regions failed: %s", e.response['Error']['Code'])
+        return [defaultRegion]
 
-def lambda_handler(event, context):
+def runRegion(region, session, now, account=None, dryRun=False, deadline=None):
     """
-    Call AWS lambda function
+    Run whole pipeline (inventory -> decide -> act) for single region. Region of account past
+    its deadline makes no actions and returns {"timeout": True}.
+
+    @param region - AWS region name
+    @param session - boto3 session
+    @param now - datetime of current run
+    @param account - AWS account ID, key of cached inventory
+    @param dryRun - only check actions with DryRun flag and return plan
+    @param deadline - Deadline of account or None
+    @return dict with number of actions
     """
-    print("Running EC2 Scheduler %s - version %s" % (datetime.today(), version))
-    listsClear()
-    main()
-    asgUpdates()
-    instanceUpdates()
+    run=RegionRun(region, session, now, account, dryRun, deadline)
+    if deadline is not None and deadline.passed():
+        log.warning("Region %s - account deadline passed, region skipped", region)
+        return {"timeout": True}
+    with metrics.phase("scanCheck"):
+        run.scanActive=timeForSS(run.now)
+    with metrics.phase("inventory"):
+        cache=loadCache(run)
+        if planIsCurrent(cache, run.now):
+            log.debug("Region %s - inventory unchanged, next transition %s", region, cache["plan"]["next"])
+            return {"skipped": True, "nextTransition": cache["plan"]["next"]}
+        inventory=loadInventory(run, cache)
+    profiler.snapshot(region, "inventory")
+    with metrics.phase("decision"):
+        main(run, inventory)
+    profiler.snapshot(region, "main")
+    if deadline is not None and not deadline.enter():
+        log.warning("Region %s - account deadline passed, no actions made", region)
+        return {"timeout": True}
+    try:
+        nextTime=actuate(run, cache, inventory)
+    finally:
+        if deadline is not None:
+            deadline.leave()
 
     if debugEnv == "True":
-        debug()
\ No newline at end of file
+        debug(run)
+    return {
+        "instances": len(inventory.instances),
+        "asgs": len(inventory.asgs),
+        "startEC2": len(run.startEC2List),
+        "stopEC2": len(run.stopEC2List),
+        "asgScaleUp": len(run.asgScaleUp),
+        "asgScaleDown": len(run.asgScaleDown),
+        "startAsg": len(run.startAsgList),
+        "stopAsg": len(run.stopAsgList),
+        "tagFailures": run.tags.failed,
+        "actionFailures": run.actionFailures,
+        "asgFailures": dict((asg, result) for asg, result in run.asgResults.items() if set(result.values()) - set(["ok"])),
+        "deferred": len(run.plan.deferred),
+        "scaleUpSeconds": run.scaleUpSeconds,
+        "scaleUpsPending": len(run.scaleUpsPending),
+        "waves": run.waveReport,
+        "nextTransition": nextTime.strftime("%Y-%m-%dT%H:%M") if nextTime else None,
+        "plan": planDict(run.plan) if run.dryRun else None
+    }
+
+def actuate(run, cache, inventory):
+    """
+    Apply actions of region run - autoscaling groups, tags, instances - and store refreshed cache and plan
+
+    @param run - RegionRun with filled action lists
+    @param cache - dict from loadCache or None
+    @param inventory - Inventory of current run
+    @return datetime of next transition or None
+    """
+    with metrics.phase("asgActuation"):
+        checkScaleUps(run, cache, inventory)
+        asgUpdates(run)
+    profiler.snapshot(run.region, "asgUpdates")
+    # SecureScanState tags have to be stored before instances are started
+    with metrics.phase("tagFlush"):
+        if not run.dryRun:
+            run.tags.flush()
+    with metrics.phase("instanceActuation"):
+        instanceUpdates(run)
+    profiler.snapshot(run.region, "instanceUpdates")
+    if run.dryRun:
+        return None
+    with metrics.phase("cacheRefresh"):
+        refreshCache(run)
+        return savePlan(run, cache, inventory)
+
+def runRegions(session, regions, now, account=None, dryRun=False, deadline=None):
+    """
+    Run pipeline for all regions in parallel. Error in one region doesn't stop others.
+
+    @param session - boto3 session
+    @param regions - list of region names
+    @param now - datetime of current run
+    @param account - AWS account ID, key of cached inventory
+    @param dryRun - only check actions with DryRun flag and return plan
+    @param deadline - Deadline of account or None
+    @return dict region -> result of runRegion or error
+    """
+    results={}
+    with ThreadPoolExecutor(max_workers=max(1, min(regionConcurrency, len(regions)))) as executor:
+        futures={region: executor.submit(profiler.call, runRegion, region, session, now, account, dryRun, deadline) for region in regions}
+        for region, future in futures.items():
+            try:
+                results[region]=future.result()
+            except Exception as e:
+                log.error("Region %s failed: %s", region, e)
+                results[region]={"error": str(e)}
+    return results
+
+def getRoleArns(event):
+    """
+    Return list of role ARNs from lambda event ("roleArns" key) or from "roleArns" env variable
+
+    @param event - lambda event
+    @return list of role ARNs
+    """
+    roleArns = (event or {}).get("roleArns") if isinstance(event, dict) else None
+    if roleArns is None:
+        roleArns = roleArnsEnv.split(",")
+    elif isinstance(roleArns, str):
+        roleArns = roleArns.split(",")
+    return [item.strip() for item in roleArns if item.strip()]
+
+def getRoleSession(session, roleArn):
+    """
+    Return session with credentials of assumed role. Credentials and session (with its clients)
+    are cached until 5 minutes before expiration, warm lambda reuses them across invocations.
+
+    @param session - boto3 session used for STS call
+    @param roleArn - ARN of role in target account
+    @return boto3 session
+    """
+    with credentialsLock:
+        cached = credentialsCache.get(roleArn)
+    if cached and cached["factory"] is sessionFactory and cached["credentials"]["Expiration"] - timedelta(minutes=5) > datetime.now(timezone.utc):
+        return cached["session"]
+    credentials = callAws(getClient(session, "sts", defaultRegion), "assume_role",
+        RoleArn=roleArn, RoleSessionName="EC2Scheduler")["Credentials"]
+    roleSession = newSession(
+        aws_access_key_id=credentials["AccessKeyId"],
+        aws_secret_access_key=credentials["SecretAccessKey"],
+        aws_session_token=credentials["SessionToken"])
+    with credentialsLock:
+        credentialsCache[roleArn] = {"credentials": credentials, "session": roleSession, "factory": sessionFactory}
+    return roleSession
+
+class Deadline(object):
+    """
+    Time limit of account run. Regions check it before actions, so account past deadline
+    makes no changes - also when its thread continues after lambda handler returned.
+    Regions already making actions are counted and finished.
+    """
+    def __init__(self, seconds):
+        self.end = time.monotonic() + seconds
+        self.lock = threading.Lock()
+        self.expired = False
+        self.active = 0
+
+    def passed(self):
+        """
+        Check if deadline is passed
+
+        @return boolean
+        """
+        with self.lock:
+            self.expired = self.expired or time.monotonic() >= self.end
+            return self.expired
+
+    def enter(self):
+        """
+        Start actions of region, refused after deadline
+
+        @return boolean, True when region can make actions (leave has to be called after them)
+        """
+        with self.lock:
+            self.expired = self.expired or time.monotonic() >= self.end
+            if self.expired:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        """
+        Finish actions of region
+        """
+        with self.lock:
+            self.active -= 1
+
+    def expire(self):
+        """
+        Close deadline, no region starts actions after it
+
+        @return boolean, True when no region is making actions
+        """
+        with self.lock:
+            self.expired = True
+            return self.active == 0
+
+def runAccount(session, roleArn, now, dryRun=False, deadline=None):
+    """
+    Run pipeline for all regions of single account
+
+    @param session - boto3 session used for STS call
+    @param roleArn - ARN of role in target account, None for own account
+    @param now - datetime of current run
+    @param dryRun - only check actions with DryRun flag and return plan
+    @param deadline - Deadline of account or None
+    @return dict region -> result
+    """
+    if roleArn:
+        session = getRoleSession(session, roleArn)
+    return runRegions(session, getRegions(session), now, roleArn.split(":")[4] if roleArn else None, dryRun, deadline)
+
+def runAccounts(session, roleArns, now, dryRun=False):
+    """
+    Run pipeline for all accounts in parallel. Failing or slow account doesn't block others.
+    Account which doesn't finish in accountTimeout seconds is reported as timeout and makes no
+    more actions, queued accounts are cancelled. Account which is making actions at deadline
+    is waited for and reported with its results.
+
+    @param session - boto3 session
+    @param roleArns - list of role ARNs
+    @param now - datetime of current run
+    @param dryRun - only check actions with DryRun flag and return plan
+    @return dict role ARN -> summary (status, regions, error)
+    """
+    results={}
+    deadlines=dict((roleArn, Deadline(accountTimeout)) for roleArn in roleArns)
+    executor=ThreadPoolExecutor(max_workers=max(1, min(accountConcurrency, len(roleArns))))
+    futures={roleArn: executor.submit(runAccount, session, roleArn, now, dryRun, deadlines[roleArn]) for roleArn in roleArns}
+    wait(futures.values(), timeout=accountTimeout)
+    for roleArn, future in futures.items():
+        if not future.done() and deadlines[roleArn].expire():
+            future.cancel()
+            log.warning("Account %s timed out", roleArn)
+            results[roleArn]={"status": "timeout"}
+            continue
+        try:
+            results[roleArn]={"status": "ok", "regions": future.result()}
+        except Exception as e:
+            log.error("Account %s failed: %s", roleArn, e)
+            results[roleArn]={"status": "error", "error": str(e)}
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+def getAccountId(session):
+    """
+    Return account ID of lambda role, cached with default session
+
+    @param session - default boto3 session
+    @return AWS account ID
+    """
+    with clientLock:
+        account = defaultSession.get("account")
+    if account is None:
+        account = callAws(getClient(session, "sts", defaultRegion), "get_caller_identity")["Account"]
+        with clientLock:
+            defaultSession["account"] = account
+    return account
+
+def getAccountSession(account):
+    """
+    Return session for account - assumed role from "roleArns" env variable or own lambda session
+
+    @param account - AWS account ID
+    @return boto3 session
+    """
+    session = getDefaultSession()
+    for roleArn in getRoleArns(None):
+        if roleArn.split(":")[4] == account:
+            return getRoleSession(session, roleArn)
+    return session
+
+def isDryRun(event):
+    """
+    Check dry run mode - "dryRun" key in lambda event or "dryRun" env variable
+
+    @param event - lambda event
+    @return boolean
+    """
+    if isinstance(event, dict) and "dryRun" in event:
+        return str(event["dryRun"]).lower() == "true"
+    return dryRunEnv == "True"
+
+def isChangeEvent(event):
+    """
+    Check if lambda event is EventBridge change event (not scheduled run)
+
+    @param event - lambda event
+    @return boolean
+    """
+    return isinstance(event, dict) and event.get("source") in eventSources and "detail-type" in event
+
+def eventChanges(event):
+    """
+    Return changes carried by EventBridge event. Change None means resource has to be read again.
+
+    @param event - EventBridge event
+    @return dict "instances"/"asgs" -> dict ID/name -> change (State and/or Tags) or None
+    """
+    detail = event.get("detail") or {}
+    changes = {"instances": {}, "asgs": {}}
+    if event["source"] == "aws.ec2" and event["detail-type"] == "EC2 Instance State-change Notification":
+        changes["instances"][detail["instance-id"]] = {"State": detail["state"]}
+    elif event["source"] == "aws.tag" and event["detail-type"] == "Tag Change on Resource":
+        # Event includes complete tag set of resource after change
+        tags = dict((key, value) for key, value in (detail.get("tags") or {}).items() if key in tagList)
+        for arn in event.get("resources", []):
+            if detail.get("service") == "ec2" and detail.get("resource-type") == "instance":
+                changes["instances"][arn.split("/")[-1]] = {"Tags": tags}
+            elif detail.get("service") == "autoscaling" and "autoScalingGroupName/" in arn:
+                changes["asgs"][arn.split("autoScalingGroupName/")[-1]] = {"Tags": tags}
+    elif event["source"] == "aws.autoscaling" and detail.get("AutoScalingGroupName"):
+        # Launch, terminate and lifecycle events - capacity or processes may be changed
+        changes["asgs"][detail["AutoScalingGroupName"]] = None
+    return changes
+
+def patchRecord(record, change):
+    """
+    Return copy of cached record with state and tags from event
+
+    @param record - cached instance or autoscaling group record
+    @param change - dict with State and/or Tags
+    @return dict
+    """
+    if "Tags" in change:
+        record = dict((key, value) for key, value in record.items() if key not in tagList)
+        record.update(change["Tags"])
+    else:
+        record = dict(record)
+    if "State" in change:
+        record["State"] = {"Name": change["State"]}
+    return record
+
+def handleEvent(event):
+    """
+    Apply EventBridge event to cached inventory of its account and region. Known resources
+    are patched from event, unknown resources and autoscaling groups are read by one targeted call.
+    Cache keeps only resources with scheduler tags (except cache of security scan, which is complete),
+    resources without them are dropped. Event is ignored when there is no state store or no cache yet
+    (next run does full scan).
+
+    @param event - EventBridge event
+    @return dict with status and number of updated resources
+    """
+    store = getStore()
+    if store is None:
+        log.warning("Event %s ignored - stateStore is not set", event["detail-type"])
+        return {"status": "ignored"}
+    key = cacheKey(event["account"], event["region"])
+    changes = eventChanges(event)
+    missing = {"instances": [], "asgs": []}
+
+    def scheduled(cache, records):
+        # Resources without scheduler tags are removed from cache of tagged resources
+        return dict((name, record if record is None or cache.get("complete") or isTaged(record) else None)
+            for name, record in records.items())
+
+    def applyChanges(cache):
+        if not cache or cache.get("version") != cacheVersion:
+            return None
+        for kind in ("instances", "asgs"):
+            records = {}
+            for name, change in changes[kind].items():
+                if change is not None and name in cache[kind]:
+                    records[name] = patchRecord(cache[kind][name], change)
+                elif change is None or change.get("State") != "terminated":
+                    missing[kind].append(name)
+            mergeCache(cache, kind, scheduled(cache, records))
+        return cache
+
+    if store.update(key, applyChanges) is None:
+        log.warning("Event %s ignored - no cached inventory for %s", event["detail-type"], key)
+        return {"status": "ignored"}
+    if missing["instances"] or missing["asgs"]:
+        session = getAccountSession(event["account"])
+        try:
+            instances = describeInstances(getClient(session, "ec2", event["region"]), missing["instances"]) if missing["instances"] else {}
+            asgs = describeAsgs(getClient(session, "autoscaling", event["region"]), missing["asgs"]) if missing["asgs"] else {}
+        except ClientError as e:
+            log.error("Event describe in %s failed: %s", key, e.response['Error']['Code'])
+            store.update(key, expireCache)
+            return {"status": "expired"}
+        store.update(key, lambda cache: cache and mergeCache(mergeCache(cache, "instances",
+            scheduled(cache, dict((name, instances.get(name)) for name in missing["instances"]))),
+            "asgs", scheduled(cache, dict((name, asgs.get(name)) for name in missing["asgs"]))))
+    updated = sum(len(item) for item in changes.values())
+    log.info("Event %s - %s resources updated in %s", event["detail-type"], updated, key)
+    return {"status": "ok", "updated": updated}
+
+def summarizeResults(results, summary=None):
+    """
+    Return totals of invocation results - regions of own account or of all accounts, event status
+
+    @param results - dict from runRegions, runAccounts or handleEvent
+    @param summary - dict with totals to update
+    @return dict
+    """
+    if "status" in results and "regions" not in results:
+        return dict(results)
+    if summary is None:
+        summary={"regions": 0, "skipped": 0, "timedOutRegions": 0, "failedRegions": 0, "failedAccounts": 0}
+    for result in results.values():
+        if "status" in result:
+            summary["failedAccounts"]+=result["status"] != "ok"
+            summarizeResults(result.get("regions", {}), summary)
+            continue
+        summary["regions"]+=1
+        if "error" in result:
+            summary["failedRegions"]+=1
+        elif result.get("skipped"):
+            summary["skipped"]+=1
+        elif result.get("timeout"):
+            summary["timedOutRegions"]+=1
+        else:
+            for key in ("instances", "asgs", "startEC2", "stopEC2", "asgScaleUp", "asgScaleDown", "startAsg", "stopAsg", "deferred"):
+                summary[key]=summary.get(key, 0) + result[key]
+            for key in ("tagFailures", "actionFailures", "asgFailures"):
+                summary[key]=summary.get(key, 0) + len(result[key])
+    return summary
+
+def lambda_handler(event, context):
+    """
+    Call AWS lambda function
+
+    Event can include "roleArns" - list of role ARNs, scheduler runs in each account.
+    Without role ARNs scheduler runs only in own account.
+    Event "dryRun": true (or "dryRun" env variable) returns plan without changes.
+    EventBridge change events only update cached inventory (stateStore env variable).
+    """
+    metrics.reset()
+    log.reset()
+    log.info("Running EC2 Scheduler %s - version %s", datetime.today(), version)
+    profiler.start()
+    try:
+        if isChangeEvent(event):
+            with metrics.phase("event"):
+                results=handleEvent(event)
+        else:
+            # Single clock for whole invocation - all resources are evaluated against same time
+            now=clock()
+            session=getDefaultSession()
+            roleArns=getRoleArns(event)
+            dryRun=isDryRun(event)
+            if not roleArns:
+                # Account ID keys cached inventory and selects account timezone
+                results=runRegions(session, getRegions(session), now, getAccountId(session) if getStore() or accountTimezones else None, dryRun)
+            else:
+                results=runAccounts(session, roleArns, now, dryRun)
+        # One summary record per invocation - metrics, totals of all regions and number of log records by level
+        record=metrics.emit()
+        record["summary"]=summarizeResults(results)
+        record["logRecords"]=dict(log.counts)
+        log.write(record)
+        return results
+    finally:
+        try:
+            profiler.finish()
+        except Exception as e:
+            log.error("Profile failed: %s", e)
+        log.flush()
@@ -0,0 +1,144 @@
+"""
+Long running scheduler - alternative entry point to lambda_handler for container or VM.
+
+Process keeps boto3 session, clients and cached inventory between runs and sleeps until
+next schedule or security scan transition reported by regions, so instances are started and
+stopped in the minute of transition instead of next cron tick. Full scan of inventory
+(reconcile) runs at least every reconcileInterval minutes. SIGTERM and SIGINT stop daemon
+after current run.
+
+Usage:
+    python daemon.py [--once] [--dry-run]
+
+All lambda env variables are used. Without "stateStore" env variable inventory is cached in memory.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Inventory is cached in process memory unless other store is set
+os.environ.setdefault("stateStore", "memory://daemon")
+
+import EC2Scheduler as scheduler
+
+# Seconds to next run when some region made actions, failed or has no stored plan
+daemonRetry = scheduler.envNumber("daemonRetry", "60", float, minimum=1)
+
+def nextTransitions(results):
+    """
+    Return next transition times from result of lambda_handler - region summaries
+    of own account or account summaries with regions. None is returned for region
+    without stored plan (actions were made, error, dry run).
+
+    @param results - dict from lambda_handler
+    @return list of datetimes or None
+    """
+    times = []
+    for result in results.values():
+        if isinstance(result, dict) and "regions" in result:
+            times += nextTransitions(result["regions"])
+        elif isinstance(result, dict) and result.get("nextTransition"):
+            times.append(datetime.strptime(result["nextTransition"], "%Y-%m-%dT%H:%M"))
+        else:
+            times.append(None)
+    return times
+
+class Daemon(object):
+    """
+    Run loop of long running scheduler
+    """
+    def __init__(self, dryRun=False):
+        self.event = {"dryRun": True} if dryRun else {}
+        self.stopEvent = threading.Event()
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stop daemon after current run, used as signal handler
+        """
+        scheduler.log.info("Stopping EC2 Scheduler daemon (signal %s)", signum)
+        self.stopEvent.set()
+
+    def runOnce(self):
+        """
+        Run scheduler in all accounts and regions
+
+        @return list of next transition datetimes or None
+        """
+        try:
+            return nextTransitions(scheduler.lambda_handler(self.event, None))
+        except Exception as e:
+            scheduler.log.error("Run failed: %s", e)
+            scheduler.log.flush()
+            return [None]
+
+    def wakeUp(self, transitions):
+        """
+        Return time.time() of next run - nearest transition, retry when some region has no plan,
+        and reconcileInterval after current run so cached inventory is expired by then
+
+        @param transitions - list from runOnce
+        @return float
+        """
+        current = time.time()
+        wake = current + scheduler.reconcileInterval*60
+        for transition in transitions:
+            if transition is None:
+                wake = min(wake, current + daemonRetry)
+            else:
+                wake = min(wake, current + max(0, (transition - scheduler.clock()).total_seconds()))
+        return wake
+
+    def sleep(self, wake):
+        """
+        Sleep until wake time or stop signal
+
+        @param wake - time.time() of next run
+        @return boolean, True when daemon is stopped
+        """
+        scheduler.log.info("Next run at %s", datetime.fromtimestamp(wake))
+        scheduler.log.flush()
+        while not self.stopEvent.is_set() and time.time() < wake:
+            self.stopEvent.wait(wake - time.time())
+        return self.stopEvent.is_set()
+
+    def run(self, once=False):
+        """
+        Run scheduler until stopped
+
+        @param once - single run
+        """
+        while not self.stopEvent.is_set():
+            transitions = self.runOnce()
+            if once or self.sleep(self.wakeUp(transitions)):
+                break
+        scheduler.log.info("EC2 Scheduler daemon stopped")
+        scheduler.log.flush()
+
+def parseArgs(argv):
+    """
+    Parse command line arguments
+
+    @param argv - list of arguments
+    @return argparse namespace
+    """
+    parser = argparse.ArgumentParser(description="Long running EC2 Scheduler")
+    parser.add_argument("--once", action="store_true", help="single run, then exit")
+    parser.add_argument("--dry-run", action="store_true", help="only return plans, no changes")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    args = parseArgs(argv)
+    daemon = Daemon(args.dry_run)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(args.once)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,323 @@
+"""
+Offline schedule simulator - replay decisions of EC2Scheduler main() and asgUpdates()
+for inventory snapshot and time range without calling AWS.
+
+Usage:
+    python simulator.py snapshot.json --start 2026-10-19T00:00 --end 2026-10-26T00:00 --step 5
+
+Snapshot is JSON with "instances" and "asgs" lists in describe_instances/describe_auto_scaling_groups
+format (Tags as list of Key/Value or as dict) and optional "account" ID. Schedules are evaluated in
+RUN:TZ zone, account zone from accountTimezones, timezone env variable or local time same way as in lambda.
+Security scan env variables are used same way as in lambda.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Security scan is disabled when env variables are not set
+os.environ.setdefault("secureScanDay", "1")
+os.environ.setdefault("secureScanStartTime", "0")
+os.environ.setdefault("secureScanDuration", "0")
+
+import EC2Scheduler as scheduler
+
+minutesInWeek = 7*24*60
+# Number of resources evaluated at once, limits memory of resources x time matrix
+resourceChunkSize = 10000
+
+def normalizeTags(resource):
+    """
+    Return resource with Tags as list of Key/Value dicts
+
+    @param resource - dict from snapshot
+    @return dict
+    """
+    tags = resource.get("Tags") or []
+    if isinstance(tags, dict):
+        resource = dict(resource, Tags=[{"Key": key, "Value": value} for key, value in tags.items()])
+    return resource
+
+def loadSnapshot(snapshot):
+    """
+    Convert snapshot to instance and asg records used by scheduler
+
+    @param snapshot - dict with "instances" and "asgs" lists
+    @return tuple (instance records, asg records)
+    """
+    instances = []
+    for instance in snapshot.get("instances", []):
+        instance = normalizeTags(instance)
+        if isinstance(instance.get("State"), str):
+            instance = dict(instance, State={"Name": instance["State"]})
+        instances.append(scheduler.getInstancetData(instance))
+    asgs = []
+    for asg in snapshot.get("asgs", []):
+        asg = normalizeTags(asg)
+        asg.setdefault("DesiredCapacity", asg.get("MinSize", 0))
+        asg.setdefault("MaxSize", max(asg.get("MinSize", 0), asg["DesiredCapacity"]))
+        asg.setdefault("MinSize", 0)
+        asgs.append(scheduler.getAsgData(asg))
+    return instances, asgs
+
+def weekArray(bitmap):
+    """
+    Convert compiled week bitmap to bool array indexed by minute of week
+
+    @param bitmap - int from compileSchedule
+    @return numpy bool array
+    """
+    raw = np.frombuffer(bitmap.to_bytes(minutesInWeek//8, "little"), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little").astype(bool)
+
+def knownZone(zone):
+    """
+    Check that zone is known IANA name - scheduler reports resources with unknown zone as wrong schedule
+
+    @param zone - zone name
+    @return boolean
+    """
+    from zoneinfo import ZoneInfo
+    try:
+        ZoneInfo(zone)
+    except (KeyError, ValueError):
+        return False
+    return True
+
+def scheduleIndex(resources, instances=False, zone=None):
+    """
+    Compile schedules of resources. Resources with manual config, wrong tags
+    and instances with run control or OFFPEAK get index -1 (scheduler doesn't touch them).
+
+    @param resources - list of records
+    @param instances - resources are instances
+    @param zone - default timezone of resources without RUN:TZ tag, None for local time
+    @return tuple (numpy int array resource -> schedule, dict (bitmap, zone) -> schedule)
+    """
+    schedules = {}
+    index = np.full(len(resources), -1, dtype=np.int32)
+    for i, resource in enumerate(resources):
+        if not scheduler.isTaged(resource):
+            continue
+        if instances and (scheduler.runControl(resource) or scheduler.offpeak(resource) is not False):
+            continue
+        try:
+            hoursTag = resource["RUN:HOURS"]
+            daysTag = resource["RUN:DAYS"]
+            if hoursTag.lower() == "manual" or daysTag.lower() == "manual":
+                continue
+            bitmap = scheduler.compileSchedule(hoursTag, daysTag)
+        except (KeyError, ValueError):
+            continue
+        resourceZone = resource.get("RUN:TZ") or zone
+        if resourceZone and not knownZone(resourceZone):
+            continue
+        index[i] = schedules.setdefault((bitmap, resourceZone), len(schedules))
+    return index, schedules
+
+def scheduleState(schedules, times):
+    """
+    Evaluate schedules in time steps. Schedules with zone are converted to UTC week by zoneSchedule
+    for each week of time range, same as isScheduled does in lambda.
+
+    @param schedules - dict (bitmap, zone) -> schedule from scheduleIndex
+    @param times - list of datetimes (local time of process)
+    @return numpy bool matrix schedule x time
+    """
+    state = np.zeros((max(1, len(schedules)), len(times)), dtype=bool)
+    localMinute = np.array([scheduler.minuteOfWeek(item) for item in times], dtype=np.int32)
+    utcWeeks = [scheduler.utcWeek(item) for item in times]
+    utcMinute = np.array([minute for weekStart, minute in utcWeeks], dtype=np.int32)
+    weekMasks = {}
+    for column, (weekStart, minute) in enumerate(utcWeeks):
+        weekMasks.setdefault(weekStart, np.zeros(len(times), dtype=bool))[column] = True
+    for (bitmap, zone), position in schedules.items():
+        if not zone:
+            state[position] = weekArray(bitmap)[localMinute]
+            continue
+        for weekStart, mask in weekMasks.items():
+            state[position, mask] = weekArray(scheduler.zoneSchedule(bitmap, zone, weekStart))[utcMinute[mask]]
+    return state
+
+def tagNumber(resource, key, default):
+    """
+    Return integer value of tag, None when value is not a number (scheduler skips such group)
+
+    @param resource - record
+    @param key - tag name
+    @param default - value without tag
+    @return int or None
+    """
+    try:
+        return int(resource.get(key, default))
+    except ValueError:
+        return None
+
+def scanMask(times):
+    """
+    Return bool array - time step is inside security scan window
+
+    @param times - list of datetimes
+    @return numpy bool array
+    """
+    windows = set()
+    for month in sorted(set((item.year, item.month) for item in times)):
+        windows.update(scheduler.getScanWindows(datetime(month[0], month[1], 1)))
+    mask = np.zeros(len(times), dtype=bool)
+    stamps = np.array([item.timestamp() for item in times])
+    for window in windows:
+        mask |= (stamps >= window.start.timestamp()) & (stamps < window.end.timestamp())
+    return mask
+
+def holdDuringScan(state, initial, inScan):
+    """
+    Keep last state from before security scan during scan window - scheduler
+    doesn't run normal decisions while scan is active
+
+    @param state - numpy bool matrix resources x time
+    @param initial - numpy bool array initial state of resources
+    @param inScan - numpy bool array from scanMask
+    @return numpy bool matrix
+    """
+    if not inScan.any():
+        return state
+    state = np.concatenate([initial[:, None], state], axis=1)
+    source = np.where(np.concatenate([[True], ~inScan]), np.arange(len(inScan) + 1), 0)
+    return state[:, np.maximum.accumulate(source)][:, 1:]
+
+def transitions(state, initial):
+    """
+    Return matrices of switch on and switch off steps
+
+    @param state - numpy bool matrix resources x time
+    @param initial - numpy bool array initial state of resources
+    @return tuple (on matrix, off matrix)
+    """
+    previous = np.concatenate([initial[:, None], state[:, :-1]], axis=1)
+    return state & ~previous, ~state & previous
+
+def simulate(snapshot, start, end, step=5, detail=False):
+    """
+    Replay scheduler decisions for snapshot between start and end with step in minutes
+
+    @param snapshot - dict with "instances" and "asgs" lists
+    @param start - datetime
+    @param end - datetime
+    @param step - step in minutes
+    @param detail - include resource IDs in timeline
+    @return dict with summary and timeline
+    """
+    times = []
+    current = start
+    while current < end:
+        times.append(current)
+        current += timedelta(minutes=step)
+    stepHours = step/60.0
+    zone = scheduler.accountZone(snapshot.get("account"))
+    inScan = scanMask(times)
+    instances, asgs = loadSnapshot(snapshot)
+    counters = {key: np.zeros(len(times), dtype=np.int64) for key in
+        ["start", "stop", "asgScaleUp", "asgScaleDown", "healthCheckResume", "healthCheckSuspend"]}
+    names = {key: {} for key in counters}
+    summary = {"instances": len(instances), "asgs": len(asgs), "steps": len(times),
+        "instanceHoursSaved": 0.0, "asgInstanceHoursSaved": 0.0}
+
+    def record(key, matrix, ids):
+        counters[key] += matrix.sum(axis=0)
+        if detail:
+            for row, column in zip(*np.nonzero(matrix)):
+                names[key].setdefault(int(column), []).append(ids[row])
+
+    # Instances - scheduled instances follow schedule, security scan starts everything.
+    # Hours are saved only by scheduled instances, other instances are not controlled by scheduler
+    index, schedules = scheduleIndex(instances, instances=True, zone=zone)
+    instanceSchedules = scheduleState(schedules, times)
+    for chunkStart in range(0, len(instances), resourceChunkSize):
+        chunk = instances[chunkStart:chunkStart+resourceChunkSize]
+        chunkIndex = index[chunkStart:chunkStart+resourceChunkSize]
+        scheduled = chunkIndex >= 0
+        initial = np.array([item["State"]["Name"] == "running" for item in chunk], dtype=bool)
+        state = np.where(scheduled[:, None], instanceSchedules[np.maximum(chunkIndex, 0)], initial[:, None])
+        state |= inScan[None, :]
+        on, off = transitions(state, initial)
+        ids = [item["InstanceId"] for item in chunk]
+        record("start", on, ids)
+        record("stop", off, ids)
+        summary["instanceHoursSaved"] += float((~state & scheduled[:, None]).sum()) * stepHours
+
+    # Autoscaling groups - OFFPEAK -1 switches HealthCheck, other OFFPEAK changes capacity,
+    # groups with wrong OFFPEAK or NUM_INST are skipped
+    index, schedules = scheduleIndex(asgs, zone=zone)
+    if asgs:
+        offpeakTags = [tagNumber(item, "OFFPEAK", -1) for item in asgs]
+        sizeTags = [tagNumber(item, "NUM_INST", 0) for item in asgs]
+        index = np.where([offpeak is not None and (offpeak == -1 or size is not None)
+            for offpeak, size in zip(offpeakTags, sizeTags)], index, -1)
+        active = scheduleState(schedules, times)[np.maximum(index, 0)] & (index >= 0)[:, None]
+        offpeakValue = np.array([-1 if offpeak is None else offpeak for offpeak in offpeakTags])
+        healthMode = (index >= 0) & (offpeakValue == -1)
+        scaleMode = (index >= 0) & (offpeakValue != -1)
+        suspended = np.array([any(process["ProcessName"] == "HealthCheck" for process in item["SuspendedProcesses"]) for item in asgs])
+        ids = [item["AutoScalingGroupName"] for item in asgs]
+        healthy = ~suspended | scaleMode
+        on, off = transitions(holdDuringScan(active, healthy, inScan), healthy)
+        record("healthCheckResume", on & healthMode[:, None], ids)
+        record("healthCheckSuspend", off & healthMode[:, None], ids)
+        fullSize = np.array([max(size or 0, item["DesiredCapacity"]) for item, size in zip(asgs, sizeTags)])
+        initialUp = np.array([item["MinSize"] > max(offpeak, 0) for item, offpeak in zip(asgs, offpeakValue)])
+        up = active | (inScan[None, :] & (np.array([item["MinSize"] for item in asgs]) == 0)[:, None])
+        on, off = transitions(up, initialUp)
+        record("asgScaleUp", on & scaleMode[:, None], ids)
+        record("asgScaleDown", off & scaleMode[:, None], ids)
+        saved = np.where(up, 0, fullSize[:, None] - np.maximum(offpeakValue, 0)[:, None])
+        summary["asgInstanceHoursSaved"] = float((saved * scaleMode[:, None]).clip(min=0).sum()) * stepHours
+
+    timeline = []
+    for column in np.nonzero(sum(counters.values()))[0]:
+        item = {"time": times[column].isoformat()}
+        item.update({key: int(value[column]) for key, value in counters.items() if value[column]})
+        if detail:
+            item["resources"] = {key: value[int(column)] for key, value in names.items() if int(column) in value}
+        timeline.append(item)
+    summary["actions"] = {key: int(value.sum()) for key, value in counters.items()}
+    return {"summary": summary, "timeline": timeline}
+
+def parseArgs(argv):
+    """
+    Parse command line arguments
+
+    @param argv - list of arguments
+    @return argparse namespace
+    """
+    parser = argparse.ArgumentParser(description="Offline EC2 Scheduler simulator")
+    parser.add_argument("snapshot", help="inventory snapshot JSON file")
+    parser.add_argument("--start", required=True, help="start time YYYY-MM-DDTHH:MM")
+    parser.add_argument("--end", required=True, help="end time YYYY-MM-DDTHH:MM")
+    parser.add_argument("--step", type=int, default=5, help="step in minutes (default 5)")
+    parser.add_argument("--detail", action="store_true", help="include resource IDs in timeline")
+    parser.add_argument("--output", help="write result to file instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    args = parseArgs(argv)
+    with open(args.snapshot) as snapshotFile:
+        snapshot = json.load(snapshotFile)
+    result = simulate(snapshot,
+        datetime.strptime(args.start, "%Y-%m-%dT%H:%M"),
+        datetime.strptime(args.end, "%Y-%m-%dT%H:%M"),
+        args.step, args.detail)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            outputFile.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
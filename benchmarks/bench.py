@@ -0,0 +1,138 @@
+"""
+Benchmark of lambda_handler against in-process fake AWS backend.
+
+For every fleet size records wall time, peak memory (tracemalloc) and API call counts
+per operation and compares them with baseline.json. Exit code is 1 on regression.
+
+Usage:
+    python benchmarks/bench.py [--sizes small,medium,large,sparse] [--update-baseline] [--tolerance 1.5] [--latency 0.05]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, "..", "EC2Scheduler"))
+baselineFile = os.path.join(benchDir, "baseline.json")
+
+# Scheduler configuration for benchmark - no security scan, rate limits above fake backend speed
+benchEnv = {
+    "secureScanDay": "1",
+    "secureScanStartTime": "0",
+    "secureScanDuration": "0",
+    "regions": "eu-central-1,us-east-1",
+    "describeRate": "100000",
+    "tagRate": "100000",
+    "mutateRate": "100000"
+}
+for key, value in benchEnv.items():
+    os.environ.setdefault(key, value)
+
+import EC2Scheduler as scheduler
+from fakeaws import FakeSession
+from fleet import buildFleet, fleetSizes
+
+# Fixed clock - monday 09:00, most schedules are active, night schedules are not
+benchTime = datetime(2026, 10, 19, 9, 0)
+
+def runScenario(name, latency=0):
+    """
+    Build fleet and run one lambda invocation against it
+
+    @param name - fleet size name from fleetSizes
+    @param latency - seconds added to every fake API call
+    @return dict with wallTime, peakMemory, apiCalls
+    """
+    session = FakeSession(os.environ["regions"].split(","), latency)
+    instances, asgs, scheduledShare = fleetSizes[name]
+    buildFleet(session, instances, asgs, scheduledShare=scheduledShare)
+    scheduler.sessionFactory = session
+    scheduler.clock = lambda: benchTime
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        sys.stdout = devnull
+        scheduler.lambda_handler({}, None)
+    finally:
+        sys.stdout = stdout
+        wallTime = time.perf_counter() - start
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        devnull.close()
+    return {
+        "instances": instances,
+        "asgs": asgs,
+        "wallTime": round(wallTime, 3),
+        "peakMemory": peakMemory,
+        "apiCalls": dict(sorted(session.calls().items()))
+    }
+
+def compare(name, result, baseline, tolerance):
+    """
+    Compare result with baseline of scenario
+
+    @param name - scenario name
+    @param result - dict from runScenario
+    @param baseline - dict from baseline.json or None
+    @param tolerance - allowed ratio for wall time and memory
+    @return list of regression messages
+    """
+    if not baseline:
+        return []
+    errors = []
+    if result["wallTime"] > baseline["wallTime"] * tolerance + 0.2:
+        errors.append("%s: wall time %.3fs > baseline %.3fs" % (name, result["wallTime"], baseline["wallTime"]))
+    if result["peakMemory"] > baseline["peakMemory"] * tolerance:
+        errors.append("%s: peak memory %d > baseline %d" % (name, result["peakMemory"], baseline["peakMemory"]))
+    for operation, count in result["apiCalls"].items():
+        if count > baseline["apiCalls"].get(operation, 0):
+            errors.append("%s: %s calls %d > baseline %d" % (name, operation, count, baseline["apiCalls"].get(operation, 0)))
+    return errors
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(description="EC2 Scheduler benchmark")
+    parser.add_argument("--sizes", default="small,medium,large,sparse", help="comma separated fleet sizes")
+    parser.add_argument("--update-baseline", action="store_true", help="store results as new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed ratio for wall time and memory")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every API call, results are not compared with baseline")
+    args = parser.parse_args(argv)
+    if args.latency and args.update_baseline:
+        parser.error("baseline can't be updated with --latency")
+
+    # Deferred imports are measured by coldstart.py, benchmark measures warm handler
+    scheduler.getClientConfig()
+    baseline = {}
+    if os.path.exists(baselineFile):
+        with open(baselineFile) as inputFile:
+            baseline = json.load(inputFile)
+    results = {}
+    errors = []
+    for name in args.sizes.split(","):
+        results[name] = runScenario(name, args.latency)
+        print("%-7s instances=%-6d asgs=%-5d wall=%.3fs peak=%.1fMB calls=%d" % (
+            name, results[name]["instances"], results[name]["asgs"], results[name]["wallTime"],
+            results[name]["peakMemory"] / 1024.0 / 1024.0, sum(results[name]["apiCalls"].values())))
+        if not args.latency:
+            errors += compare(name, results[name], baseline.get(name), args.tolerance)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(baselineFile, "w") as outputFile:
+            json.dump(baseline, outputFile, indent=2, sort_keys=True)
+        print("Baseline updated")
+        return 0
+    for error in errors:
+        print("REGRESSION %s" % (error))
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,74 @@
+"""
+Cold start measurement - module import time, first (cold) and second (warm) invocation latency.
+
+Every sample runs in fresh python process. Resources come from fake backend, but clients are
+also built by real boto3 session, so client creation cost is included in invocation latency.
+
+Usage:
+    python benchmarks/coldstart.py [--samples 5] [--module-dir EC2Scheduler]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+
+sampleScript = """
+import os, sys, time, json
+os.environ.update({"secureScanDay": "1", "secureScanStartTime": "0", "secureScanDuration": "0",
+    "regions": "eu-central-1,us-east-1", "AWS_ACCESS_KEY_ID": "bench", "AWS_SECRET_ACCESS_KEY": "bench",
+    "AWS_DEFAULT_REGION": "eu-central-1"})
+sys.path.insert(0, %(benchDir)r)
+from datetime import datetime
+start = time.perf_counter()
+sys.path.insert(0, %(moduleDir)r)
+import EC2Scheduler as scheduler
+imported = time.perf_counter()
+import boto3
+from fakeaws import FakeSession
+from fleet import buildFleet
+
+class CostlySession(FakeSession):
+    def __init__(self, regions):
+        FakeSession.__init__(self, regions)
+        self.real = boto3.session.Session()
+    def client(self, name, region_name=None, config=None, **kwargs):
+        self.real.client(name, region_name=region_name or "eu-central-1", config=config)
+        return FakeSession.client(self, name, region_name, config)
+
+session = CostlySession(["eu-central-1", "us-east-1"])
+buildFleet(session, 200, 20)
+scheduler.sessionFactory = session
+scheduler.clock = lambda: datetime(2026, 10, 19, 9, 0)
+devnull = open(os.devnull, "w")
+stdout, sys.stdout = sys.stdout, devnull
+times = []
+for i in range(2):
+    begin = time.perf_counter()
+    scheduler.lambda_handler({}, None)
+    times.append(time.perf_counter() - begin)
+sys.stdout = stdout
+print(json.dumps({"import": imported - start, "cold": times[0], "warm": times[1]}))
+"""
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(description="EC2 Scheduler cold start measurement")
+    parser.add_argument("--samples", type=int, default=5, help="number of fresh processes")
+    parser.add_argument("--module-dir", default=os.path.join(benchDir, "..", "EC2Scheduler"), help="directory with EC2Scheduler.py")
+    args = parser.parse_args(argv)
+    script = sampleScript % {"benchDir": benchDir, "moduleDir": os.path.abspath(args.module_dir)}
+    samples = []
+    for i in range(args.samples):
+        output = subprocess.check_output([sys.executable, "-c", script])
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+    for key in ("import", "cold", "warm"):
+        print("%-6s median %.1f ms" % (key, statistics.median(item[key] for item in samples) * 1000))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,530 @@
+"""
+In-process stand-in for EC2, Auto Scaling, STS and S3 (put_object) used by benchmarks.
+
+FakeSession mimics boto3 session - client(name, region_name, config) returns fake client
+with same method names and response shapes as boto3. Every region has its own
+FakeRegion with instances and autoscaling groups, all API calls are counted.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+instancePageSize = 1000
+asgPageSize = 50
+tagPageSize = 100
+# Simulated seconds until new group instance is in service - launch from AMI with bootstrap, resume of stopped instance
+launchSeconds = 720
+resumeSeconds = 60
+stateCodes = {"pending": 0, "running": 16, "shutting-down": 32, "terminated": 48, "stopping": 64, "stopped": 80}
+
+def clientError(code, operation):
+    """
+    Return botocore ClientError with error code
+
+    @param code - AWS error code
+    @param operation - API operation name
+    @return ClientError
+    """
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+def page(items, pageSize, token):
+    """
+    Return one page of items and next token
+
+    @param items - list
+    @param pageSize - int
+    @param token - NextToken from request or None
+    @return tuple (list, next token or None)
+    """
+    start = int(token or 0)
+    end = start + pageSize
+    return items[start:end], (str(end) if end < len(items) else None)
+
+class FakeRegion(object):
+    """
+    Resources of one region - instances by ID, reservations and autoscaling groups by name
+    """
+    def __init__(self, name):
+        self.name = name
+        self.instances = {}
+        self.reservations = []
+        self.asgs = {}
+        self.warmPools = {}
+        self.ready = {}
+        self.session = None
+        self.launched = 0
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.capacityUpdated = time.monotonic()
+
+    def addReservation(self, instances):
+        """
+        Add reservation with instances
+
+        @param instances - list of dicts (InstanceId, State name, Tags dict)
+        """
+        reservation = []
+        for instance in instances:
+            record = {
+                "InstanceId": instance["InstanceId"],
+                "State": {"Name": instance.get("State", "running"), "Code": stateCodes[instance.get("State", "running")]},
+                "Tags": [{"Key": key, "Value": value} for key, value in instance.get("Tags", {}).items()]
+            }
+            self.instances[record["InstanceId"]] = record
+            reservation.append(record["InstanceId"])
+        self.reservations.append({"ReservationId": "r-%08d" % len(self.reservations), "Instances": reservation})
+
+    def addAsg(self, name, minSize, desiredCapacity, maxSize, tags, suspended=(), withInstances=False):
+        """
+        Add autoscaling group
+
+        @param name - group name
+        @param minSize - int
+        @param desiredCapacity - int
+        @param maxSize - int
+        @param tags - dict
+        @param suspended - list of suspended process names
+        @param withInstances - group has EC2 instances, resize launches, terminates or moves them
+            to warm pool, new instances are Pending until simulated boot time passes (FakeSession.clock)
+        """
+        self.asgs[name] = {
+            "AutoScalingGroupName": name,
+            "MinSize": minSize,
+            "DesiredCapacity": desiredCapacity,
+            "MaxSize": maxSize,
+            "Instances": [],
+            "SuspendedProcesses": [{"ProcessName": item, "SuspensionReason": ""} for item in suspended],
+            "Tags": [{"ResourceId": name, "ResourceType": "auto-scaling-group", "Key": key, "Value": value,
+                "PropagateAtLaunch": False} for key, value in tags.items()]
+        }
+        if withInstances:
+            self.warmPools[name] = []
+            for index in range(desiredCapacity):
+                self.launch(name)
+
+    def launch(self, name):
+        """
+        Launch new running instance of autoscaling group, group tags with PropagateAtLaunch are copied to instance
+
+        @param name - group name
+        @return instance ID
+        """
+        self.launched += 1
+        instanceId = "i-%s-%04d" % (name, self.launched)
+        tags = dict((tag["Key"], tag["Value"]) for tag in self.asgs[name]["Tags"] if tag.get("PropagateAtLaunch"))
+        self.addReservation([{"InstanceId": instanceId, "State": "running", "Tags": dict(tags, **{"aws:autoscaling:groupName": name})}])
+        self.asgs[name]["Instances"].append({"InstanceId": instanceId, "LifecycleState": "InService", "HealthStatus": "Healthy"})
+        return instanceId
+
+    def setInstanceState(self, instanceId, state):
+        """
+        Set EC2 state of instance
+
+        @param instanceId - instance ID
+        @param state - state name from stateCodes
+        """
+        self.instances[instanceId]["State"] = {"Name": state, "Code": stateCodes[state]}
+
+    def resize(self, name):
+        """
+        Match in service instances of group with instance tracking to DesiredCapacity. New instances
+        come from warm pool (resumeSeconds) or are launched (launchSeconds), removed instances go
+        to warm pool with ReuseOnScaleIn (up to MaxGroupPreparedCapacity, default MaxSize) or are terminated.
+
+        @param name - group name
+        """
+        if name not in self.warmPools:
+            return
+        group = self.asgs[name]
+        pool = self.warmPools[name]
+        active = [item for item in group["Instances"] if item["LifecycleState"] in ("InService", "Pending")]
+        while len(active) < group["DesiredCapacity"]:
+            if pool:
+                instanceId = pool.pop(0)
+                self.setInstanceState(instanceId, "running")
+                group["Instances"].append({"InstanceId": instanceId, "LifecycleState": "InService", "HealthStatus": "Healthy"})
+                self.boot(group["Instances"][-1], resumeSeconds)
+            else:
+                self.launch(name)
+                self.boot(group["Instances"][-1], launchSeconds)
+            active.append(group["Instances"][-1])
+        warmPool = group.get("WarmPoolConfiguration", {})
+        poolSize = max(warmPool.get("MinSize", 0), warmPool.get("MaxGroupPreparedCapacity", group["MaxSize"]) - group["DesiredCapacity"])
+        while len(active) > group["DesiredCapacity"]:
+            item = active.pop()
+            group["Instances"].remove(item)
+            if warmPool.get("InstanceReusePolicy", {}).get("ReuseOnScaleIn") and len(pool) < poolSize:
+                pool.append(item["InstanceId"])
+                self.setInstanceState(item["InstanceId"], "stopped")
+            else:
+                self.setInstanceState(item["InstanceId"], "terminated")
+
+    def boot(self, item, seconds):
+        """
+        Keep new group instance Pending for simulated seconds of FakeSession.clock,
+        without clock instance is InService at once
+
+        @param item - instance of group Instances list
+        @param seconds - simulated boot time
+        """
+        if self.session is None or self.session.clock is None:
+            return
+        item["LifecycleState"] = "Pending"
+        self.ready[item["InstanceId"]] = self.session.clock() + timedelta(seconds=seconds)
+
+    def settle(self, group):
+        """
+        Move Pending instances of group which finished boot to InService
+
+        @param group - autoscaling group dict
+        """
+        for item in group["Instances"]:
+            if item["LifecycleState"] == "Pending" and self.ready.get(item["InstanceId"]) <= self.session.clock():
+                item["LifecycleState"] = "InService"
+                del self.ready[item["InstanceId"]]
+
+    def takeCapacity(self, count):
+        """
+        Take instance capacity for start, capacity refills with session capacityRefill per second
+
+        @param count - number of started instances
+        @return boolean - capacity was available
+        """
+        session = self.session
+        if session.startCapacity is None:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.capacity = min(session.startCapacity, getattr(self, "capacity", session.startCapacity)
+                + (now - self.capacityUpdated) * session.capacityRefill)
+            self.capacityUpdated = now
+            if self.capacity < count:
+                return False
+            self.capacity -= count
+            return True
+
+    def count(self, service, operation):
+        """
+        Count API call
+
+        @param service - ec2, autoscaling, sts
+        @param operation - boto3 method name
+        """
+        with self.lock:
+            key = "%s.%s" % (service, operation)
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+class FakeClient(object):
+    """
+    Base of fake clients - counts calls of public methods, every call waits session latency.
+    Operations in session deniedOperations ("ec2.start_instances" -> error code) fail for all items.
+    """
+    service = None
+
+    def __init__(self, region):
+        self.region = region
+
+    def __getattribute__(self, name):
+        attribute = object.__getattribute__(self, name)
+        if callable(attribute) and not name.startswith("_") and name[0].islower() and "_" in name:
+            region = object.__getattribute__(self, "region")
+            region.count(object.__getattribute__(self, "service"), name)
+            if region.session.latency:
+                time.sleep(region.session.latency)
+            code = region.session.deniedOperations.get("%s.%s" % (object.__getattribute__(self, "service"), name))
+            if code:
+                def denied(*args, **kwargs):
+                    raise clientError(code, name)
+                return denied
+        return attribute
+
+def matchInstance(instance, filters):
+    """
+    Check describe_instances filters (instance-state-name, tag-key, tag:<key>)
+
+    @param instance - instance record
+    @param filters - list of filters
+    @return boolean
+    """
+    tags = dict((tag["Key"], tag["Value"]) for tag in instance["Tags"])
+    for item in filters or []:
+        if item["Name"] == "instance-state-name":
+            if instance["State"]["Name"] not in item["Values"]:
+                return False
+        elif item["Name"] == "tag-key":
+            if not set(item["Values"]) & set(tags):
+                return False
+        elif item["Name"].startswith("tag:"):
+            if tags.get(item["Name"][4:]) not in item["Values"]:
+                return False
+        elif item["Name"] == "instance-id":
+            if instance["InstanceId"] not in item["Values"]:
+                return False
+    return True
+
+class FakeEc2Client(FakeClient):
+    """
+    Fake EC2 client
+    """
+    service = "ec2"
+
+    def describe_regions(self, **kwargs):
+        return {"Regions": [{"RegionName": name} for name in sorted(self.region.session.regions)]}
+
+    def describe_instances(self, Filters=None, InstanceIds=None, NextToken=None, **kwargs):
+        # NextToken is index of next reservation, page is full after instancePageSize instances
+        reservations, size = [], 0
+        index = int(NextToken or 0)
+        while index < len(self.region.reservations) and size < instancePageSize:
+            reservation = self.region.reservations[index]
+            index += 1
+            instances = [dict(self.region.instances[item]) for item in reservation["Instances"]
+                if matchInstance(self.region.instances[item], Filters)
+                and (not InstanceIds or item in InstanceIds)]
+            if instances:
+                reservations.append({"ReservationId": reservation["ReservationId"], "Instances": instances})
+                size += len(instances)
+        response = {"Reservations": reservations}
+        if index < len(self.region.reservations):
+            response["NextToken"] = str(index)
+        return response
+
+    def _setState(self, operation, InstanceIds, state, fromStates, DryRun=False):
+        changes = []
+        for instanceId in InstanceIds:
+            if instanceId not in self.region.instances:
+                raise clientError("InvalidInstanceID.NotFound", operation)
+            if self.region.instances[instanceId]["State"]["Name"] not in fromStates + [state]:
+                raise clientError("IncorrectInstanceState", operation)
+        if DryRun:
+            raise clientError("DryRunOperation", operation)
+        if state == "running" and not self.region.takeCapacity(len(InstanceIds)):
+            raise clientError("InsufficientInstanceCapacity", operation)
+        for instanceId in InstanceIds:
+            instance = self.region.instances[instanceId]
+            previous = dict(instance["State"])
+            instance["State"] = {"Name": state, "Code": stateCodes[state]}
+            changes.append({"InstanceId": instanceId, "PreviousState": previous, "CurrentState": instance["State"]})
+        return changes
+
+    def start_instances(self, InstanceIds, DryRun=False, **kwargs):
+        return {"StartingInstances": self._setState("StartInstances", InstanceIds, "running", ["stopped"], DryRun)}
+
+    def stop_instances(self, InstanceIds, DryRun=False, **kwargs):
+        return {"StoppingInstances": self._setState("StopInstances", InstanceIds, "stopped", ["running"], DryRun)}
+
+    def create_tags(self, Resources, Tags, DryRun=False, **kwargs):
+        for resource in Resources:
+            if resource not in self.region.instances:
+                raise clientError("InvalidInstanceID.NotFound", "CreateTags")
+        for resource in Resources:
+            tags = self.region.instances[resource]["Tags"]
+            for tag in Tags:
+                tags[:] = [item for item in tags if item["Key"] != tag["Key"]] + [dict(tag)]
+        return {}
+
+    def delete_tags(self, Resources, Tags, DryRun=False, **kwargs):
+        keys = set(tag["Key"] for tag in Tags)
+        for resource in Resources:
+            if resource in self.region.instances:
+                tags = self.region.instances[resource]["Tags"]
+                tags[:] = [item for item in tags if item["Key"] not in keys]
+        return {}
+
+class FakeAsgClient(FakeClient):
+    """
+    Fake Auto Scaling client
+    """
+    service = "autoscaling"
+
+    def _group(self, name, operation):
+        if name not in self.region.asgs:
+            raise clientError("ValidationError", operation)
+        return self.region.asgs[name]
+
+    def describe_auto_scaling_groups(self, AutoScalingGroupNames=None, NextToken=None, MaxRecords=None, Filters=None, **kwargs):
+        groups = [group for name, group in self.region.asgs.items()
+            if not AutoScalingGroupNames or name in AutoScalingGroupNames]
+        for item in Filters or []:
+            if item["Name"] == "tag-key":
+                groups = [group for group in groups if set(item["Values"]) & set(tag["Key"] for tag in group["Tags"])]
+        items, token = page(groups, MaxRecords or asgPageSize, NextToken)
+        for group in items:
+            self.region.settle(group)
+        response = {"AutoScalingGroups": [dict(group, Instances=[dict(item) for item in group["Instances"]]) for group in items]}
+        if token:
+            response["NextToken"] = token
+        return response
+
+    def describe_tags(self, Filters=None, NextToken=None, MaxRecords=None, **kwargs):
+        tags = [tag for group in self.region.asgs.values() for tag in group["Tags"]]
+        for item in Filters or []:
+            if item["Name"] == "auto-scaling-group":
+                tags = [tag for tag in tags if tag["ResourceId"] in item["Values"]]
+            elif item["Name"] == "key":
+                tags = [tag for tag in tags if tag["Key"] in item["Values"]]
+            elif item["Name"] == "value":
+                tags = [tag for tag in tags if tag["Value"] in item["Values"]]
+        items, token = page(tags, MaxRecords or tagPageSize, NextToken)
+        response = {"Tags": [dict(tag) for tag in items]}
+        if token:
+            response["NextToken"] = token
+        return response
+
+    def create_or_update_tags(self, Tags, **kwargs):
+        for tag in Tags:
+            self._group(tag["ResourceId"], "CreateOrUpdateTags")
+        for tag in Tags:
+            group = self.region.asgs[tag["ResourceId"]]
+            group["Tags"] = [item for item in group["Tags"] if item["Key"] != tag["Key"]] + [dict(tag)]
+        return {}
+
+    def delete_tags(self, Tags, **kwargs):
+        for tag in Tags:
+            group = self._group(tag["ResourceId"], "DeleteTags")
+            group["Tags"] = [item for item in group["Tags"] if item["Key"] != tag["Key"]]
+        return {}
+
+    def update_auto_scaling_group(self, AutoScalingGroupName, **kwargs):
+        group = self._group(AutoScalingGroupName, "UpdateAutoScalingGroup")
+        for key in ("MinSize", "MaxSize", "DesiredCapacity"):
+            if key in kwargs:
+                group[key] = kwargs[key]
+        group["MaxSize"] = max(group["MaxSize"], group["DesiredCapacity"])
+        self.region.resize(AutoScalingGroupName)
+        return {}
+
+    def put_warm_pool(self, AutoScalingGroupName, **kwargs):
+        group = self._group(AutoScalingGroupName, "PutWarmPool")
+        group["WarmPoolConfiguration"] = dict(kwargs, Status="Active")
+        return {}
+
+    def _standby(self, AutoScalingGroupName, InstanceIds, fromState, operation):
+        group = self._group(AutoScalingGroupName, operation)
+        items = dict((item["InstanceId"], item) for item in group["Instances"])
+        if len(InstanceIds) > 20 or any(items.get(instanceId, {}).get("LifecycleState") != fromState for instanceId in InstanceIds):
+            raise clientError("ValidationError", operation)
+        return group, [items[instanceId] for instanceId in InstanceIds]
+
+    def enter_standby(self, AutoScalingGroupName, InstanceIds, ShouldDecrementDesiredCapacity, **kwargs):
+        group, items = self._standby(AutoScalingGroupName, InstanceIds, "InService", "EnterStandby")
+        if ShouldDecrementDesiredCapacity and group["DesiredCapacity"] - len(items) < group["MinSize"]:
+            raise clientError("ValidationError", "EnterStandby")
+        for item in items:
+            item["LifecycleState"] = "Standby"
+        if ShouldDecrementDesiredCapacity:
+            group["DesiredCapacity"] -= len(items)
+        return {"Activities": []}
+
+    def exit_standby(self, AutoScalingGroupName, InstanceIds, **kwargs):
+        group, items = self._standby(AutoScalingGroupName, InstanceIds, "Standby", "ExitStandby")
+        if group["DesiredCapacity"] + len(items) > group["MaxSize"]:
+            raise clientError("ValidationError", "ExitStandby")
+        for item in items:
+            item["LifecycleState"] = "InService"
+            # Stopped instance fails health check and is replaced by new launch
+            running = self.region.instances[item["InstanceId"]]["State"]["Name"] == "running"
+            self.region.boot(item, resumeSeconds if running else launchSeconds)
+        group["DesiredCapacity"] += len(items)
+        return {"Activities": []}
+
+    def suspend_processes(self, AutoScalingGroupName, ScalingProcesses, **kwargs):
+        group = self._group(AutoScalingGroupName, "SuspendProcesses")
+        names = set(item["ProcessName"] for item in group["SuspendedProcesses"])
+        group["SuspendedProcesses"] = group["SuspendedProcesses"] + [
+            {"ProcessName": item, "SuspensionReason": ""} for item in ScalingProcesses if item not in names]
+        return {}
+
+    def resume_processes(self, AutoScalingGroupName, ScalingProcesses, **kwargs):
+        group = self._group(AutoScalingGroupName, "ResumeProcesses")
+        group["SuspendedProcesses"] = [item for item in group["SuspendedProcesses"] if item["ProcessName"] not in ScalingProcesses]
+        return {}
+
+class FakeStsClient(FakeClient):
+    """
+    Fake STS client - every role gets credentials valid for one hour
+    """
+    service = "sts"
+
+    def get_caller_identity(self, **kwargs):
+        return {"Account": self.region.session.account, "Arn": "arn:aws:iam::%s:role/EC2Scheduler" % (self.region.session.account)}
+
+    def assume_role(self, RoleArn, RoleSessionName, **kwargs):
+        if RoleArn in self.region.session.deniedRoles:
+            raise clientError("AccessDenied", "AssumeRole")
+        return {"Credentials": {
+            "AccessKeyId": "ASIA" + RoleArn.split(":")[4],
+            "SecretAccessKey": "secret",
+            "SessionToken": "token",
+            "Expiration": datetime.now(timezone.utc) + timedelta(hours=1)}}
+
+class FakeS3Client(FakeClient):
+    """
+    Fake S3 client - objects are kept in session
+    """
+    service = "s3"
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.region.session.objects[(Bucket, Key)] = Body
+        return {"ETag": "\"%x\"" % (hash(Body) & 0xffffffff)}
+
+class FakeSession(object):
+    """
+    boto3 session stand-in. Calling instance returns itself, so it can replace
+    EC2Scheduler.sessionFactory (also with credential arguments of assumed role).
+    With startCapacity, start_instances fails with InsufficientInstanceCapacity when region
+    has less free capacity than started instances (capacity refills by capacityRefill per second).
+    Accounts added by addAccount have own regions, other assumed roles share regions of this session.
+    With clock (callable returning simulated datetime), new autoscaling group instances are Pending
+    for launchSeconds or resumeSeconds of simulated time.
+    """
+    clients = {"ec2": FakeEc2Client, "autoscaling": FakeAsgClient, "sts": FakeStsClient, "s3": FakeS3Client}
+
+    def __init__(self, regions=("eu-central-1",), latency=0, startCapacity=None, capacityRefill=0):
+        self.latency = latency
+        self.startCapacity = startCapacity
+        self.capacityRefill = capacityRefill
+        self.regions = dict((name, FakeRegion(name)) for name in regions)
+        for region in self.regions.values():
+            region.session = self
+        self.clock = None
+        self.deniedRoles = set()
+        self.deniedOperations = {}
+        self.account = "123456789012"
+        self.accounts = {}
+        self.objects = {}
+
+    def __call__(self, aws_access_key_id=None, **kwargs):
+        # Access key of assumed role is "ASIA" + account ID (FakeStsClient.assume_role)
+        return self.accounts.get((aws_access_key_id or "")[4:], self)
+
+    def addAccount(self, account, latency=0):
+        """
+        Add account with own regions, session with credentials of role in account uses them
+
+        @param account - AWS account ID
+        @param latency - seconds added to every API call in account
+        @return FakeSession of account
+        """
+        session = FakeSession(list(self.regions), latency)
+        session.account = account
+        self.accounts[account] = session
+        return session
+
+    def client(self, name, region_name=None, config=None, **kwargs):
+        region = self.regions.get(region_name) or next(iter(self.regions.values()))
+        return self.clients[name](region)
+
+    def calls(self):
+        """
+        Return API call counters summed over regions
+
+        @return dict operation -> count
+        """
+        total = {}
+        for region in self.regions.values():
+            for key, value in region.calls.items():
+                total[key] = total.get(key, 0) + value
+        return total
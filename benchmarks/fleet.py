@@ -0,0 +1,65 @@
+"""
+Synthetic fleet generator for benchmarks - instances with mixed schedules in multi-instance
+reservations and autoscaling groups in all OFFPEAK modes.
+"""
+import random
+
+hoursValues = ["08:00-17:00", "06:00-01:00", "07:30-19:00", "00:00-24:00", "22:00-06:00", "manual"]
+daysValues = ["MON,TUE,WED,THU,FRI", "MON,TUE,WED,THU,FRI,SAT,SUN", "SAT,SUN", "MON,WED,FRI"]
+offpeakValues = ["-1", "0", "1", "2"]
+
+# name -> (instances, autoscaling groups, share of scheduled autoscaling groups)
+fleetSizes = {
+    "small": (1000, 100, 0.8),
+    "medium": (10000, 1000, 0.8),
+    "large": (50000, 1000, 0.8),
+    "sparse": (1000, 5000, 0.05)
+}
+
+def instanceTags(rng, index):
+    """
+    Return tags of synthetic instance - 10 % untagged, 5 % run control
+
+    @param rng - random.Random
+    @param index - instance number
+    @return dict
+    """
+    roll = rng.random()
+    if roll < 0.1:
+        return {"Name": "untagged-%d" % index}
+    tags = {"Name": "instance-%d" % index, "RUN:HOURS": rng.choice(hoursValues), "RUN:DAYS": rng.choice(daysValues)}
+    if roll < 0.15:
+        tags["RUN:CONTROL"] = "True"
+    return tags
+
+def buildFleet(session, instances, asgs, seed=42, scheduledShare=0.8):
+    """
+    Fill all regions of FakeSession with synthetic fleet, resources are split evenly between regions
+
+    @param session - fakeaws.FakeSession
+    @param instances - number of instances
+    @param asgs - number of autoscaling groups
+    @param seed - random seed, same seed gives same fleet
+    @param scheduledShare - share of autoscaling groups with scheduler tags
+    """
+    rng = random.Random(seed)
+    regions = list(session.regions.values())
+    created = 0
+    while created < instances:
+        region = regions[created % len(regions)]
+        size = min(rng.choice([1, 1, 1, 2, 4]), instances - created)
+        region.addReservation([{
+            "InstanceId": "i-%017x" % (created + offset),
+            "State": rng.choice(["running", "stopped"]),
+            "Tags": instanceTags(rng, created + offset)} for offset in range(size)])
+        created += size
+    for index in range(asgs):
+        region = regions[index % len(regions)]
+        tags = {"Name": "asg-%d" % index}
+        if rng.random() < scheduledShare:
+            tags.update({"RUN:HOURS": rng.choice(hoursValues), "RUN:DAYS": rng.choice(daysValues),
+                "OFFPEAK": rng.choice(offpeakValues)})
+        minSize = rng.choice([0, 1, 2, 4])
+        desired = max(minSize, rng.choice([1, 2, 4]))
+        suspended = ["HealthCheck"] if tags.get("OFFPEAK") == "-1" and rng.random() < 0.5 else []
+        region.addAsg("asg-%05d" % index, minSize, desired, max(desired, 8), tags, suspended)
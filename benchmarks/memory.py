@@ -0,0 +1,60 @@
+"""
+Memory of inventory records - bytes per resource of compact slotted records against plain dicts
+with same fields (format used before records and in cached inventory).
+
+Usage:
+    python benchmarks/memory.py [--count 50000]
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, "..", "EC2Scheduler"))
+os.environ.setdefault("secureScanDay", "1")
+os.environ.setdefault("secureScanStartTime", "0")
+os.environ.setdefault("secureScanDuration", "0")
+
+import EC2Scheduler as scheduler
+from fakeaws import FakeSession
+from fleet import buildFleet
+
+def measure(build):
+    """
+    Return traced memory allocated by build and kept by its result
+
+    @param build - function without arguments returning collection of records
+    @return tuple (bytes, number of records)
+    """
+    gc.collect()
+    tracemalloc.start()
+    records = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, len(records)
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(description="EC2 Scheduler record memory")
+    parser.add_argument("--count", type=int, default=50000, help="number of instances and asgs")
+    args = parser.parse_args(argv)
+    session = FakeSession(["eu-central-1"])
+    buildFleet(session, args.count, args.count)
+    region = session.regions["eu-central-1"]
+    instances = list(region.instances.values())
+    asgs = list(region.asgs.values())
+    scenarios = [
+        ("instance dict", lambda: [scheduler.getInstancetData(item).toDict() for item in instances]),
+        ("instance record", lambda: [scheduler.getInstancetData(item) for item in instances]),
+        ("asg dict", lambda: [scheduler.getAsgData(item).toDict() for item in asgs]),
+        ("asg record", lambda: [scheduler.getAsgData(item) for item in asgs])]
+    for name, build in scenarios:
+        size, count = measure(build)
+        print("%-16s count=%-7d total=%.1fMB per resource=%d B" % (name, count, size / 1024.0 / 1024.0, size // max(count, 1)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+"""
+Scale-up latency of autoscaling groups per OFFPEAK:MODE against fake AWS backend.
+
+Groups are scaled down to OFFPEAK in the evening and scaled up in the morning, then scheduler
+runs every --interval simulated minutes until it reports all scale-ups finished. Latency is
+measured by scheduler (SCALEUP tag until DesiredCapacity instances are InService), fake backend
+keeps new instances Pending while they launch or resume.
+
+Usage:
+    python benchmarks/warmpool.py [--groups 20] [--size 4] [--interval 1]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, "..", "EC2Scheduler"))
+os.environ.update({"secureScanDay": "1", "secureScanStartTime": "0", "secureScanDuration": "0",
+    "regions": "eu-central-1", "describeRate": "100000", "tagRate": "100000", "mutateRate": "100000"})
+
+import EC2Scheduler as scheduler
+from fakeaws import FakeSession
+
+# Monday evening scale down, tuesday morning scale up
+scaleDownTime = datetime(2026, 10, 19, 20, 0)
+scaleUpTime = datetime(2026, 10, 20, 8, 0)
+modes = ["scale", "warm-stopped", "warm-hibernated", "standby"]
+# Runs after scale up before unfinished scale-ups are reported
+maxRuns = 120
+
+def runMode(mode, groups, size, interval):
+    """
+    Scale groups with given OFFPEAK:MODE down and up again, run scheduler until scale-ups finish
+
+    @param mode - OFFPEAK:MODE tag value
+    @param groups - number of groups
+    @param size - DesiredCapacity of groups in schedule, OFFPEAK is 0
+    @param interval - minutes between scheduler runs after scale up
+    @return dict with scale-up seconds measured by scheduler (max, avg), finished groups, in service instances and apiCalls
+    """
+    session = FakeSession(["eu-central-1"])
+    region = session.regions["eu-central-1"]
+    for index in range(groups):
+        region.addAsg("asg-%03d" % index, size, size, size, {"RUN:HOURS": "08:00-17:00", "RUN:DAYS": "MON,TUE,WED,THU,FRI",
+            "OFFPEAK": "0", "OFFPEAK:MODE": mode}, withInstances=True)
+    current = [scaleDownTime]
+    session.clock = scheduler.clock = lambda: current[0]
+    scheduler.sessionFactory = session
+    scheduler.lambda_handler({}, None)
+    current[0] = scaleUpTime
+    measured = {}
+    for run in range(maxRuns):
+        result = scheduler.lambda_handler({}, None)["eu-central-1"]
+        measured.update(result.get("scaleUpSeconds") or {})
+        if run and not result.get("scaleUpsPending"):
+            break
+        current[0] += timedelta(minutes=interval)
+    inService = sum(1 for group in region.asgs.values() for item in group["Instances"] if item["LifecycleState"] == "InService")
+    return {
+        "scaleUpMax": max(measured.values() or [0]),
+        "scaleUpAvg": sum(measured.values()) / max(1, len(measured)),
+        "finished": len(measured),
+        "inService": inService,
+        "apiCalls": sum(session.calls().values())
+    }
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(description="EC2 Scheduler autoscaling group scale-up latency")
+    parser.add_argument("--groups", type=int, default=20, help="number of autoscaling groups")
+    parser.add_argument("--size", type=int, default=4, help="group size in schedule")
+    parser.add_argument("--interval", type=int, default=1, help="simulated minutes between scheduler runs")
+    args = parser.parse_args(argv)
+    for mode in modes:
+        devnull = open(os.devnull, "w")
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            result = runMode(mode, args.groups, args.size, args.interval)
+        finally:
+            sys.stdout = stdout
+            devnull.close()
+        print("%-16s scale-up max=%4ds avg=%6.1fs finished=%d/%d in-service=%-5d calls=%d" % (mode, result["scaleUpMax"],
+            result["scaleUpAvg"], result["finished"], args.groups, result["inService"], result["apiCalls"]))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -11,13 +11,14 @@ echo_usage() {
 
 install_requirements() {
     echo "Instaling required python packages"
-    pip3 install awscli boto3 cronex --user --upgrade 
+    pip3 install awscli boto3 --user --upgrade 
+    # Offline simulator (EC2Scheduler/simulator.py)
+    pip3 install numpy --user --upgrade
 }
 
 create_awslambda_package() {
     echo "Creating zip file for lambda"
     mkdir packages
-    pip3 install cronex --system --target packages
     cp EC2Scheduler/EC2Scheduler.py packages/lambda_function.py
     cd packages
     zip -r9 ../lambda_package.zip *
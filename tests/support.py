@@ -0,0 +1,55 @@
+"""
+Shared setup of tests - scheduler module with fake AWS backend from benchmarks/fakeaws.py.
+Rate limits are above fake backend speed and security scan is off.
+"""
+import os
+import sys
+import time
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, "..", "EC2Scheduler"))
+sys.path.insert(0, os.path.join(testDir, "..", "benchmarks"))
+testEnv = {
+    "secureScanDay": "1",
+    "secureScanStartTime": "0",
+    "secureScanDuration": "0",
+    "regions": "eu-central-1",
+    "describeRate": "100000",
+    "tagRate": "100000",
+    "mutateRate": "100000"
+}
+for key, value in testEnv.items():
+    os.environ.setdefault(key, value)
+# Run times of tests are local times of process, RUN:TZ tests expect UTC
+os.environ["TZ"] = "UTC"
+time.tzset()
+
+import EC2Scheduler as scheduler
+from fakeaws import FakeSession
+
+# Working hours of test resources, monday 09:00 is in schedule, monday 20:00 is not
+scheduleTags = {"RUN:HOURS": "08:00-17:00", "RUN:DAYS": "MON,TUE,WED,THU,FRI"}
+
+def addInstance(session, instanceId, state, tags=None, region="eu-central-1"):
+    """
+    Add single instance reservation to fake session
+
+    @param session - FakeSession
+    @param instanceId - instance ID
+    @param state - state name
+    @param tags - dict, default scheduleTags
+    @param region - region name
+    """
+    session.regions[region].addReservation([{"InstanceId": instanceId, "State": state,
+        "Tags": dict(scheduleTags if tags is None else tags)}])
+
+def instanceState(session, instanceId, region="eu-central-1"):
+    """
+    Return state name of fake instance
+
+    @param session - FakeSession
+    @param instanceId - instance ID
+    @param region - region name
+    @return string
+    """
+    return session.regions[region].instances[instanceId]["State"]["Name"]
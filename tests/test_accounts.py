@@ -0,0 +1,98 @@
+"""
+Cross-account scheduling against fake STS/EC2 - assumed roles, credential cache, failing and slow accounts
+"""
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from support import scheduler, FakeSession, addInstance, instanceState
+
+mondayMorning = datetime(2026, 10, 19, 9, 0)
+
+def roleArn(account):
+    return "arn:aws:iam::%s:role/EC2Scheduler" % (account)
+
+class AccountsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession(["eu-central-1"])
+        patcher = mock.patch.multiple(scheduler, sessionFactory=self.session, clock=lambda: mondayMorning)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def addAccount(self, account, latency=0):
+        accountSession = self.session.addAccount(account, latency)
+        addInstance(accountSession, "i-%s" % (account), "stopped")
+        return accountSession
+
+    def waitForThreads(self, seconds):
+        # Timed out accounts continue in background until they reach deadline check
+        time.sleep(seconds)
+
+    def testAccountsAreIsolated(self):
+        first = self.addAccount("111111111111")
+        second = self.addAccount("222222222222")
+        addInstance(self.session, "i-own", "stopped")
+        results = scheduler.lambda_handler({"roleArns": [roleArn("111111111111"), roleArn("222222222222")]}, None)
+        for account, accountSession in (("111111111111", first), ("222222222222", second)):
+            self.assertEqual(results[roleArn(account)]["status"], "ok")
+            self.assertEqual(results[roleArn(account)]["regions"]["eu-central-1"]["startEC2"], 1)
+            self.assertEqual(instanceState(accountSession, "i-%s" % (account)), "running")
+        self.assertEqual(instanceState(self.session, "i-own"), "stopped")
+
+    def testCredentialsAreCached(self):
+        self.addAccount("111111111111")
+        for i in range(2):
+            scheduler.lambda_handler({"roleArns": [roleArn("111111111111")]}, None)
+        self.assertEqual(self.session.calls()["sts.assume_role"], 1)
+
+    def testDeniedAccount(self):
+        allowed = self.addAccount("111111111111")
+        self.addAccount("222222222222")
+        self.session.deniedRoles.add(roleArn("222222222222"))
+        results = scheduler.lambda_handler({"roleArns": [roleArn("111111111111"), roleArn("222222222222")]}, None)
+        self.assertEqual(results[roleArn("111111111111")]["status"], "ok")
+        self.assertEqual(results[roleArn("222222222222")]["status"], "error")
+        self.assertIn("AccessDenied", results[roleArn("222222222222")]["error"])
+        self.assertEqual(instanceState(allowed, "i-111111111111"), "running")
+
+    def testTimedOutAccountMakesNoActions(self):
+        fast = self.addAccount("111111111111")
+        slow = self.addAccount("333333333333", latency=0.3)
+        with mock.patch.multiple(scheduler, accountTimeout=0.5):
+            results = scheduler.lambda_handler({"roleArns": [roleArn("111111111111"), roleArn("333333333333")]}, None)
+        self.assertEqual(results[roleArn("111111111111")]["status"], "ok")
+        self.assertEqual(results[roleArn("333333333333")]["status"], "timeout")
+        self.waitForThreads(3)
+        self.assertEqual(instanceState(fast, "i-111111111111"), "running")
+        self.assertEqual(instanceState(slow, "i-333333333333"), "stopped")
+        self.assertNotIn("ec2.start_instances", slow.calls())
+
+    def testQueuedAccountsAreCancelled(self):
+        accounts = ["44444444444%d" % (index) for index in range(3)]
+        sessions = [self.addAccount(account, latency=0.3) for account in accounts]
+        with mock.patch.multiple(scheduler, accountTimeout=0.5, accountConcurrency=1):
+            results = scheduler.lambda_handler({"roleArns": [roleArn(account) for account in accounts]}, None)
+        self.assertEqual([results[roleArn(account)]["status"] for account in accounts], ["timeout"] * 3)
+        self.waitForThreads(3)
+        for accountSession in sessions:
+            self.assertNotIn("ec2.start_instances", accountSession.calls())
+        # Only first account was started, queued accounts didn't call AWS
+        self.assertEqual(sum(1 for accountSession in sessions if accountSession.calls()), 1)
+
+class DeadlineTest(unittest.TestCase):
+
+    def testPassedDeadlineRefusesActions(self):
+        self.assertFalse(scheduler.Deadline(0).enter())
+
+    def testRegionInActionsIsWaitedFor(self):
+        deadline = scheduler.Deadline(60)
+        self.assertTrue(deadline.enter())
+        self.assertFalse(deadline.expire())
+        self.assertFalse(deadline.enter())
+        deadline.leave()
+        self.assertTrue(deadline.expire())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Start/stop execution - chunks are split only on errors of single instance
+"""
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from support import scheduler, FakeSession, addInstance, instanceState
+
+mondayMorning = datetime(2026, 10, 19, 9, 0)
+
+def clientError(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "StartInstances")
+
+class BisectCallTest(unittest.TestCase):
+
+    def testItemErrorIsIsolated(self):
+        calls = []
+        def function(items):
+            calls.append(items)
+            if "bad" in items:
+                raise clientError("IncorrectInstanceState")
+        failed = scheduler.bisectCall(function, ["a", "b", "bad", "c"], scheduler.instanceCodes)
+        self.assertEqual(failed, {"bad": "IncorrectInstanceState"})
+        self.assertEqual(len(calls), 5)
+
+    def testCallErrorFailsAllItems(self):
+        calls = []
+        def function(items):
+            calls.append(items)
+            raise clientError("UnauthorizedOperation")
+        failed = scheduler.bisectCall(function, ["a", "b", "c", "d"], scheduler.instanceCodes)
+        self.assertEqual(failed, dict((item, "UnauthorizedOperation") for item in "abcd"))
+        self.assertEqual(len(calls), 1)
+
+class DeniedActionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession(["eu-central-1"])
+        for index in range(1000):
+            addInstance(self.session, "i-%04d" % (index), "stopped")
+        self.session.deniedOperations["ec2.start_instances"] = "UnauthorizedOperation"
+        patcher = mock.patch.multiple(scheduler, sessionFactory=self.session, clock=lambda: mondayMorning)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testDeniedStartIsOneCallPerChunk(self):
+        result = scheduler.lambda_handler({}, None)["eu-central-1"]
+        self.assertEqual(len(result["actionFailures"]), 1000)
+        self.assertEqual(set(result["actionFailures"].values()), set(["UnauthorizedOperation"]))
+        self.assertEqual(self.session.calls()["ec2.start_instances"], 1000 // scheduler.actionChunkSize)
+        self.assertEqual(instanceState(self.session, "i-0000"), "stopped")
+
+    def testDeniedDryRunIsOneCallPerChunk(self):
+        result = scheduler.lambda_handler({"dryRun": True}, None)["eu-central-1"]
+        self.assertEqual(len(result["actionFailures"]), 1000)
+        self.assertEqual(self.session.calls()["ec2.start_instances"], 1000 // scheduler.actionChunkSize)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+API call layer - callAws is the only retry layer, botocore makes single attempt
+"""
+import unittest
+from unittest import mock
+
+from botocore.exceptions import EndpointConnectionError
+
+from support import scheduler
+import fakeaws
+
+class FailingClient(object):
+    """
+    Client failing first calls of describe_instances with given error
+    """
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def describe_instances(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"Reservations": []}
+
+class CallAwsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(scheduler.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        scheduler.metrics.reset()
+
+    def testBotocoreDoesNotRetry(self):
+        self.assertEqual(scheduler.getClientConfig().retries["max_attempts"], 1)
+
+    def testThrottledAndTransientErrorsAreRepeated(self):
+        client = FailingClient([fakeaws.clientError("Throttling", "DescribeInstances"),
+            fakeaws.clientError("InternalError", "DescribeInstances"), EndpointConnectionError(endpoint_url="https://ec2")])
+        self.assertEqual(scheduler.callAws(client, "describe_instances"), {"Reservations": []})
+        self.assertEqual(client.calls, 4)
+        api = scheduler.metrics.api["describe_instances"]
+        self.assertEqual((api["calls"], api["retries"], scheduler.metrics.throttles), (1, 3, 1))
+
+    def testAttemptsAreLimited(self):
+        client = FailingClient([fakeaws.clientError("Throttling", "DescribeInstances")] * 20)
+        with self.assertRaises(scheduler.ClientError):
+            scheduler.callAws(client, "describe_instances")
+        self.assertEqual(client.calls, scheduler.apiMaxAttempts)
+
+    def testOtherErrorsAreRaised(self):
+        client = FailingClient([fakeaws.clientError("UnauthorizedOperation", "DescribeInstances")])
+        with self.assertRaises(scheduler.ClientError):
+            scheduler.callAws(client, "describe_instances")
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(scheduler.metrics.api["describe_instances"]["errors"], {"UnauthorizedOperation": 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Long running daemon - next transitions from lambda results and choice of wake up time
+"""
+import os
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from support import scheduler
+
+# Daemon sets default stateStore in environment, keep environment of other tests unchanged
+with mock.patch.dict(os.environ):
+    import daemon
+
+now = datetime(2026, 10, 19, 9, 0)
+
+class NextTransitionsTest(unittest.TestCase):
+
+    def testRegions(self):
+        results = {"eu-central-1": {"nextTransition": "2026-10-19T17:00"}, "us-east-1": {"nextTransition": None}}
+        self.assertEqual(daemon.nextTransitions(results), [datetime(2026, 10, 19, 17, 0), None])
+
+    def testAccounts(self):
+        results = {
+            "arn:aws:iam::111111111111:role/EC2Scheduler": {"status": "ok", "regions": {
+                "eu-central-1": {"nextTransition": "2026-10-19T17:00"},
+                "us-east-1": {"startEC2": 1}}},
+            "arn:aws:iam::222222222222:role/EC2Scheduler": {"status": "error", "error": "AccessDenied"},
+            "arn:aws:iam::333333333333:role/EC2Scheduler": {"status": "ok", "regions": {
+                "eu-central-1": {"nextTransition": "2026-10-20T08:00"}}}}
+        self.assertEqual(daemon.nextTransitions(results),
+            [datetime(2026, 10, 19, 17, 0), None, None, datetime(2026, 10, 20, 8, 0)])
+
+    def testNoneResult(self):
+        self.assertEqual(daemon.nextTransitions({"eu-central-1": None}), [None])
+
+class WakeUpTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(scheduler, clock=lambda: now, reconcileInterval=60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.multiple(daemon, daemonRetry=30)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(daemon.time, "time", return_value=1000.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.daemon = daemon.Daemon()
+
+    def testReconcileInterval(self):
+        self.assertEqual(self.daemon.wakeUp([]), 1000 + 3600)
+        self.assertEqual(self.daemon.wakeUp([now + timedelta(hours=2)]), 1000 + 3600)
+
+    def testTransition(self):
+        self.assertEqual(self.daemon.wakeUp([now + timedelta(hours=8), now + timedelta(minutes=10)]), 1000 + 600)
+
+    def testPastTransitionRunsNow(self):
+        self.assertEqual(self.daemon.wakeUp([now - timedelta(minutes=5)]), 1000)
+
+    def testRetry(self):
+        self.assertEqual(self.daemon.wakeUp([now + timedelta(minutes=10), None]), 1000 + 30)
+        self.assertEqual(self.daemon.wakeUp([now + timedelta(seconds=10), None]), 1000 + 10)
+
+    def testFailedRunRetries(self):
+        with mock.patch.object(scheduler, "lambda_handler", side_effect=RuntimeError("no credentials")), \
+                mock.patch.object(scheduler.log, "flush"):
+            self.assertEqual(self.daemon.runOnce(), [None])
+
+if __name__ == "__main__":
+    unittest.main()
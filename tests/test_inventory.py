@@ -0,0 +1,63 @@
+"""
+Inventory collection - failed page fails the region instead of scheduling partial fleet
+"""
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from support import scheduler, FakeSession, addInstance, instanceState
+import fakeaws
+
+mondayMorning = datetime(2026, 10, 19, 9, 0)
+
+def failingPage(original, operation):
+    """
+    Return fake API method which fails on second and later pages
+
+    @param original - fake client method
+    @param operation - AWS operation name
+    @return function
+    """
+    def call(self, *args, **kwargs):
+        if kwargs.get("NextToken"):
+            raise fakeaws.clientError("UnauthorizedOperation", operation)
+        return original(self, *args, **kwargs)
+    return call
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession(["eu-central-1"])
+        patcher = mock.patch.multiple(scheduler, sessionFactory=self.session, clock=lambda: mondayMorning)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testAllPagesAreRead(self):
+        for index in range(2500):
+            addInstance(self.session, "i-%04d" % (index), "stopped")
+        result = scheduler.lambda_handler({}, None)["eu-central-1"]
+        self.assertEqual(result["instances"], 2500)
+        self.assertEqual(result["startEC2"], 2500)
+
+    def testFailedInstancePageFailsRegion(self):
+        for index in range(2500):
+            addInstance(self.session, "i-%04d" % (index), "stopped")
+        with mock.patch.object(fakeaws.FakeEc2Client, "describe_instances",
+                failingPage(fakeaws.FakeEc2Client.describe_instances, "DescribeInstances")):
+            result = scheduler.lambda_handler({}, None)["eu-central-1"]
+        self.assertIn("UnauthorizedOperation", result["error"])
+        self.assertNotIn("ec2.start_instances", self.session.calls())
+        self.assertEqual(instanceState(self.session, "i-0000"), "stopped")
+
+    def testFailedTagPageFailsRegion(self):
+        region = self.session.regions["eu-central-1"]
+        for index in range(150):
+            region.addAsg("asg-%03d" % (index), 0, 0, 2, {"RUN:HOURS": "08:00-17:00", "RUN:DAYS": "MON", "OFFPEAK": "0", "NUM_INST": "2"})
+        with mock.patch.object(fakeaws.FakeAsgClient, "describe_tags",
+                failingPage(fakeaws.FakeAsgClient.describe_tags, "DescribeTags")):
+            result = scheduler.lambda_handler({}, None)["eu-central-1"]
+        self.assertIn("UnauthorizedOperation", result["error"])
+        self.assertNotIn("autoscaling.update_auto_scaling_group", self.session.calls())
+
+if __name__ == "__main__":
+    unittest.main()
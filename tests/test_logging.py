@@ -0,0 +1,72 @@
+"""
+Buffered leveled log - level filtering, record counters, flush on full buffer and on failed invocation
+"""
+import io
+import json
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from support import scheduler, FakeSession
+
+class LogTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("sys.stdout", new_callable=io.StringIO)
+        self.stdout = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def records(self):
+        return [json.loads(line) for line in self.stdout.getvalue().splitlines()]
+
+    def testLevelFiltering(self):
+        log = scheduler.Log("INFO", 100)
+        log.debug("instance %s", "i-1")
+        log.info("instance %s", "i-2")
+        log.warning("instance %s", "i-3")
+        log.error("instance %s", "i-4")
+        self.assertEqual(self.stdout.getvalue(), "")
+        log.flush()
+        self.assertEqual([(record["level"], record["message"]) for record in self.records()],
+            [("INFO", "instance i-2"), ("WARNING", "instance i-3"), ("ERROR", "instance i-4")])
+        # Filtered records are counted for summary
+        self.assertEqual(log.counts, {"DEBUG": 1, "INFO": 1, "WARNING": 1, "ERROR": 1})
+        log.reset()
+        self.assertEqual(log.counts, {"DEBUG": 0, "INFO": 0, "WARNING": 0, "ERROR": 0})
+
+    def testDisabledLevelIsNotFormatted(self):
+        log = scheduler.Log("WARNING", 100)
+        argument = mock.MagicMock()
+        log.info("resource %s", argument)
+        argument.__str__.assert_not_called()
+        log.flush()
+        self.assertEqual(self.stdout.getvalue(), "")
+
+    def testDebugLevel(self):
+        log = scheduler.Log("DEBUG", 100)
+        log.debug("plan %d%%", 50)
+        log.flush()
+        self.assertEqual([record["message"] for record in self.records()], ["plan 50%"])
+
+    def testFullBufferIsWritten(self):
+        log = scheduler.Log("INFO", 3)
+        log.info("first")
+        log.write({"summary": 1})
+        self.assertEqual(self.stdout.getvalue(), "")
+        log.info("third")
+        self.assertEqual(len(self.records()), 3)
+        self.assertEqual(self.records()[1], {"summary": 1})
+        log.flush()
+        self.assertEqual(len(self.records()), 3)
+
+    def testFailedInvocationIsFlushed(self):
+        log = scheduler.Log("INFO", 100)
+        session = FakeSession(["eu-central-1"])
+        with mock.patch.multiple(scheduler, log=log, sessionFactory=session, clock=lambda: datetime(2026, 10, 19, 9, 0)), \
+                mock.patch.object(scheduler, "getRegions", side_effect=RuntimeError("no regions")):
+            self.assertRaises(RuntimeError, scheduler.lambda_handler, {}, None)
+        self.assertEqual(log.buffer, [])
+        self.assertTrue(self.records()[0]["message"].startswith("Running EC2 Scheduler"))
+
+if __name__ == "__main__":
+    unittest.main()
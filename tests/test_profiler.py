@@ -0,0 +1,73 @@
+"""
+On-demand profiling - modes and sink from "profile" and "profileSink" env variables
+"""
+import importlib.util
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from support import scheduler, FakeSession, addInstance
+
+def loadScheduler(**env):
+    """
+    Load separate copy of scheduler module, env variables are read when module is loaded
+
+    @param env - env variables
+    @return module
+    """
+    spec = importlib.util.spec_from_file_location("profiledScheduler", scheduler.__file__)
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ, env):
+        spec.loader.exec_module(module)
+    return module
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sink)
+        patcher = mock.patch("sys.stdout", new_callable=io.StringIO)
+        self.stdout = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def runHandler(self, module):
+        session = FakeSession(["eu-central-1"])
+        addInstance(session, "i-1", "stopped")
+        with mock.patch.multiple(module, sessionFactory=session, clock=lambda: datetime(2026, 10, 19, 9, 0)):
+            results = module.lambda_handler({}, None)
+        self.assertEqual(results["eu-central-1"]["startEC2"], 1)
+
+    def written(self):
+        return sorted(os.path.relpath(os.path.join(path, name), self.sink).split(os.sep, 1)[-1]
+            for path, directories, names in os.walk(self.sink) for name in names)
+
+    def testDisabledByDefault(self):
+        module = loadScheduler(profile="", profileSink="file://" + self.sink)
+        self.assertFalse(module.profiler.enabled)
+        self.runHandler(module)
+        self.assertEqual(self.written(), [])
+        self.assertNotIn("Profile written", self.stdout.getvalue())
+
+    def testEnabledModes(self):
+        module = loadScheduler(profile="cprofile, tracemalloc,spans", profileSink="file://" + self.sink, profileInterval="0.001")
+        self.assertTrue(module.profiler.enabled)
+        self.assertEqual(module.profiler.modes, frozenset(["cprofile", "tracemalloc", "spans"]))
+        self.runHandler(module)
+        self.assertEqual(self.written(), ["cprofile.pstats", "spans.txt", "tracemalloc.json"])
+        self.assertIn("Profile written to file://%s" % (self.sink), self.stdout.getvalue())
+
+    def testSingleMode(self):
+        module = loadScheduler(profile="cprofile", profileSink="file://" + self.sink)
+        self.runHandler(module)
+        self.assertEqual(self.written(), ["cprofile.pstats"])
+
+    def testWrongSettings(self):
+        self.assertRaises(ValueError, loadScheduler, profile="cprofile,heap")
+        self.assertRaises(ValueError, loadScheduler, profile="cprofile", profileSink="ftp://profiles")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Reconciler - resource with wrong tag is skipped, plan of other resources is kept
+"""
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from support import scheduler, FakeSession, scheduleTags
+
+mondayMorning = datetime(2026, 10, 19, 9, 0)
+
+def asgRecord(name, tags, minSize=0, desired=0):
+    return scheduler.getAsgData({"AutoScalingGroupName": name, "DesiredCapacity": desired, "MaxSize": 8, "MinSize": minSize,
+        "SuspendedProcesses": [], "Tags": [{"Key": key, "Value": value} for key, value in dict(scheduleTags, **tags).items()]})
+
+def instanceRecord(instanceId, state):
+    return scheduler.getInstancetData({"InstanceId": instanceId, "State": {"Name": state},
+        "Tags": [{"Key": key, "Value": value} for key, value in scheduleTags.items()]})
+
+def inventory(instances, asgs):
+    return scheduler.Inventory(dict((item["InstanceId"], item) for item in instances),
+        dict((item["AutoScalingGroupName"], item) for item in asgs))
+
+class WrongTagTest(unittest.TestCase):
+
+    def testWrongTagsSkipOnlyTheirGroup(self):
+        plan = scheduler.reconcile(inventory([instanceRecord("i-1", "stopped")], [
+            asgRecord("asg-offpeak", {"OFFPEAK": "two"}),
+            asgRecord("asg-size", {"OFFPEAK": "0", "NUM_INST": "four"}),
+            asgRecord("asg-ok", {"OFFPEAK": "0", "NUM_INST": "4"})]), mondayMorning, False)
+        self.assertEqual(plan.instances["i-1"]["action"], "start")
+        self.assertEqual(sorted(plan.asgs), ["asg-ok"])
+        self.assertEqual(plan.asgs["asg-ok"]["size"], 4)
+
+    def testWrongSizeOutOfScheduleIsSkipped(self):
+        evening = datetime(2026, 10, 19, 20, 0)
+        plan = scheduler.reconcile(inventory([], [asgRecord("asg-size", {"OFFPEAK": "0", "NUM_INST": "x"}, 2, 2)]), evening, False)
+        self.assertEqual(plan.asgs, {})
+
+    def testNegativeOffpeakScalesToZero(self):
+        evening = datetime(2026, 10, 19, 20, 0)
+        plan = scheduler.reconcile(inventory([], [asgRecord("asg", {"OFFPEAK": "-3"}, 2, 2)]), evening, False)
+        self.assertEqual(plan.asgs["asg"]["size"], 0)
+
+class StoredSizeTest(unittest.TestCase):
+
+    def testScanKeepsStoredSize(self):
+        session = FakeSession(["eu-central-1"])
+        region = session.regions["eu-central-1"]
+        region.addAsg("asg", 0, 0, 4, dict(scheduleTags, OFFPEAK="0", NUM_INST="3"))
+        group = region.asgs["asg"]
+        evening = datetime(2026, 10, 19, 20, 0)
+        with mock.patch.multiple(scheduler, sessionFactory=session, clock=lambda: evening):
+            with mock.patch.object(scheduler, "timeForSS", return_value=True):
+                scheduler.lambda_handler({}, None)
+            self.assertEqual(group["DesiredCapacity"], 1)
+            scheduler.lambda_handler({}, None)
+        self.assertEqual(group["DesiredCapacity"], 0)
+        self.assertIn({"Key": "NUM_INST", "Value": "3"}, [{"Key": tag["Key"], "Value": tag["Value"]} for tag in group["Tags"]])
+        with mock.patch.multiple(scheduler, sessionFactory=session, clock=lambda: mondayMorning):
+            scheduler.lambda_handler({}, None)
+        self.assertEqual((group["MinSize"], group["DesiredCapacity"]), (3, 3))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Compact inventory records - dict interface, compiled schedule and cache roundtrip
+"""
+import json
+import unittest
+
+from support import scheduler, scheduleTags
+
+class RecordTest(unittest.TestCase):
+
+    def instance(self, tags):
+        return scheduler.getInstancetData({"InstanceId": "i-1", "State": {"Code": 80, "Name": "stopped"},
+            "InstanceType": "t3.micro", "Tags": [{"Key": key, "Value": value} for key, value in tags.items()]})
+
+    def asg(self, tags, instances=()):
+        return scheduler.getAsgData({"AutoScalingGroupName": "asg-1", "DesiredCapacity": 0, "MaxSize": 3, "MinSize": 0,
+            "SuspendedProcesses": [{"ProcessName": "Launch", "SuspensionReason": "user"}], "LoadBalancerNames": [],
+            "Instances": [{"InstanceId": instanceId, "LifecycleState": "Standby"} for instanceId in instances],
+            "Tags": [{"Key": key, "Value": value, "PropagateAtLaunch": False} for key, value in tags.items()]})
+
+    def testInstanceDictInterface(self):
+        record = self.instance(dict(scheduleTags, Name="web", MANUAL="true"))
+        self.assertEqual(record["InstanceId"], "i-1")
+        self.assertEqual(record["State"]["Name"], "stopped")
+        self.assertEqual(record["RUN:HOURS"], "08:00-17:00")
+        self.assertEqual(record.get("MANUAL"), "true")
+        self.assertIsNone(record.get("OFFPEAK"))
+        self.assertEqual(record.get("Name", "-"), "-")
+        self.assertNotIn("Name", record)
+        self.assertNotIn("InstanceType", record)
+        self.assertRaises(KeyError, lambda: record["OFFPEAK"])
+        self.assertEqual(sorted(record.keys()), ["InstanceId", "MANUAL", "RUN:DAYS", "RUN:HOURS", "State"])
+        self.assertRaises(AttributeError, setattr, record, "Name", "web")
+
+    def testSchedule(self):
+        self.assertEqual(self.instance(scheduleTags).schedule, scheduler.compileSchedule(scheduleTags["RUN:HOURS"], scheduleTags["RUN:DAYS"]))
+        self.assertIsNone(self.instance({"RUN:HOURS": "08:00-17:00"}).schedule)
+        self.assertIsNone(self.instance(dict(scheduleTags, **{"RUN:HOURS": "8-"})).schedule)
+
+    def testInternedTags(self):
+        first = self.instance(dict(scheduleTags))
+        second = self.instance(dict((key, value[:1] + value[1:]) for key, value in scheduleTags.items()))
+        self.assertIs(first["RUN:DAYS"], second["RUN:DAYS"])
+
+    def testInstanceRoundtrip(self):
+        record = self.instance(dict(scheduleTags, OFFPEAK="1"))
+        cached = json.loads(json.dumps(record.toDict()))
+        self.assertEqual(cached, {"InstanceId": "i-1", "State": {"Name": "stopped"}, "OFFPEAK": "1",
+            "RUN:HOURS": "08:00-17:00", "RUN:DAYS": "MON,TUE,WED,THU,FRI"})
+        self.assertEqual(scheduler.InstanceRecord.fromDict(cached).toDict(), cached)
+
+    def testAsgRoundtrip(self):
+        record = self.asg(dict(scheduleTags, NUM_INST="3"))
+        self.assertEqual(record["SuspendedProcesses"], [{"ProcessName": "Launch"}])
+        self.assertNotIn("Instances", record)
+        cached = json.loads(json.dumps(record.toDict()))
+        self.assertEqual(cached["NUM_INST"], "3")
+        self.assertEqual(scheduler.AsgRecord.fromDict(cached).toDict(), cached)
+
+    def testStandbyAsgKeepsInstances(self):
+        record = self.asg(dict(scheduleTags, **{"OFFPEAK:MODE": "standby"}), ["i-1", "i-2"])
+        self.assertEqual(record["Instances"], [{"InstanceId": "i-1", "LifecycleState": "Standby"},
+            {"InstanceId": "i-2", "LifecycleState": "Standby"}])
+        cached = json.loads(json.dumps(record.toDict()))
+        self.assertEqual(scheduler.AsgRecord.fromDict(cached)["Instances"], record["Instances"])
+
+if __name__ == "__main__":
+    unittest.main()
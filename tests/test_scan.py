@@ -0,0 +1,61 @@
+"""
+Security scan windows - day in month or nth weekday, windows crossing day and month
+"""
+import unittest
+from datetime import date, datetime
+from unittest import mock
+
+from support import scheduler
+
+class ScanWindowTest(unittest.TestCase):
+
+    def settings(self, day, startTime, duration):
+        patcher = mock.patch.multiple(scheduler, secureScanDay=day, secureScanStartTime=str(startTime), secureScanDuration=str(duration))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        scheduler.getScanWindows.cache_clear()
+        self.addCleanup(scheduler.getScanWindows.cache_clear)
+
+    def testNthWeekday(self):
+        # October 2026 starts on thursday, November 2026 on sunday
+        self.assertEqual(scheduler.scanDay(2026, 10, "0#1"), date(2026, 10, 4))
+        self.assertEqual(scheduler.scanDay(2026, 11, "0#1"), date(2026, 11, 1))
+        self.assertEqual(scheduler.scanDay(2026, 10, "7#1"), date(2026, 10, 4))
+        self.assertEqual(scheduler.scanDay(2026, 10, "1#3"), date(2026, 10, 19))
+        self.assertEqual(scheduler.scanDay(2026, 10, "6#5"), date(2026, 10, 31))
+        self.assertIsNone(scheduler.scanDay(2026, 11, "6#5"))
+
+    def testMissingDayIsSkipped(self):
+        self.assertIsNone(scheduler.scanDay(2026, 4, "31"))
+        self.settings("31", 0, 2)
+        self.assertEqual([window.start for window in scheduler.getScanWindows(datetime(2026, 4, 15))],
+            [datetime(2026, 3, 31), datetime(2026, 5, 31)])
+
+    def testWrongDayIsRejected(self):
+        for value in ("8#1", "0#6", "0#0", "32", "0"):
+            self.assertRaises(ValueError, scheduler.scanDay, 2026, 10, value)
+
+    def testWindowCrossesDay(self):
+        self.settings("0#1", 22, 4)
+        self.assertIn(scheduler.ScanWindow(datetime(2026, 10, 4, 22), datetime(2026, 10, 5, 2)),
+            scheduler.getScanWindows(datetime(2026, 10, 5, 1)))
+        self.assertFalse(scheduler.timeForSS(datetime(2026, 10, 4, 21, 59)))
+        self.assertTrue(scheduler.timeForSS(datetime(2026, 10, 4, 22, 0)))
+        self.assertTrue(scheduler.timeForSS(datetime(2026, 10, 5, 1, 59)))
+        self.assertFalse(scheduler.timeForSS(datetime(2026, 10, 5, 2, 0)))
+
+    def testWindowCrossesMonth(self):
+        # Fifth saturday of October 2026 is 31st, window ends in November
+        self.settings("6#5", 20, 10)
+        self.assertTrue(scheduler.timeForSS(datetime(2026, 10, 31, 23, 0)))
+        self.assertTrue(scheduler.timeForSS(datetime(2026, 11, 1, 5, 59)))
+        self.assertFalse(scheduler.timeForSS(datetime(2026, 11, 1, 6, 0)))
+        self.assertFalse(scheduler.timeForSS(datetime(2026, 11, 28, 21, 0)))
+
+    def testZeroDurationDisablesScan(self):
+        self.settings("1", 0, 0)
+        self.assertEqual(scheduler.getScanWindows(datetime(2026, 10, 1, 1)), [])
+        self.assertFalse(scheduler.timeForSS(datetime(2026, 10, 1, 1)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Compiled schedules - RUN:HOURS/RUN:DAYS parsing and week bitmaps
+"""
+import unittest
+from datetime import datetime
+
+from support import scheduler
+
+dayMinutes = 24*60
+
+def minutes(bitmap, start, end):
+    """
+    Return bits of bitmap in minute range as list of 0/1
+    """
+    return [bitmap >> minute & 1 for minute in range(start, end)]
+
+class CompileHoursTest(unittest.TestCase):
+
+    def testEndAt2400IncludesLastMinute(self):
+        bitmap = scheduler.compileHours("08:00-24:00")
+        self.assertEqual(minutes(bitmap, 479, 481), [0, 1])
+        self.assertEqual(bitmap >> (dayMinutes - 1), 1)
+        self.assertEqual(scheduler.compileHours("00:00-24:00"), (1 << dayMinutes) - 1)
+
+    def testEndAt2359ExcludesLastMinute(self):
+        bitmap = scheduler.compileHours("22:00-23:59")
+        self.assertEqual(minutes(bitmap, dayMinutes - 2, dayMinutes), [1, 0])
+        self.assertEqual(bin(bitmap).count("1"), 119)
+
+    def testRangeOverMidnightWraps(self):
+        bitmap = scheduler.compileHours("22:00-02:00")
+        self.assertEqual(minutes(bitmap, 0, 2), [1, 1])
+        self.assertEqual(minutes(bitmap, 119, 121), [1, 0])
+        self.assertEqual(minutes(bitmap, 1319, 1321), [0, 1])
+        self.assertEqual(bin(bitmap).count("1"), 4*60)
+
+    def testWrongTimesAreRejected(self):
+        for value in ("24:00-08:00", "08:00-24:01", "08:60-17:00", "8-17", "08:00-25:00", ""):
+            self.assertRaises(ValueError, scheduler.compileHours, value)
+
+class CompileDaysTest(unittest.TestCase):
+
+    def testDayList(self):
+        self.assertEqual(scheduler.compileDays("MON,TUE"), 0b11)
+        self.assertEqual(scheduler.compileDays("[mon, sun]"), 0b1000001)
+        self.assertEqual(scheduler.compileDays("MON,TUE,WED,THU,FRI,SAT,SUN"), 0b1111111)
+
+    def testWrongDaysAreRejected(self):
+        for value in ("MONDAY", "XMON", "MON,FRIDAY", "MON;TUE"):
+            self.assertRaises(ValueError, scheduler.compileDays, value)
+
+class CompileScheduleTest(unittest.TestCase):
+
+    def testWeekBitmap(self):
+        bitmap = scheduler.compileSchedule("08:00-17:00", "MON,WED")
+        self.assertEqual(bin(bitmap).count("1"), 2*9*60)
+        monday = datetime(2026, 10, 19, 8, 0)
+        self.assertEqual(bitmap >> scheduler.minuteOfWeek(monday) & 1, 1)
+        self.assertEqual(bitmap >> scheduler.minuteOfWeek(datetime(2026, 10, 20, 8, 0)) & 1, 0)
+
+    def testWrappedHoursStayOnTheirDay(self):
+        # Hours after midnight belong to same RUN:DAYS day, as in original minute-of-day check
+        bitmap = scheduler.compileSchedule("22:00-02:00", "MON")
+        self.assertEqual(bitmap >> scheduler.minuteOfWeek(datetime(2026, 10, 19, 1, 0)) & 1, 1)
+        self.assertEqual(bitmap >> scheduler.minuteOfWeek(datetime(2026, 10, 19, 23, 0)) & 1, 1)
+        self.assertEqual(bitmap >> scheduler.minuteOfWeek(datetime(2026, 10, 20, 1, 0)) & 1, 0)
+
+    def testCachedResultMatchesFreshCompile(self):
+        for hours, days in (("08:00-17:00", "MON,TUE,WED,THU,FRI"), ("22:00-02:00", "SAT,SUN"), ("00:00-24:00", "MON")):
+            cached = scheduler.compileSchedule(hours, days)
+            self.assertIs(scheduler.compileSchedule(hours, days), cached)
+            fresh = scheduler.compileSchedule.__wrapped__(hours, days)
+            self.assertEqual(fresh, cached)
+            self.assertEqual(scheduler.compileHours.__wrapped__(hours), scheduler.compileHours(hours))
+            self.assertEqual(scheduler.compileDays.__wrapped__(days), scheduler.compileDays(days))
+
+    def testWrongTagsAreNotScheduled(self):
+        record = scheduler.getInstancetData({"InstanceId": "i-1", "State": {"Name": "stopped"},
+            "Tags": [{"Key": "RUN:HOURS", "Value": "08:00-17:00"}, {"Key": "RUN:DAYS", "Value": "MONDAY"}]})
+        self.assertIsNone(record.schedule)
+        self.assertIsNone(scheduler.isScheduled(record, datetime(2026, 10, 19, 9, 0)))
+
+if __name__ == "__main__":
+    unittest.main()
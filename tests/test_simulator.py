@@ -0,0 +1,40 @@
+"""
+Offline simulator - hours saved only by scheduled resources, tags parsed same way as in lambda
+"""
+import unittest
+from datetime import datetime
+
+from support import scheduler, scheduleTags
+import simulator
+
+monday = datetime(2026, 10, 19)
+nextMonday = datetime(2026, 10, 26)
+
+def instance(instanceId, tags, state="stopped"):
+    return {"InstanceId": instanceId, "State": state, "Tags": tags}
+
+class SimulatorTest(unittest.TestCase):
+
+    def testUncontrolledInstancesSaveNothing(self):
+        result = simulator.simulate({"instances": [instance("i-untagged", {"Name": "web"}),
+            instance("i-manual", dict(scheduleTags, **{"RUN:HOURS": "manual"}))]}, monday, nextMonday, step=60)
+        self.assertEqual(result["summary"]["instanceHoursSaved"], 0)
+        self.assertEqual(result["timeline"], [])
+
+    def testScheduledInstanceSavesHoursOutOfSchedule(self):
+        result = simulator.simulate({"instances": [instance("i-1", scheduleTags, "running")]}, monday, nextMonday, step=60)
+        # 5 working days of 9 hours in week of 168 hours
+        self.assertEqual(result["summary"]["instanceHoursSaved"], 168 - 5*9)
+        self.assertEqual((result["summary"]["actions"]["start"], result["summary"]["actions"]["stop"]), (5, 6))
+
+    def testOffpeakParsedAsInLambda(self):
+        snapshot = {"instances": [instance("i-%d" % (index), dict(scheduleTags, OFFPEAK=value))
+            for index, value in enumerate(["-01", " -1", "2", "x"])]}
+        instances = simulator.loadSnapshot(snapshot)[0]
+        index = simulator.scheduleIndex(instances, instances=True)[0]
+        lambdaControls = [scheduler.desiredInstance(item, monday, False)[0] is not None for item in instances]
+        self.assertEqual(list(index >= 0), lambdaControls)
+        self.assertEqual(lambdaControls, [True, True, False, False])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+"""
+Cached inventory - file/SQLite/memory stores, fingerprint, EventBridge updates and full scan failures
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from support import scheduler, FakeSession, addInstance, instanceState
+import fakeaws
+
+mondayMorning = datetime(2026, 10, 19, 9, 0)
+account = "123456789012"
+cacheKey = "inventory/%s/eu-central-1" % (account)
+
+def stateEvent(instanceId, state):
+    """
+    Return EventBridge instance state change event
+
+    @param instanceId - instance ID
+    @param state - new state name
+    @return dict
+    """
+    return {"source": "aws.ec2", "detail-type": "EC2 Instance State-change Notification", "account": account,
+        "region": "eu-central-1", "detail": {"instance-id": instanceId, "state": state}}
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def stores(self):
+        return [scheduler.FileStore(os.path.join(self.directory, "state.json")),
+            scheduler.SqliteStore(os.path.join(self.directory, "state.db")),
+            scheduler.MemoryStore("test")]
+
+    def testUpdateAndLoad(self):
+        for store in self.stores():
+            self.assertIsNone(store.load("key"))
+            self.assertEqual(store.update("key", lambda old: {"count": 1}), {"count": 1})
+            store.update("key", lambda old: dict(old, count=old["count"] + 1))
+            self.assertEqual(store.load("key"), {"count": 2})
+
+    def testNoneIsNotWritten(self):
+        for store in self.stores():
+            store.update("key", lambda old: {"count": 1})
+            self.assertIsNone(store.update("key", lambda old: None))
+            self.assertEqual(store.load("key"), {"count": 1})
+
+    def testValuesSurviveNewStore(self):
+        for storeType, path in (("file", "state.json"), ("sqlite", "state.db")):
+            scheduler.storeTypes[storeType](os.path.join(self.directory, path)).update("key", lambda old: [1, 2])
+            self.assertEqual(scheduler.storeTypes[storeType](os.path.join(self.directory, path)).load("key"), [1, 2])
+
+class MergeCacheTest(unittest.TestCase):
+
+    def cache(self, instances):
+        return {"version": scheduler.cacheVersion, "fingerprint": scheduler.inventoryFingerprint(instances, {}),
+            "instances": dict(instances), "asgs": {}}
+
+    def testFingerprintFollowsRecords(self):
+        cache = self.cache({"i-1": {"State": {"Name": "running"}}, "i-2": {"State": {"Name": "stopped"}}})
+        scheduler.mergeCache(cache, "instances", {"i-1": {"State": {"Name": "stopped"}}, "i-3": {"State": {"Name": "running"}}})
+        self.assertEqual(cache["fingerprint"], scheduler.inventoryFingerprint(cache["instances"], {}))
+        self.assertEqual(sorted(cache["instances"]), ["i-1", "i-2", "i-3"])
+
+    def testRemovedRecords(self):
+        cache = self.cache({"i-1": {"State": {"Name": "running"}}, "i-2": {"State": {"Name": "stopped"}}})
+        scheduler.mergeCache(cache, "instances", {"i-1": {"State": {"Name": "terminated"}}, "i-2": None})
+        self.assertEqual(cache["instances"], {})
+        self.assertEqual(cache["fingerprint"], scheduler.inventoryFingerprint({}, {}))
+
+    def testOtherVersionIsNotMerged(self):
+        cache = dict(self.cache({}), version=scheduler.cacheVersion - 1)
+        self.assertIsNone(scheduler.mergeCache(cache, "instances", {"i-1": {"State": {"Name": "running"}}}))
+
+class CachedRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.session = FakeSession(["eu-central-1"])
+        self.now = mondayMorning
+        patcher = mock.patch.multiple(scheduler, sessionFactory=self.session, clock=lambda: self.now,
+            stateStoreEnv="sqlite://%s" % (os.path.join(self.directory, "state.db")), stateStore={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handler(self, event=None):
+        return scheduler.lambda_handler(event or {}, None)
+
+    def scanAndPlan(self):
+        # First run makes full scan, second run evaluates cached inventory and stores plan
+        self.handler()
+        return self.handler()
+
+    def testFullScanIsCachedAndPlanSkipsRun(self):
+        addInstance(self.session, "i-1", "running")
+        self.assertEqual(self.scanAndPlan()["eu-central-1"]["nextTransition"], "2026-10-19T17:00")
+        cache = scheduler.getStore().load(cacheKey)
+        self.assertEqual(list(cache["instances"]), ["i-1"])
+        self.assertEqual(cache["plan"]["next"], "2026-10-19T17:00")
+        calls = self.session.calls()["ec2.describe_instances"]
+        self.assertEqual(calls, 1)
+        self.now = datetime(2026, 10, 19, 9, 5)
+        self.assertTrue(self.handler()["eu-central-1"]["skipped"])
+        self.assertEqual(self.session.calls()["ec2.describe_instances"], calls)
+
+    def testFailedScanIsNotCached(self):
+        for index in range(2500):
+            addInstance(self.session, "i-%04d" % (index), "running")
+        describe = fakeaws.FakeEc2Client.describe_instances
+        def failingPage(client, *args, **kwargs):
+            if kwargs.get("NextToken"):
+                raise fakeaws.clientError("UnauthorizedOperation", "DescribeInstances")
+            return describe(client, *args, **kwargs)
+        with mock.patch.object(fakeaws.FakeEc2Client, "describe_instances", failingPage):
+            self.assertIn("error", self.handler()["eu-central-1"])
+        self.assertIsNone(scheduler.getStore().load(cacheKey))
+        result = self.handler()["eu-central-1"]
+        self.assertEqual(result["instances"], 2500)
+        self.assertEqual(len(scheduler.getStore().load(cacheKey)["instances"]), 2500)
+
+    def testStateEventInvalidatesPlan(self):
+        addInstance(self.session, "i-1", "running")
+        self.scanAndPlan()
+        calls = self.session.calls()["ec2.describe_instances"]
+        # Instance stopped outside of scheduler
+        self.session.regions["eu-central-1"].setInstanceState("i-1", "stopped")
+        self.assertEqual(self.handler(stateEvent("i-1", "stopped")), {"status": "ok", "updated": 1})
+        cache = scheduler.getStore().load(cacheKey)
+        self.assertEqual(cache["instances"]["i-1"]["State"], {"Name": "stopped"})
+        self.assertNotEqual(cache["fingerprint"], cache["plan"]["fingerprint"])
+        self.now = datetime(2026, 10, 19, 9, 5)
+        self.assertEqual(self.handler()["eu-central-1"]["startEC2"], 1)
+        self.assertEqual(instanceState(self.session, "i-1"), "running")
+        # Cached inventory is used, only started instance is read again
+        self.assertEqual(self.session.calls()["ec2.describe_instances"], calls + 1)
+
+    def testUnknownInstanceIsDescribed(self):
+        addInstance(self.session, "i-1", "running")
+        self.handler()
+        addInstance(self.session, "i-2", "stopped")
+        self.handler(stateEvent("i-2", "stopped"))
+        cache = scheduler.getStore().load(cacheKey)
+        self.assertEqual(sorted(cache["instances"]), ["i-1", "i-2"])
+        self.assertEqual(cache["fingerprint"], scheduler.inventoryFingerprint(cache["instances"], cache["asgs"]))
+
+    def testUntaggedInstanceIsNotCached(self):
+        addInstance(self.session, "i-1", "running")
+        self.scanAndPlan()
+        fingerprint = scheduler.getStore().load(cacheKey)["fingerprint"]
+        addInstance(self.session, "i-2", "stopped", {"Name": "build"})
+        self.handler(stateEvent("i-2", "stopped"))
+        cache = scheduler.getStore().load(cacheKey)
+        self.assertEqual((list(cache["instances"]), cache["fingerprint"]), (["i-1"], fingerprint))
+        self.now = datetime(2026, 10, 19, 9, 5)
+        self.assertTrue(self.handler()["eu-central-1"]["skipped"])
+
+    def testInstanceWithoutSchedulerTagsIsRemoved(self):
+        addInstance(self.session, "i-1", "running")
+        self.handler()
+        self.handler({"source": "aws.tag", "detail-type": "Tag Change on Resource", "account": account, "region": "eu-central-1",
+            "resources": ["arn:aws:ec2:eu-central-1:%s:instance/i-1" % (account)],
+            "detail": {"service": "ec2", "resource-type": "instance", "tags": {"Name": "web"}}})
+        self.assertEqual(scheduler.getStore().load(cacheKey)["instances"], {})
+
+    def testTerminatedInstanceIsRemoved(self):
+        addInstance(self.session, "i-1", "running")
+        self.handler()
+        self.handler(stateEvent("i-1", "terminated"))
+        self.assertEqual(scheduler.getStore().load(cacheKey)["instances"], {})
+
+    def testDeferredInstanceKeepsRegionActive(self):
+        self.now = datetime(2026, 10, 19, 20, 0)
+        addInstance(self.session, "i-1", "pending")
+        self.scanAndPlan()
+        self.assertNotIn("plan", scheduler.getStore().load(cacheKey))
+        self.session.regions["eu-central-1"].setInstanceState("i-1", "running")
+        self.now = datetime(2026, 10, 19, 20, 2)
+        result = self.handler()["eu-central-1"]
+        self.assertEqual(result["deferred"], 1)
+        self.assertIsNone(result["nextTransition"])
+        self.now = datetime(2026, 10, 19, 20, 4)
+        self.assertEqual(self.handler()["eu-central-1"]["stopEC2"], 1)
+        self.assertEqual(instanceState(self.session, "i-1"), "stopped")
+
+    def testEventWithoutCacheIsIgnored(self):
+        self.assertEqual(self.handler(stateEvent("i-1", "stopped")), {"status": "ignored"})
+        with mock.patch.multiple(scheduler, stateStoreEnv=""):
+            self.assertEqual(self.handler(stateEvent("i-1", "stopped")), {"status": "ignored"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+Bulk tag writes - calls are split only on errors of single resource
+"""
+import unittest
+
+from support import scheduler, FakeSession
+
+class TagBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession(["eu-central-1"])
+        self.region = self.session.regions["eu-central-1"]
+        self.buffer = scheduler.TagBuffer(self.session.client("ec2", "eu-central-1"), self.session.client("autoscaling", "eu-central-1"))
+
+    def testDeniedTagsAreOneCallPerChunk(self):
+        self.session.deniedOperations["ec2.create_tags"] = "UnauthorizedOperation"
+        for index in range(1000):
+            self.buffer.addInstanceTag("i-%04d" % (index), "SecureScanState", "stopped")
+        failed = self.buffer.flush()
+        self.assertEqual(len(failed), 1000)
+        self.assertEqual(set(failed.values()), set(["UnauthorizedOperation"]))
+        self.assertEqual(self.session.calls()["ec2.create_tags"], 1)
+
+    def testMissingInstanceIsIsolated(self):
+        self.region.addReservation([{"InstanceId": "i-%04d" % (index), "State": "running", "Tags": {}} for index in range(8)])
+        for index in range(9):
+            self.buffer.addInstanceTag("i-%04d" % (index), "SecureScanState", "stopped")
+        self.assertEqual(self.buffer.flush(), {"i-0008": "InvalidInstanceID.NotFound"})
+        self.assertEqual(self.region.instances["i-0000"]["Tags"], [{"Key": "SecureScanState", "Value": "stopped"}])
+
+    def testMissingGroupIsIsolated(self):
+        for name in ("asg-1", "asg-2"):
+            self.region.addAsg(name, 0, 0, 1, {})
+        for name in ("asg-1", "asg-missing", "asg-2"):
+            self.buffer.addAsgTag(name, "NUM_INST", 2)
+        self.assertEqual(self.buffer.flush(), {"asg-missing": "ValidationError"})
+
+    def testDeniedGroupTagsAreOneCall(self):
+        self.session.deniedOperations["autoscaling.create_or_update_tags"] = "AccessDenied"
+        for index in range(40):
+            self.buffer.addAsgTag("asg-%d" % (index), "NUM_INST", 2)
+        self.assertEqual(len(self.buffer.flush()), 40)
+        self.assertEqual(self.session.calls()["autoscaling.create_or_update_tags"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
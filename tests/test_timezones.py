@@ -0,0 +1,86 @@
+"""
+Timezones of schedules - account timezone of own account and of assumed role accounts
+"""
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from support import scheduler, FakeSession, addInstance, instanceState, scheduleTags
+import simulator
+
+# Monday 01:00 UTC is 10:00 in Tokyo - in schedule 08:00-17:00
+mondayNight = datetime(2026, 10, 19, 1, 0)
+account = "123456789012"
+
+class AccountZoneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession(["eu-central-1"])
+        patcher = mock.patch.multiple(scheduler, sessionFactory=self.session, clock=lambda: mondayNight,
+            accountTimezones={account: "Asia/Tokyo"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testOwnAccountUsesAccountZone(self):
+        addInstance(self.session, "i-1", "stopped")
+        self.assertEqual(scheduler.lambda_handler({}, None)["eu-central-1"]["startEC2"], 1)
+        self.assertEqual(instanceState(self.session, "i-1"), "running")
+
+    def testRoleAccountUsesAccountZone(self):
+        addInstance(self.session.addAccount(account), "i-1", "stopped")
+        roleArn = "arn:aws:iam::%s:role/EC2Scheduler" % (account)
+        results = scheduler.lambda_handler({"roleArns": [roleArn]}, None)
+        self.assertEqual(results[roleArn]["regions"]["eu-central-1"]["startEC2"], 1)
+
+    def testOtherAccountUsesLocalTime(self):
+        addInstance(self.session, "i-1", "stopped")
+        with mock.patch.multiple(scheduler, accountTimezones={"210987654321": "Asia/Tokyo"}):
+            self.assertEqual(scheduler.lambda_handler({}, None)["eu-central-1"]["startEC2"], 0)
+
+class ZoneEnvTest(unittest.TestCase):
+
+    def testUnknownZoneIsRejected(self):
+        self.assertRaises(ValueError, scheduler.envZones, "timezone", ["Europe/Prgue"])
+
+    def testAccountZones(self):
+        with mock.patch.dict("os.environ", {"accountTimezones": "123456789012=Asia/Tokyo, 210987654321=UTC"}):
+            self.assertEqual(scheduler.envAccountZones("accountTimezones"), {"123456789012": "Asia/Tokyo", "210987654321": "UTC"})
+        for value in ("123456789012", "123456789012=Mars/Base", "account=UTC"):
+            with mock.patch.dict("os.environ", {"accountTimezones": value}):
+                self.assertRaises(ValueError, scheduler.envAccountZones, "accountTimezones")
+
+class SimulatorZoneTest(unittest.TestCase):
+
+    def snapshot(self):
+        instances = []
+        for index, zone in enumerate([None, "Asia/Tokyo", "Europe/Prague", "America/New_York", "Mars/Base"]):
+            tags = dict(scheduleTags, **({"RUN:TZ": zone} if zone else {}))
+            instances.append({"InstanceId": "i-%d" % (index), "State": "stopped", "Tags": tags})
+        return {"account": account, "instances": instances}
+
+    def testFollowsLambdaDecisions(self):
+        # Week with end of DST in Europe (october 25th), account zone for resources without RUN:TZ
+        start, end = datetime(2026, 10, 19), datetime(2026, 10, 27)
+        snapshot = self.snapshot()
+        with mock.patch.multiple(scheduler, accountTimezones={account: "Asia/Tokyo"}):
+            result = simulator.simulate(snapshot, start, end, step=30, detail=True)
+            instances = simulator.loadSnapshot(snapshot)[0]
+            expected = {}
+            previous = {item["InstanceId"]: False for item in instances}
+            now = start
+            while now < end:
+                for item in instances:
+                    running = scheduler.isScheduled(item, now, scheduler.accountZone(account))
+                    if running is not None and running != previous[item["InstanceId"]]:
+                        expected.setdefault(now.isoformat(), []).append(item["InstanceId"])
+                        previous[item["InstanceId"]] = running
+                now += timedelta(minutes=30)
+        actual = {}
+        for item in result["timeline"]:
+            for key in ("start", "stop"):
+                actual.setdefault(item["time"], []).extend(item["resources"].get(key, []))
+        self.assertEqual({key: sorted(value) for key, value in actual.items()}, {key: sorted(value) for key, value in expected.items()})
+        self.assertNotIn("i-4", sum(actual.values(), []))
+
+if __name__ == "__main__":
+    unittest.main()
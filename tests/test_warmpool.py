@@ -0,0 +1,102 @@
+"""
+OFFPEAK:MODE of autoscaling groups - warm pool keeps only capacity removed by scale down,
+scale-up latency is measured until instances are InService
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from support import scheduler, FakeSession, scheduleTags
+
+mondayEvening = datetime(2026, 10, 19, 20, 0)
+tuesdayMorning = datetime(2026, 10, 20, 9, 0)
+
+class WarmPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession(["eu-central-1"])
+        self.region = self.session.regions["eu-central-1"]
+        self.region.addAsg("asg-1", 4, 4, 8, dict(scheduleTags, **{"OFFPEAK": "1", "OFFPEAK:MODE": "warm-stopped"}),
+            withInstances=True)
+
+    def runAt(self, now):
+        with mock.patch.multiple(scheduler, sessionFactory=self.session, clock=lambda: now):
+            return scheduler.lambda_handler({}, None)["eu-central-1"]
+
+    def testPoolHoldsScaledDownInstances(self):
+        self.runAt(mondayEvening)
+        group = self.region.asgs["asg-1"]
+        self.assertEqual(group["WarmPoolConfiguration"]["MinSize"], 0)
+        self.assertEqual(group["WarmPoolConfiguration"]["MaxGroupPreparedCapacity"], 4)
+        self.assertEqual(group["DesiredCapacity"], 1)
+        self.assertEqual(len(self.region.warmPools["asg-1"]), 3)
+        self.runAt(tuesdayMorning)
+        self.assertEqual(group["DesiredCapacity"], 4)
+        self.assertEqual(self.region.warmPools["asg-1"], [])
+        self.assertEqual(self.region.launched, 4)
+
+class ScaleUpLatencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession(["eu-central-1"])
+        self.region = self.session.regions["eu-central-1"]
+        self.region.addAsg("asg-scale", 2, 2, 4, dict(scheduleTags, OFFPEAK="0"), withInstances=True)
+        self.region.addAsg("asg-warm", 2, 2, 4, dict(scheduleTags, **{"OFFPEAK": "0", "OFFPEAK:MODE": "warm-stopped"}),
+            withInstances=True)
+        self.now = mondayEvening
+        self.session.clock = lambda: self.now
+        patcher = mock.patch.multiple(scheduler, sessionFactory=self.session, clock=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def runUntilFinished(self):
+        self.assertEqual(scheduler.lambda_handler({}, None)["eu-central-1"]["asgScaleDown"], 2)
+        self.now = tuesdayMorning
+        self.assertEqual(scheduler.lambda_handler({}, None)["eu-central-1"]["asgScaleUp"], 2)
+        self.assertIn("SCALEUP", [tag["Key"] for tag in self.region.asgs["asg-scale"]["Tags"]])
+        measured = {}
+        for minutes in range(20):
+            self.now += timedelta(minutes=1)
+            result = scheduler.lambda_handler({}, None)["eu-central-1"]
+            measured.update(result["scaleUpSeconds"])
+            if not result["scaleUpsPending"]:
+                break
+        return measured
+
+    def testLatencyUntilInService(self):
+        metrics = scheduler.metrics
+        self.assertEqual(self.runUntilFinished(), {"asg-warm": 60, "asg-scale": 720})
+        self.assertEqual(metrics.emit()["scaleUpSeconds"], {"eu-central-1/asg-scale": 720})
+        for group in self.region.asgs.values():
+            self.assertNotIn("SCALEUP", [tag["Key"] for tag in group["Tags"]])
+
+    def testLatencyWithCachedInventory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.multiple(scheduler, stateStoreEnv="sqlite://%s" % (os.path.join(directory, "state.db")), stateStore={}):
+            self.assertEqual(self.runUntilFinished(), {"asg-warm": 60, "asg-scale": 720})
+
+    def testBookkeepingTagsAreNotPropagated(self):
+        self.runUntilFinished()
+        for group in self.region.asgs.values():
+            self.assertFalse([tag for tag in group["Tags"] if tag["Key"] in ("NUM_INST", "SCALEUP") and tag["PropagateAtLaunch"]])
+        launched = [item for item in self.region.instances.values() if item["State"]["Name"] == "running"]
+        self.assertEqual(len(launched), 4)
+        for item in launched:
+            self.assertFalse(set(tag["Key"] for tag in item["Tags"]) & set(["NUM_INST", "SCALEUP"]))
+
+    def testScaleDownCancelsMeasurement(self):
+        scheduler.lambda_handler({}, None)
+        self.now = tuesdayMorning
+        scheduler.lambda_handler({}, None)
+        self.now = mondayEvening + timedelta(days=1)
+        result = scheduler.lambda_handler({}, None)["eu-central-1"]
+        self.assertEqual((result["asgScaleDown"], result["scaleUpSeconds"]), (2, {}))
+        for group in self.region.asgs.values():
+            self.assertNotIn("SCALEUP", [tag["Key"] for tag in group["Tags"]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Staggered start - wave sizing by priority, capacity errors move whole start call to later wave
+"""
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from support import scheduler, FakeSession, addInstance, scheduleTags
+import fakeaws
+
+mondayMorning = datetime(2026, 10, 19, 9, 0)
+
+class WavesTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(scheduler, waveSize=10, waveDelay=0, waveRetries=2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def startWaves(self, session):
+        calls = []
+        original = fakeaws.FakeEc2Client.start_instances
+        def startInstances(client, InstanceIds, **kwargs):
+            calls.append(list(InstanceIds))
+            return original(client, InstanceIds, **kwargs)
+        with mock.patch.multiple(scheduler, sessionFactory=session, clock=lambda: mondayMorning), \
+                mock.patch.object(fakeaws.FakeEc2Client, "start_instances", startInstances):
+            return scheduler.lambda_handler({}, None)["eu-central-1"], calls
+
+    def testWavesFollowPriorityAndSize(self):
+        session = FakeSession(["eu-central-1"])
+        for index in range(25):
+            addInstance(session, "i-%02d" % (index), "stopped",
+                dict(scheduleTags, **({"RUN:PRIORITY": "1"} if index >= 20 else {})))
+        session.regions["eu-central-1"].addAsg("asg", 0, 0, 8, dict(scheduleTags, OFFPEAK="0", NUM_INST="4"))
+        result, calls = self.startWaves(session)
+        self.assertEqual(result["waves"]["waves"], 3)
+        self.assertTrue(set(["i-20", "i-21", "i-22", "i-23", "i-24"]) <= set(calls[0]))
+        # Third wave has 5 instances and group counted by its size 4
+        self.assertEqual([len(call) for call in calls], [10, 10, 5])
+        self.assertEqual(session.regions["eu-central-1"].asgs["asg"]["DesiredCapacity"], 4)
+
+    def testCapacityErrorRetriesWholeCall(self):
+        session = FakeSession(["eu-central-1"], startCapacity=10)
+        for index in range(30):
+            addInstance(session, "i-%02d" % (index), "stopped")
+        result, calls = self.startWaves(session)
+        # First wave fits capacity, two other waves fail as whole and are retried twice each
+        self.assertEqual(result["waves"], dict(result["waves"], waves=7, retried=40, failed=20))
+        self.assertEqual([len(call) for call in calls], [10] * 7)
+        self.assertEqual(set(result["actionFailures"].values()), set(["InsufficientInstanceCapacity"]))
+        self.assertEqual(len(result["actionFailures"]), 20)
+
+if __name__ == "__main__":
+    unittest.main()